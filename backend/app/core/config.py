@@ -25,6 +25,72 @@ class Settings(BaseSettings):
     # OpenAI settings
     OPENAI_API_KEY: str
 
+    # Files of one upload request that are uploaded, extracted and embedded concurrently
+    INGESTION_MAX_CONCURRENT_FILES: int = 4
+    # Background ingestion jobs: worker tasks, attempts per file and retry backoff
+    INGESTION_WORKERS: int = 4
+    INGESTION_MAX_ATTEMPTS: int = 5
+    INGESTION_RETRY_BASE_SECONDS: float = 30.0
+    # A running job whose worker stopped renewing it is picked up again after this long;
+    # workers renew it every third of this while the job runs
+    INGESTION_JOB_LEASE_SECONDS: float = 900.0
+    # How often due retries and abandoned jobs are looked for
+    INGESTION_POLL_SECONDS: float = 15.0
+
+    # PDF text extraction: worker processes, pages per parallel task and the limit per file
+    PDF_EXTRACTION_WORKERS: int = 2
+    PDF_EXTRACTION_PAGES_PER_TASK: int = 16
+    PDF_EXTRACTION_TIMEOUT_SECONDS: float = 120.0
+
+    # Token budget of user document chunks and the tokens carried over between neighbours
+    CHUNK_MAX_TOKENS: int = 650
+    CHUNK_OVERLAP_TOKENS: int = 50
+
+    # Model for new user uploads and CDA queries; existing indexes keep the model they were built with
+    EMBEDDING_MODEL: str = "text-embedding-3-small"
+    # Output size requested from text-embedding-3 models; every index must be built at this size
+    EMBEDDING_DIMENSIONS: int = 1536
+    # Chunks re-embedded per checkpoint when migrating user indexes to EMBEDDING_MODEL
+    EMBEDDING_MIGRATION_BATCH_SIZE: int = 256
+
+    # Embedding request batching across concurrent callers
+    EMBEDDING_BATCH_MAX_SIZE: int = 100
+    EMBEDDING_BATCH_MAX_WAIT_MS: float = 10.0
+
+    # Local content-addressed embedding cache; an empty path disables it
+    EMBEDDING_CACHE_PATH: str = ".cache/embeddings.sqlite3"
+    EMBEDDING_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024
+
+    # Retry queue for chunks whose embeddings failed at upload time
+    EMBEDDING_BACKFILL_INTERVAL_SECONDS: float = 60.0
+    EMBEDDING_BACKFILL_LEASE_SECONDS: float = 300.0
+    # Back-fill rounds before a file's remaining chunks are given up on, and the retry backoff
+    EMBEDDING_BACKFILL_MAX_ATTEMPTS: int = 8
+    EMBEDDING_BACKFILL_RETRY_BASE_SECONDS: float = 60.0
+
+    # User vector DB cache settings
+    USER_INDEX_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+    USER_INDEX_CACHE_MAX_ENTRIES: int = 64
+    USER_INDEX_CACHE_REVALIDATE_SECONDS: float = 5.0
+
+    # User vector DB storage settings
+    USER_INDEX_MAX_DELTA_SEGMENTS: int = 8
+    USER_INDEX_TOMBSTONE_COMPACTION_RATIO: float = 0.2
+    # Vector storage for user indexes: "flat" (float32), "fp16", or "sq8" (8-bit search re-ranked against fp16)
+    USER_INDEX_VECTOR_STORAGE: str = "flat"
+    USER_INDEX_RERANK_FACTOR: int = 4
+
+    # Chat retrieval: how long each source (CDA, user) may take, query embedding included,
+    # before the answer goes ahead without it
+    RETRIEVAL_SOURCE_TIMEOUT_SECONDS: float = 10.0
+    # Threads for blocking retrievals; a search that timed out holds its thread until it returns
+    RETRIEVAL_WORKERS: int = 8
+
+    # Answer generation: per-request timeout, SDK retries and pooled connections of the shared AsyncOpenAI client
+    LLM_TIMEOUT_SECONDS: float = 60.0
+    LLM_MAX_RETRIES: int = 2
+    LLM_MAX_CONNECTIONS: int = 100
+
     # Environment settings
     environment: str = "development"
     debug: bool = True
@@ -1,3 +1,4 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import users, auth, chatbot, organizations, users_drugs
@@ -18,4 +19,37 @@ app.include_router(users.router, prefix="/users", tags=["users"])
 app.include_router(chatbot.router, prefix="/chat", tags=["chat"])
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(organizations.router, prefix="/organizations", tags=["organizations"])
-app.include_router(users_drugs.router, prefix="/user-drugs", tags=["user-drugs"])
\ No newline at end of file
+app.include_router(users_drugs.router, prefix="/user-drugs", tags=["user-drugs"])
+
+
+@app.on_event("startup")
+async def start_embedding_backfill():
+    from app.services.vectorDBServices.embedding_backfill import EmbeddingBackfillService
+    app.state.embedding_backfill = asyncio.create_task(
+        EmbeddingBackfillService().run_forever(settings.EMBEDDING_BACKFILL_INTERVAL_SECONDS)
+    )
+
+
+@app.on_event("startup")
+async def start_ingestion_queue():
+    from app.services.ingestion_queue import ingestion_queue
+    await ingestion_queue.start()
+
+
+@app.on_event("shutdown")
+async def stop_embedding_backfill():
+    app.state.embedding_backfill.cancel()
+
+
+@app.on_event("shutdown")
+async def stop_ingestion_queue():
+    from app.services.ingestion_queue import ingestion_queue
+    from app.services.vectorDBServices.pdf_extraction import shutdown_executor
+    await ingestion_queue.stop()
+    shutdown_executor()
+
+
+@app.on_event("shutdown")
+async def stop_retrieval_executor():
+    from app.services.chatbot_service import shutdown_retrieval_executor
+    shutdown_retrieval_executor()
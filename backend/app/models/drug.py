@@ -1,6 +1,7 @@
 from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, Float, Date, Table
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from datetime import datetime, timezone
 from app.models.base import Base, TimestampMixin, PKMixin
 
 # Join table for many-to-many relationship between Organization and Drug
@@ -57,9 +58,24 @@ class DrugFile(Base):
     vector_ids = Column(JSON)  # Store vector database IDs for this file's chunks
     chunk_count = Column(Integer, default=0)  # Number of chunks created
     file_type = Column(String(50), default="pdf")
-    processing_status = Column(String(50), default="pending")  # pending, processing, completed, failed
+    processing_status = Column(String(50), default="pending")  # pending, processing, pending_embeddings, completed, failed
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Relationships
     drug = relationship("Drug", back_populates="files")
-    user = relationship("User")
\ No newline at end of file
+    user = relationship("User")
+
+class IngestionJob(Base, PKMixin, TimestampMixin):
+    """Extraction, embedding and indexing of one uploaded file, run by the background ingestion queue"""
+    __tablename__ = "ingestion_jobs"
+
+    drug_file_id = Column(Integer, ForeignKey("drug_files.id", ondelete="CASCADE"), nullable=False, unique=True, index=True)
+    drug_id = Column(Integer, ForeignKey("drugs.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    status = Column(String(50), nullable=False, default="queued")  # queued, running, succeeded, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    run_after = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))  # Earliest start of the next attempt
+    lease_expires_at = Column(DateTime(timezone=True))  # Renewed while running; an expired lease means the worker died
+
+    drug_file = relationship("DrugFile")
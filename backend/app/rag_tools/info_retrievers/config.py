@@ -1,7 +1,8 @@
 import os
+from app.core.config import settings
 
 # Directories
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-EMBEDDING_MODEL = "text-embedding-3-small"
-EMBEDDING_MODEL_DIM = 1536
\ No newline at end of file
+EMBEDDING_MODEL = settings.EMBEDDING_MODEL
+EMBEDDING_MODEL_DIM = settings.EMBEDDING_DIMENSIONS
\ No newline at end of file
@@ -1,11 +1,14 @@
 import json
+import mmap
 import os
 import pickle
+import threading
 import uuid
 import faiss
 import numpy as np
 from datetime import datetime
-from typing import List
+from collections.abc import Sequence
+from typing import List, Optional
 from openai import OpenAI
 from dotenv import load_dotenv
 load_dotenv()
@@ -13,9 +16,15 @@ load_dotenv()
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 from app.rag_tools.info_retrievers.config import (
-    BASE_DIR
+    BASE_DIR,
+    EMBEDDING_MODEL,
+    EMBEDDING_MODEL_DIM,
 )
 from azure.storage.blob import BlobServiceClient
+from azure.core.exceptions import ResourceNotFoundError
+
+from app.core.config import settings
+from app.services.vectorDBServices.user_index_cache import UserIndexCache
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
@@ -27,67 +36,261 @@ container_client = blob_service_client.get_container_client(os.getenv("AZURE_CON
 # so stick to 100 or less
 _global_cda_faiss_index = None
 _global_cda_metadata = None
+# Model the CDA vectors were embedded with, from the info blob published beside the index
+_global_cda_embedding_model = None
+
+# Per-user indexes, keyed by user_id; retrievers call in from executor threads, hence the lock
+_user_index_cache = UserIndexCache(
+    max_bytes=settings.USER_INDEX_CACHE_MAX_BYTES,
+    max_entries=settings.USER_INDEX_CACHE_MAX_ENTRIES,
+    revalidate_seconds=settings.USER_INDEX_CACHE_REVALIDATE_SECONDS,
+)
+_user_index_cache_lock = threading.Lock()
+
+
+class MappedMetadata(Sequence):
+    """
+    Read-only, memory-mapped view of a metadata list.
+
+    Records are stored as JSON lines in one file, with their byte offsets in a
+    .npy array. Both are mapped rather than read, so every worker process shares
+    the same page cache and a record is only parsed when it is indexed.
+    """
+
+    def __init__(self, data_path: str, offsets_path: str):
+        self._offsets = np.load(offsets_path, mmap_mode="r")
+        with open(data_path, "rb") as f:
+            # mmap cannot map an empty file
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return json.loads(self._data[int(self._offsets[idx]):int(self._offsets[idx + 1])])
+
+    @staticmethod
+    def write(records: List[dict], data_path: str, offsets_path: str):
+        """Write records in the mapped layout, replacing any existing files atomically"""
+        offsets = [0]
+        tmp_suffix = f".{uuid.uuid4().hex}.tmp"
+        with open(data_path + tmp_suffix, "wb") as f:
+            for record in records:
+                line = json.dumps(record, ensure_ascii=False, default=str).encode("utf-8") + b"\n"
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+        with open(offsets_path + tmp_suffix, "wb") as f:
+            np.save(f, np.array(offsets, dtype=np.int64))
+        # Data first, offsets last: _load_metadata keys its staleness check off the offsets file
+        os.replace(data_path + tmp_suffix, data_path)
+        os.replace(offsets_path + tmp_suffix, offsets_path)
+
+
+class MappedFlatIndex:
+    """
+    Exact search over flat-index vectors memory-mapped from a .npy file.
+
+    faiss 1.9 only maps the inverted lists of IVF indexes; a flat index read with
+    IO_FLAG_MMAP is still copied onto the heap. Its vectors are therefore kept in
+    a .npy opened with mmap_mode="r", which faiss.knn scans in place, so every
+    worker process shares the same page cache. Supports the part of the
+    faiss.Index interface the retrievers use: d, ntotal, metric_type and search().
+    """
+
+    def __init__(self, vectors_path: str, metric_type: int):
+        self.vectors = np.load(vectors_path, mmap_mode="r")
+        self.ntotal, self.d = self.vectors.shape
+        self.metric_type = metric_type
+
+    def search(self, x: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        return faiss.knn(x, self.vectors, k, metric=self.metric_type)
+
+    @staticmethod
+    def write(index: faiss.IndexFlat, vectors_path: str):
+        """Write a flat index's vectors in the mapped layout, replacing any existing file atomically"""
+        vectors = faiss.rev_swig_ptr(index.get_xb(), index.ntotal * index.d).reshape(index.ntotal, index.d)
+        tmp_path = f"{vectors_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, vectors)
+        os.replace(tmp_path, vectors_path)
+
+
+# Suffix of the mapped vectors of a flat index, per metric
+_MAPPED_VECTOR_SUFFIXES = {faiss.METRIC_L2: "l2.npy", faiss.METRIC_INNER_PRODUCT: "ip.npy"}
+
+
+def _mapped_metadata_paths(metadata_path: str) -> tuple[str, str]:
+    root, _ = os.path.splitext(metadata_path)
+    return f"{root}.jsonl", f"{root}.offsets.npy"
+
+
+def _mapped_vectors_path(index_path: str, metric_type: int) -> str:
+    root, _ = os.path.splitext(index_path)
+    return f"{root}.{_MAPPED_VECTOR_SUFFIXES[metric_type]}"
+
+
+def _load_index(index_path: str):
+    """
+    Open a FAISS index with its vectors shared through the page cache where possible.
+    Flat indexes are converted once into mapped vectors (see MappedFlatIndex), again
+    whenever the index file is newer; IVF indexes have their lists mapped by faiss.
+    """
+    index_mtime = os.path.getmtime(index_path)
+    for metric_type in _MAPPED_VECTOR_SUFFIXES:
+        vectors_path = _mapped_vectors_path(index_path, metric_type)
+        if os.path.exists(vectors_path) and os.path.getmtime(vectors_path) >= index_mtime:
+            return MappedFlatIndex(vectors_path, metric_type)
+
+    index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    if isinstance(index, faiss.IndexFlat) and index.metric_type in _MAPPED_VECTOR_SUFFIXES:
+        vectors_path = _mapped_vectors_path(index_path, index.metric_type)
+        MappedFlatIndex.write(index, vectors_path)
+        return MappedFlatIndex(vectors_path, index.metric_type)
+    return index
+
+
+def _load_metadata(metadata_path: str) -> MappedMetadata:
+    """Open the mapped form of a pickled metadata list, converting it once when the pickle is newer"""
+    data_path, offsets_path = _mapped_metadata_paths(metadata_path)
+    if not os.path.exists(offsets_path) or os.path.getmtime(offsets_path) < os.path.getmtime(metadata_path):
+        with open(metadata_path, "rb") as f:
+            records = pickle.load(f)
+        MappedMetadata.write(records, data_path, offsets_path)
+    return MappedMetadata(data_path, offsets_path)
 
-_global_user_faiss_index = None
-_global_user_metadata = None
+
+def _check_dimensions(index: faiss.Index, name: str):
+    """Refuse an index whose vectors are not the size queries are embedded at"""
+    if index.d != EMBEDDING_MODEL_DIM:
+        raise ValueError(
+            f"{name} holds {index.d}-d vectors but EMBEDDING_DIMENSIONS is {EMBEDDING_MODEL_DIM}; "
+            f"rebuild the index or change the setting"
+        )
 
 
 def download_blob(blob_name: str, download_path: str):
-    print("Getting blob client")
     blob_client = container_client.get_blob_client(blob_name)
-    print("Got blob client")
-    with open(download_path, "wb") as f:
-        print("DOWNLOADING")
+    # Download beside the target and swap it in, so other workers never open a partial file
+    tmp_path = f"{download_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
         f.write(blob_client.download_blob().readall())
+    os.replace(tmp_path, download_path)
 
 
 def blob_exists(blob_name: str) -> bool:
     return any(b.name == blob_name for b in container_client.list_blobs(name_starts_with=blob_name))
 
 
+def get_blob_etag(blob_name: str) -> Optional[str]:
+    try:
+        return container_client.get_blob_client(blob_name).get_blob_properties().etag
+    except ResourceNotFoundError:
+        return None
+
+
+def _load_index_info() -> dict:
+    """Model and size the preprocessing pipeline recorded for the unified index, if it published them"""
+    info_path = os.path.join(BASE_DIR, "unified_index_info.json")
+    try:
+        if blob_exists("unified_index_info.json"):
+            download_blob("unified_index_info.json", info_path)
+        with open(info_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def cda_embedding_model() -> str:
+    """Model CDA queries must be embedded with; EMBEDDING_MODEL for indexes published without an info blob"""
+    return _global_cda_embedding_model or EMBEDDING_MODEL
+
+
+def user_index_cache_stats() -> dict:
+    """Hit ratio, evictions and footprint of the per-user index cache"""
+    with _user_index_cache_lock:
+        return _user_index_cache.stats()
+
+
+def _load_user_embeddings(user_id: int):
+    """
+    Load a user's FAISS index and metadata through the per-user cache.
+
+    Entries are revalidated against the index blob's ETag once they are older than
+    USER_INDEX_CACHE_REVALIDATE_SECONDS, and refetched only when the blob changed.
+    """
+    index_filename = f"unified_{user_id}.index"
+    metadata_filename = f"unified_meta_{user_id}.pkl"
+
+    with _user_index_cache_lock:
+        cached = _user_index_cache.get(user_id)
+        if cached is not None and _user_index_cache.is_fresh(cached):
+            return cached.index, cached.metadata
+
+    if cached is not None:
+        if get_blob_etag(index_filename) == cached.etag:
+            with _user_index_cache_lock:
+                _user_index_cache.mark_validated(user_id)
+            return cached.index, cached.metadata
+        print(f"Vector DB for user {user_id} changed, reloading", flush=True)
+
+    try:
+        index_download = container_client.get_blob_client(index_filename).download_blob()
+        metadata_data = container_client.get_blob_client(metadata_filename).download_blob().readall()
+    except ResourceNotFoundError:
+        with _user_index_cache_lock:
+            _user_index_cache.invalidate(user_id)
+        raise FileNotFoundError(f"No blob files exist for {index_filename}/{metadata_filename}")
+
+    etag = index_download.properties.etag
+    faiss_index = faiss.deserialize_index(np.frombuffer(index_download.readall(), dtype=np.uint8))
+    _check_dimensions(faiss_index, index_filename)
+    metadata = pickle.loads(metadata_data)
+    print(f"Loaded {faiss_index.ntotal} vectors for user {user_id}.", flush=True)
+
+    with _user_index_cache_lock:
+        _user_index_cache.put(
+            user_id, faiss_index, metadata, etag,
+            nbytes=faiss_index.ntotal * faiss_index.d * 4 + len(metadata_data)
+        )
+    return faiss_index, metadata
+
+
 def load_embeddings(user_id: int = None):
     """
     Load FAISS index and metadata from local disk if available.
     If not found, download from Azure Blob Storage, then load.
+    With a user_id, loads that user's index through the per-user cache instead.
     Returns the FAISS index and metadata.
     """
-    global _global_cda_faiss_index, _global_cda_metadata
-    global _global_user_faiss_index, _global_user_metadata
+    global _global_cda_faiss_index, _global_cda_metadata, _global_cda_embedding_model
 
-    # CHECK IF ALREADY CACHED IN THE GLOBAL VARS
     if user_id:
-        if _global_user_faiss_index is not None and _global_user_metadata is not None:
-            print(f"Using cached in-memory FAISS index with {_global_user_faiss_index.ntotal} vectors.", flush=True)
-            return _global_user_faiss_index, _global_user_metadata
-    else:
-        if _global_cda_faiss_index is not None and _global_cda_metadata is not None:
-            print(f"Using cached in-memory FAISS index with {_global_cda_faiss_index.ntotal} vectors.", flush=True)
-            return _global_cda_faiss_index, _global_cda_metadata
+        return _load_user_embeddings(user_id)
+
+    # CHECK IF ALREADY CACHED IN THE GLOBAL VARS
+    if _global_cda_faiss_index is not None and _global_cda_metadata is not None:
+        print(f"Using cached in-memory FAISS index with {_global_cda_faiss_index.ntotal} vectors.", flush=True)
+        return _global_cda_faiss_index, _global_cda_metadata
 
     print("Loading FAISS index and metadata...", flush=True)
 
-    # SELECT THE CORRECT VECTORDB
-    if user_id:
-        print("USING USER'S VECTORDB")
-        index_filename = f"unified_{user_id}.index"
-        metadata_filename = f"unified_meta_{user_id}.pkl"
-        index_global_var = "_global_user_faiss_index"
-        meta_global_var = "_global_user_metadata"
-    else:
-        print("USING CDA VECTORDB")
-        index_filename = "unified.index"
-        metadata_filename = "unified_meta.pkl"
-        index_global_var = "_global_cda_faiss_index"
-        meta_global_var = "_global_cda_metadata"
+    # Prefer the ANN tier published by the preprocessing pipeline; it is built in the same order as the metadata
+    index_filename = "unified_ann.index" if blob_exists("unified_ann.index") else "unified.index"
+    metadata_filename = "unified_meta.pkl"
 
     index_path = os.path.join(BASE_DIR, index_filename)
     metadata_path = os.path.join(BASE_DIR, metadata_filename)
 
     # CHECK IF THE INDEX FILE EXISTS LOCALLY
     try:
-        faiss_index = faiss.read_index(index_path)
-        with open(metadata_path, "rb") as f:
-            metadata = pickle.load(f)
+        faiss_index = _load_index(index_path)
+        metadata = _load_metadata(metadata_path)
         print(f"Loaded {faiss_index.ntotal} vectors from local FAISS index.", flush=True)
     except Exception as e:
         print(f"Local files missing or corrupted ({e}), downloading from Azure...", flush=True)
@@ -100,24 +303,13 @@ def load_embeddings(user_id: int = None):
             raise FileNotFoundError(f"Neither local nor blob files exist for {index_filename}/{metadata_filename}")
 
         # LOAD AGAIN ONCE DOWNLOADED
-        faiss_index = faiss.read_index(index_path)
-        with open(metadata_path, "rb") as f:
-            metadata = pickle.load(f)
+        faiss_index = _load_index(index_path)
+        metadata = _load_metadata(metadata_path)
         print(f"Loaded {faiss_index.ntotal} vectors from downloaded FAISS index.", flush=True)
 
-    UNIFIED_INDEX_PATH = os.path.join(BASE_DIR, "unified.index")
-    UNIFIED_METADATA_PATH = os.path.join(BASE_DIR, "unified_meta.pkl")
-
-    # download_blob("unified.index", UNIFIED_INDEX_PATH)
-    # download_blob("unified_meta.pkl", UNIFIED_METADATA_PATH)
-
-    # Download blobs if they exist
-    print(blob_exists("unified.index"))
-    print(blob_exists("unified_meta.pkl"))
-    print(UNIFIED_INDEX_PATH)
-    print(UNIFIED_METADATA_PATH)
-    # CACHE TO THE CORRECT GLOBALS VIA GLOBAL VARS
-    globals()[index_global_var] = faiss_index
-    globals()[meta_global_var] = metadata
+    _check_dimensions(faiss_index, index_filename)
+    _global_cda_faiss_index = faiss_index
+    _global_cda_metadata = metadata
+    _global_cda_embedding_model = _load_index_info().get("embedding_model", EMBEDDING_MODEL)
 
     return faiss_index, metadata
\ No newline at end of file
@@ -9,7 +9,7 @@ IMPLEMENTED SOURCES:
 import os
 import faiss
 import numpy as np
-from typing import List, Optional
+from typing import Dict, List, Optional
 from .base_retriever import BaseRetriever, RetrievalResult
 from app.models.enums import DatabaseEnum
 
@@ -24,8 +24,9 @@ except ImportError:
     OpenAIEmbeddings = None
     LANGCHAIN_AVAILABLE = False
 
-from app.rag_tools.info_retrievers.utils import load_embeddings
-from app.rag_tools.info_retrievers.config import EMBEDDING_MODEL
+from app.rag_tools.info_retrievers.utils import cda_embedding_model, load_embeddings
+from app.rag_tools.info_retrievers.config import EMBEDDING_MODEL, EMBEDDING_MODEL_DIM
+from app.services.vectorDBServices.embedding_gateway import get_embedding_gateway
 
 try:
     from openai import OpenAI
@@ -50,26 +51,28 @@ class VectorDBRetriever(BaseRetriever):
         self._index_loaded = False
         self.source = source
 
-    def _ensure_index_loaded(self, user_id: int = None):
+    def _wrap_index(self, faiss_index):
+        """Return (vectorstore, index): a LangChain wrapper when available, else the raw FAISS index"""
+        if LANGCHAIN_AVAILABLE and FAISS is not None:
+            embeddings = OpenAIEmbeddings(model=self.embedding_model)
+            vectorstore = FAISS(
+                embedding_function=embeddings,
+                index=faiss_index,
+                docstore=None,
+                index_to_docstore_id=None
+            )
+            return vectorstore, None
+        return None, faiss_index
+
+    def _ensure_index_loaded(self):
+        """Load the shared CDA index once per retriever"""
         if self._index_loaded:
             return
         try:
-            if self.source == DatabaseEnum.USER_VECTORDB and user_id is not None:
-                faiss_index, metadata = load_embeddings(user_id)
-            else:
-                faiss_index, metadata = load_embeddings()
-
-            if LANGCHAIN_AVAILABLE and FAISS is not None:
-                embeddings = OpenAIEmbeddings(model=self.embedding_model)
-                self._vectorstore = FAISS(
-                    embedding_function=embeddings,
-                    index=faiss_index,
-                    docstore=None,
-                    index_to_docstore_id=None
-                )
-            else:
-                self._index = faiss_index
-
+            faiss_index, metadata = load_embeddings()
+            # Queries are embedded with whatever model the CDA index was built with
+            self.embedding_model = cda_embedding_model()
+            self._vectorstore, self._index = self._wrap_index(faiss_index)
             self._metadata = metadata
             self._index_loaded = True
 
@@ -77,19 +80,53 @@ class VectorDBRetriever(BaseRetriever):
             if LANGCHAIN_AVAILABLE:
                 self._vectorstore = None
             else:
-                self._index = faiss.IndexFlatL2(1536)
+                self._index = faiss.IndexFlatL2(EMBEDDING_MODEL_DIM)
             self._metadata = []
             self._index_loaded = True
 
-    def retrieve(self, query: str, user_id: int = None, top_k: int = 3) -> List[RetrievalResult]:
-        self._ensure_index_loaded(user_id)
+    def _load_user_index(self, user_id: int):
+        """
+        Per-call lookup of a user's index; load_embeddings caches it per user and
+        revalidates it, so nothing is latched on this shared retriever.
+        """
+        try:
+            faiss_index, metadata = load_embeddings(user_id)
+        except Exception:
+            return None, None, []
+        vectorstore, index = self._wrap_index(faiss_index)
+        return vectorstore, index, metadata
+
+    def query_embedding_model(self) -> str:
+        """Model this retriever embeds queries with"""
+        if self.source == DatabaseEnum.CDA_VECTORDB:
+            return cda_embedding_model()
+        return self.embedding_model
+
+    def retrieve(self, query: str, user_id: int = None, top_k: int = 3,
+                 query_embeddings: Optional[Dict[str, np.ndarray]] = None) -> List[RetrievalResult]:
+        """
+        query_embeddings maps embedding models to an already computed embedding of
+        query; the one for this retriever's model is used instead of embedding again.
+        """
+        if self.source == DatabaseEnum.USER_VECTORDB:
+            if user_id is None:
+                return []
+            vectorstore, index, metadata = self._load_user_index(user_id)
+        else:
+            self._ensure_index_loaded()
+            vectorstore, index, metadata = self._vectorstore, self._index, self._metadata
 
         if not query.strip():
             return []
 
+        query_embedding = (query_embeddings or {}).get(self.query_embedding_model())
+
         try:
-            if LANGCHAIN_AVAILABLE and self._vectorstore is not None:
-                docs_and_scores = self._vectorstore.similarity_search_with_score(query, k=top_k)
+            if LANGCHAIN_AVAILABLE and vectorstore is not None:
+                if query_embedding is not None:
+                    docs_and_scores = vectorstore.similarity_search_with_score_by_vector(query_embedding.tolist(), k=top_k)
+                else:
+                    docs_and_scores = vectorstore.similarity_search_with_score(query, k=top_k)
                 return [
                     RetrievalResult(
                         text=doc.page_content,
@@ -101,24 +138,25 @@ class VectorDBRetriever(BaseRetriever):
                     for rank, (doc, score) in enumerate(docs_and_scores)
                 ]
 
-            elif self._index is not None and self._index.ntotal > 0:
-                query_embedding = self._get_embedding(query)
+            elif index is not None and index.ntotal > 0:
+                if query_embedding is None:
+                    query_embedding = self._get_embedding(query)
                 if query_embedding is None:
                     return []
 
                 query_embedding = query_embedding.reshape(1, -1).astype(np.float32)
-                distances, indices = self._index.search(query_embedding, top_k)
+                distances, indices = index.search(query_embedding, top_k)
 
                 results = []
                 for rank, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-                    if idx >= 0 and idx < len(self._metadata):
-                        metadata = self._metadata[idx] if self._metadata else {}
-                        text = metadata.get('text',
-                                            metadata.get('content', metadata.get('page_content', str(metadata))))
+                    if idx >= 0 and idx < len(metadata):
+                        record = metadata[idx] if metadata else {}
+                        text = record.get('text',
+                                          record.get('content', record.get('page_content', str(record))))
                         results.append(
                             RetrievalResult(
                                 text=text,
-                                metadata=metadata,
+                                metadata=record,
                                 score=float(1.0 - distance),
                                 rank=rank + 1,
                                 database=f"{self.source}_VECTORDB"
@@ -134,15 +172,13 @@ class VectorDBRetriever(BaseRetriever):
             return []
 
     def _get_embedding(self, text: str) -> Optional[np.ndarray]:
+        """Query embedding, or None when it cannot be computed; retrieval then returns nothing"""
         if OpenAI is None or not os.getenv("OPENAI_API_KEY"):
-            return np.random.rand(1536).astype(np.float32)
+            return None
 
         try:
-            client = OpenAI()
-            response = client.embeddings.create(
-                model=self.embedding_model,
-                input=text.strip()
-            )
-            return np.array(response.data[0].embedding, dtype=np.float32)
-        except Exception:
-            return np.random.rand(1536).astype(np.float32)
+            embedding = get_embedding_gateway(self.embedding_model, EMBEDDING_MODEL_DIM).embed_blocking(text.strip())
+            return np.array(embedding, dtype=np.float32)
+        except Exception as e:
+            print(f"Error embedding query, skipping {self.source} retrieval: {e}")
+            return None
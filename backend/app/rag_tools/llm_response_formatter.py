@@ -1,11 +1,16 @@
 from __future__ import annotations
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional
 import os, textwrap, logging
-from openai import OpenAI    
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from app.core.config import settings
 logger = logging.getLogger(__name__)        
 
 MODEL = "gpt-4o-mini"   # TBD if this is the right model
 
+# Shared by every answer generated in this process; built on first use
+_async_client: Optional[AsyncOpenAI] = None
+
 SYSTEM_PROMPT = """
 You are a formal pharmaceutical market-access assistant in Canada.
 
@@ -38,37 +43,132 @@ PRICING_RATIO_MAP = {
     "Belgium": 0.82, "Sweden": 0.78, "Australia": 0.71, "France": 0.69,
 }
 
-def reformat(
+async def reformat(
     user_query: str,
     data_dict: Dict[str, Any],
     prediction: Optional[Dict[str, Any]] = None,
     *,
     client: Optional[Any] = None,
+    context: Optional[Any] = None,
     model: str = MODEL,
     temperature: float = 0.2,
     max_output_tokens: int = 700,
 ) -> str:
     """
     STEP-3: Given normalized retrieval + optional prediction, return the FINAL user-facing answer.
+    Awaits the model without blocking the event loop; client is an AsyncOpenAI client (the shared one by default).
     Expects data_dict keys from the normalizer:
         - query: str
         - jurisdiction: {"country": str|None, "province"?: str, "city"?: str}
         - snippets: List[{ "text": str, "score"?: float, "rank"?: int }]
+    context: the turn's QueryContext; its resolved jurisdiction takes precedence over data_dict's.
     """
     if not isinstance(user_query, str) or not user_query.strip():
         raise ValueError("user_query must be a non-empty string")
     if not isinstance(data_dict, dict):
         raise ValueError("data_dict must be a dict")
 
-    # Build OpenAI client
-    if client is None:
+    # Shared AsyncOpenAI client unless the caller brings one
+    client = client or get_async_client()
+
+    messages = _build_messages(user_query, data_dict, prediction, context)
+
+    # Model call
+    try:
+        resp = await client.chat.completions.create(
+            model=model,
+            temperature=temperature,
+            max_tokens=max_output_tokens,
+            messages=messages,
+        )
+    except Exception:
+        logger.exception("OpenAI chat.completions.create failed")
+        return ("Sorry, I’m unable to generate a response right now. "
+                "Please try again in a moment.")
+
+    # Basic response validation
+    choice = resp.choices[0] if getattr(resp, "choices", None) else None
+    text = getattr(getattr(choice, "message", None), "content", None)
+    if not text:
+        logger.error("OpenAI returned no content: %r", resp)
+        return ("Sorry, I couldn’t produce a response with the available context. "
+                "Please try again.")
+
+    text = text.strip()
+
+    print("FINAL RESULT", text)
+
+    return text
+
+async def reformat_stream(
+    user_query: str,
+    data_dict: Dict[str, Any],
+    prediction: Optional[Dict[str, Any]] = None,
+    *,
+    client: Optional[Any] = None,
+    context: Optional[Any] = None,
+    model: str = MODEL,
+    temperature: float = 0.2,
+    max_output_tokens: int = 700,
+) -> AsyncIterator[str]:
+    """
+    Streaming variant of reformat: yields the answer's text deltas as the model generates them.
+    Takes the same inputs; client is an AsyncOpenAI client (the shared one by default).
+    Errors propagate to the caller, which decides what to tell the user.
+    """
+    if not isinstance(user_query, str) or not user_query.strip():
+        raise ValueError("user_query must be a non-empty string")
+    if not isinstance(data_dict, dict):
+        raise ValueError("data_dict must be a dict")
+
+    client = client or get_async_client()
+    stream = await client.chat.completions.create(
+        model=model,
+        temperature=temperature,
+        max_tokens=max_output_tokens,
+        messages=_build_messages(user_query, data_dict, prediction, context),
+        stream=True,
+    )
+    async for chunk in stream:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            yield delta
+
+def get_async_client() -> AsyncOpenAI:
+    """
+    Process-wide AsyncOpenAI client, so concurrent answers share one connection pool.
+    Timeout, retries and pool size come from the LLM_* settings.
+    """
+    global _async_client
+    if _async_client is None:
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise RuntimeError("OPENAI_API_KEY is not set")
-        client = OpenAI(api_key=api_key)
+        _async_client = AsyncOpenAI(
+            api_key=api_key,
+            timeout=settings.LLM_TIMEOUT_SECONDS,
+            max_retries=settings.LLM_MAX_RETRIES,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=settings.LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.LLM_MAX_CONNECTIONS,
+                )
+            ),
+        )
+    return _async_client
+
+# ---- helper functions
 
+def _build_messages(
+    user_query: str,
+    data_dict: Dict[str, Any],
+    prediction: Optional[Dict[str, Any]],
+    context: Optional[Any],
+) -> List[Dict[str, str]]:
+    """System and user messages for the final answer, shared by reformat and reformat_stream."""
     # Compact prompt inputs (normalizer already capped/deduped)
-    jurisdiction = _format_jurisdiction(data_dict.get("jurisdiction") or {"country": "Canada"})
+    jur = getattr(context, "jurisdiction", None) or data_dict.get("jurisdiction")
+    jurisdiction = _format_jurisdiction(jur or {"country": "Canada"})
     snippets_block = _format_snippets(data_dict.get("snippets") or [])
     prediction_block = _format_prediction(prediction)
 
@@ -95,43 +195,17 @@ def reformat(
     print("USER BLOCK", user_block)
 
     # System message (append a targeted ratio section if a country is present)
-    country = (data_dict.get("jurisdiction") or {}).get("country")
+    country = (jur or {}).get("country")
     system_prompt = SYSTEM_PROMPT
     ratio_section = _ratio_prompt(country)
     if ratio_section:
         system_prompt = SYSTEM_PROMPT + "\n\n" + ratio_section
 
-    # Model call
-    try:
-        resp = client.chat.completions.create(
-            model=model,
-            temperature=temperature,
-            max_tokens=max_output_tokens,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_block},
-            ],
-        )
-    except Exception:
-        logger.exception("OpenAI chat.completions.create failed")
-        return ("Sorry, I’m unable to generate a response right now. "
-                "Please try again in a moment.")
-
-    # Basic response validation
-    choice = resp.choices[0] if getattr(resp, "choices", None) else None
-    text = getattr(getattr(choice, "message", None), "content", None)
-    if not text:
-        logger.error("OpenAI returned no content: %r", resp)
-        return ("Sorry, I couldn’t produce a response with the available context. "
-                "Please try again.")
-
-    text = text.strip()
-
-    print("FINAL RESULT", text)
-
-    return text
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_block},
+    ]
 
-# ---- helper functions
 
 def _ratio_prompt(country: Optional[str]) -> str:
     """Render a small ratio section for the detected country (and Canada=1.00)."""
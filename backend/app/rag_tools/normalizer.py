@@ -2,6 +2,7 @@ from typing import Any, Dict, List, Optional, Tuple
 from app.models.enums import IntentEnum
 import re
 from app.rag_tools.info_retrievers.base_retriever import RetrievalResult
+from app.rag_tools.query_context import QueryContext
 
 # Country aliases for jurisdiction context
 _COUNTRY_ALIASES = {
@@ -25,7 +26,8 @@ _COUNTRY_ALIASES = {
 
 def normalize_tool_responses(
     query: str, 
-    responses: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    responses: List[Dict[str, Any]],
+    context: Optional[QueryContext] = None) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
     """Normalize STEP-2 outputs into tuple of (data_dict, prediction) for the LLM response formatter.
     
     data_dict fields:
@@ -35,6 +37,9 @@ def normalize_tool_responses(
       }
       prediction = normalized price/timeline dict if provided by tools, else None
 
+    The jurisdiction is taken from context when it was already resolved this turn,
+    and stored on it otherwise.
+
     prediction (or None):
         - { "type": "price"|"timeline",
             "value": {...},        # e.g., {"range_cad":[lo,hi],"unit":"..."} OR {"milestones":[...]}
@@ -48,7 +53,12 @@ def normalize_tool_responses(
     MAX_SNIPPETS = 6
 
     # Jurisdiction from query, regex-first
-    jur = _fallback_jurisdiction(query)
+    if context is not None and context.jurisdiction is not None:
+        jur = context.jurisdiction
+    else:
+        jur = _fallback_jurisdiction(query)
+        if context is not None:
+            context.jurisdiction = jur
     print("JURISDICTION")
     print(jur)
 
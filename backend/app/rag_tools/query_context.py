@@ -0,0 +1,47 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.models.enums import IntentEnum
+from app.rag_tools.classifiers.intent_classifier import intent_classifier
+from app.services.vectorDBServices.embedding_gateway import get_embedding_gateway
+
+
+@dataclass
+class QueryContext:
+    """
+    Everything derived from the user's query during one chat turn.
+
+    Created once per send_message and passed through call_tools,
+    normalize_tool_responses and reformat, so the query is embedded at most
+    once per embedding model and intent and jurisdiction are resolved once,
+    however many tools use them.
+    """
+    query: str
+    user_id: Optional[int] = None
+    embeddings: Dict[str, np.ndarray] = field(default_factory=dict)
+    intents: Optional[List[IntentEnum]] = None
+    jurisdiction: Optional[Dict[str, Optional[str]]] = None
+
+    async def embed(self, models: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Embeddings of the query for models, computing only the missing ones; models that fail are left out"""
+        missing = sorted(set(models) - set(self.embeddings))
+        vectors = await asyncio.gather(
+            *[get_embedding_gateway(model, settings.EMBEDDING_DIMENSIONS).embed(self.query.strip()) for model in missing],
+            return_exceptions=True
+        )
+        for model, vector in zip(missing, vectors):
+            if isinstance(vector, Exception):
+                print(f"Error embedding query with {model}: {vector}")
+                continue
+            self.embeddings[model] = np.array(vector, dtype=np.float32)
+        return {model: self.embeddings[model] for model in models if model in self.embeddings}
+
+    async def classify_intents(self) -> List[IntentEnum]:
+        """Intents of the query; the classifier is a blocking API call, so it runs in a worker thread"""
+        if self.intents is None:
+            self.intents = await asyncio.to_thread(intent_classifier, self.query)
+        return self.intents
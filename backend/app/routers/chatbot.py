@@ -1,5 +1,7 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends, Header
+from fastapi.responses import StreamingResponse
 from typing import List
+import json
 from app.services.chatbot_service import ChatbotService
 from app.services.auth_service import AuthService
 from app.db.sqlite import get_sqlite_db
@@ -18,8 +20,8 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 # Helper function to get chatbot service
 async def get_chatbot_service(db: AsyncSession = Depends(get_db)) -> ChatbotService:
-    async with db as session:
-        return ChatbotService(session)
+    # get_db closes the session when the request is done
+    return ChatbotService(db)
 
 # Create a new chat session
 @router.post("/sessions")
@@ -113,6 +115,37 @@ async def send_message(
         raise HTTPException(status_code=404, detail=str(e))
 
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Add a message and stream the answer as Server-Sent Events
+@router.post("/sessions/{session_id}/messages/stream")
+async def stream_message(
+    session_id: int,
+    user_id: int = Form(...),
+    message: str = Form(...),
+    chatbot_service: ChatbotService = Depends(get_chatbot_service),
+):
+    """
+    Same as send_message, but the answer arrives as "token" events while it is
+    generated, followed by a "done" event with the stored message id and timings.
+    """
+    try:
+        events = await chatbot_service.stream_message(session_id, user_id, message)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    async def body():
+        async for item in events:
+            yield _sse(item["event"], item["data"])
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # Get all messages in a chat session
 @router.get("/sessions/{session_id}/messages")
 async def get_messages(
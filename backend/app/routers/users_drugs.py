@@ -107,4 +107,14 @@ async def get_drug_files(
     drug_service: DrugService = Depends(get_drug_service)
 ):
     """Get all PDF files associated with a drug"""
-    return await drug_service.get_drug_files(current_user.id, drug_id)
\ No newline at end of file
+    return await drug_service.get_drug_files(current_user.id, drug_id)
+
+# Get background ingestion status of drug files
+@router.get("/{drug_id}/files/jobs")
+async def get_drug_file_jobs(
+    drug_id: int,
+    current_user: User = Depends(get_current_user),
+    drug_service: DrugService = Depends(get_drug_service)
+):
+    """Get the ingestion job status (attempts, last error, next retry) of every file of a drug"""
+    return await drug_service.get_ingestion_jobs(current_user.id, drug_id)
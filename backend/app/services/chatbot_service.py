@@ -1,11 +1,14 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from fastapi import UploadFile
 from app.models.user import User
 from app.models.chat_message import ChatMessage
 from app.models.chat_history import ChatHistory
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, delete
-from app.rag_tools.classifiers.intent_classifier import intent_classifier
-from typing import List, Dict, Any, Optional, Tuple
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional, Tuple
 from app.models.enums import IntentEnum
 # from app.services.agent_tools import (
 #     price_rec_service,
@@ -13,9 +16,10 @@ from app.models.enums import IntentEnum
 # )
 from app.rag_tools.info_retrievers.retriever_service import RetrieverService
 from app.rag_tools.info_retrievers.base_retriever import RetrievalResult
+from app.rag_tools.query_context import QueryContext
 # STEP 3 Imports
 from app.rag_tools.normalizer import normalize_tool_responses
-from app.rag_tools.llm_response_formatter import reformat
+from app.rag_tools.llm_response_formatter import reformat, reformat_stream
 from app.core.config import settings
 from jose import JWTError, jwt
 from app.models.enums import DatabaseEnum
@@ -25,6 +29,29 @@ from app.models.enums import DatabaseEnum
 SECRET_KEY = settings.jwt_secret_key
 ALGORITHM = "HS256"
 
+FALLBACK_RESPONSE = ("Sorry, I couldn’t generate a complete answer just now. "
+                     "Please try again in a moment.")
+
+# Blocking retrievals run here rather than in the default executor, so searches that
+# timed out but are still running cannot starve the event loop's other to_thread work
+_retrieval_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_retrieval_executor() -> ThreadPoolExecutor:
+    global _retrieval_executor
+    if _retrieval_executor is None:
+        _retrieval_executor = ThreadPoolExecutor(
+            max_workers=settings.RETRIEVAL_WORKERS, thread_name_prefix="retrieval"
+        )
+    return _retrieval_executor
+
+
+def shutdown_retrieval_executor():
+    global _retrieval_executor
+    if _retrieval_executor is not None:
+        _retrieval_executor.shutdown(wait=False, cancel_futures=True)
+        _retrieval_executor = None
+
 
 class ChatbotService:
     def __init__(self, db: AsyncSession):
@@ -142,18 +169,11 @@ class ChatbotService:
 
         # Current RAG pipeline attempt:
         try:
-            # STEP 2
-            tool_responses = await self.call_tools(message, user_id)
-            print("TOOL RESPONSES")
-            print(tool_responses)
-            # STEP 3.1: normalizer (passes the same user message as 'query')
-            data_dict, prediction = normalize_tool_responses(message, tool_responses)
-            print("RETURNED DATA_DICT", data_dict)
+            data_dict, prediction, context = await self._prepare_answer(message, user_id)
             # STEP 3.2: format final LLM answer
-            final_text = reformat(message, data_dict, prediction)
+            final_text = await reformat(message, data_dict, prediction, context=context)
         except Exception:
-            final_text = ("Sorry, I couldn’t generate a complete answer just now. "
-                        "Please try again in a moment.")
+            final_text = FALLBACK_RESPONSE
 
         bot_msg = ChatMessage(
             role="ASSISTANT",
@@ -166,6 +186,80 @@ class ChatbotService:
 
         return {"user_message": user_msg.content, "bot_response": bot_msg.content}
 
+    async def stream_message(self, session_id: int, user_id: int, message: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of send_message.
+
+        Validates the session and stores the user message before returning, so
+        errors surface before anything is streamed. The returned generator yields
+        {"event": "token", "data": {"text": ...}} for every piece of the answer as
+        the LLM generates it, then one {"event": "done", ...} event carrying the
+        stored assistant message id and the time to first token.
+        """
+        await self._get_user(user_id)
+        await self._get_session(session_id, user_id)
+
+        user_msg = ChatMessage(
+            role="USER",
+            content=message,
+            chat_history_id=session_id
+        )
+        self.db.add(user_msg)
+        await self.db.commit()
+
+        return self._stream_answer(session_id, user_id, message)
+
+    async def _stream_answer(self, session_id: int, user_id: int, message: str) -> AsyncIterator[Dict[str, Any]]:
+        started = time.perf_counter()
+        ttft_ms = None
+        parts: List[str] = []
+        try:
+            data_dict, prediction, context = await self._prepare_answer(message, user_id)
+            async for delta in reformat_stream(message, data_dict, prediction, context=context):
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - started) * 1000
+                    print(f"CHAT STREAM TTFT {ttft_ms:.0f}ms (session {session_id})")
+                parts.append(delta)
+                yield {"event": "token", "data": {"text": delta}}
+        except Exception as e:
+            print(f"Error streaming answer for session {session_id}: {e}")
+            if not parts:
+                parts.append(FALLBACK_RESPONSE)
+                yield {"event": "token", "data": {"text": FALLBACK_RESPONSE}}
+
+        # Persist the assistant message once the whole answer is known. The request's
+        # session was closed by get_db when the response started, so use a new one
+        bot_msg = ChatMessage(
+            role="ASSISTANT",
+            content="".join(parts).strip(),
+            chat_history_id=session_id
+        )
+        async with AsyncSession(self.db.bind, expire_on_commit=False) as db:
+            db.add(bot_msg)
+            await db.commit()
+
+        yield {
+            "event": "done",
+            "data": {
+                "message_id": bot_msg.id,
+                "ttft_ms": ttft_ms,
+                "total_ms": (time.perf_counter() - started) * 1000,
+            },
+        }
+
+    async def _prepare_answer(self, message: str, user_id: int) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]], QueryContext]:
+        """Run the tools and normalize their output; everything the LLM formatter needs for an answer"""
+        # STEP 2
+        # Embedding, intents and jurisdiction are computed once for the whole turn
+        context = QueryContext(query=message, user_id=user_id)
+        tool_responses = await self.call_tools(message, user_id, context)
+        print("TOOL RESPONSES")
+        print(tool_responses)
+        # STEP 3.1: normalizer (passes the same user message as 'query')
+        data_dict, prediction = normalize_tool_responses(message, tool_responses, context)
+        print("RETURNED DATA_DICT", data_dict)
+        return data_dict, prediction, context
+
     async def get_messages(self, session_id: int, user_id: int):
         """Retrieve all messages in a chat session"""
         # Validate both user and session exist
@@ -188,7 +282,7 @@ class ChatbotService:
         # Save the file and optionally extract content or embeddings
         return True  # Placeholder
     
-    async def call_tools(self, query: str, user_id: int) -> List[Dict[str, Any]]:
+    async def call_tools(self, query: str, user_id: int, context: Optional[QueryContext] = None) -> List[Dict[str, Any]]:
         """Route *query* to the appropriate tools based on classified intents.
 
         The function executes the following high-level flow:
@@ -204,15 +298,20 @@ class ChatbotService:
             3. Collect every individual tool response inside *responses*.
             4. Return the list of responses.
 
+        Tools take the query embedding and intents from *context*, a fresh
+        QueryContext unless the caller shares one across the turn.
+
         The return value is a list of dictionaries, each having the shape:
             {
                 "intent": IntentEnum value,
                 "response": <tool-specific output>,
             }
         """
+        context = context or QueryContext(query=query, user_id=user_id)
+
         # 1) Classify the query.
         print("Getting intents")
-        intents = intent_classifier(query)
+        intents = await context.classify_intents()
         intents = [IntentEnum.VECTORDB]
         print("Got intents", intents)
         intents = [IntentEnum.VECTORDB]
@@ -243,9 +342,31 @@ class ChatbotService:
 
                 metadata = []
 
+                # Both sources are searched at once, off the event loop, with one shared query embedding.
+                # The embedding counts against the sources' deadline
+                cda_retriever = await self.retriever_service.get_retriever(DatabaseEnum.CDA_VECTORDB)
+                user_retriever = await self.retriever_service.get_retriever(DatabaseEnum.USER_VECTORDB)
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + settings.RETRIEVAL_SOURCE_TIMEOUT_SECONDS
+                try:
+                    query_embeddings = await asyncio.wait_for(
+                        context.embed([cda_retriever.query_embedding_model(), user_retriever.query_embedding_model()]),
+                        settings.RETRIEVAL_SOURCE_TIMEOUT_SECONDS,
+                    )
+                except asyncio.TimeoutError:
+                    # No time is left to search either source; answer without them
+                    print(f"QUERY EMBEDDING TIMED OUT after {settings.RETRIEVAL_SOURCE_TIMEOUT_SECONDS}s")
+                    responses.append({"intent": intent, "response": metadata})
+                    continue
+
+                remaining = max(deadline - loop.time(), 0.0)
+                cda_metadata, user_metadata = await asyncio.gather(
+                    self._retrieve_cda_metadata(query, query_embeddings, remaining),
+                    self._retrieve_user_metadata(query, user_id, query_embeddings, remaining),
+                )
                 sources = {
-                    "CDA": await self._retrieve_cda_metadata(query),
-                    "USER": await self._retrieve_user_metadata(query, user_id),
+                    "CDA": cda_metadata,
+                    "USER": user_metadata,
                 }
 
                 for source_name, source_data in sources.items():
@@ -271,16 +392,34 @@ class ChatbotService:
 
         return responses
 
-    async def _retrieve_cda_metadata(self, query: str) -> List[RetrievalResult]:
+    async def _retrieve_from_source(self, source_name: str, retrieve: Callable[[], List[RetrievalResult]],
+                                    timeout: float) -> List[RetrievalResult]:
+        """
+        Run a blocking retrieval on the retrieval threads; a source that errors or times out
+        contributes nothing. A timed-out search cannot be interrupted and keeps its thread until
+        it returns, so at most RETRIEVAL_WORKERS searches run at once and the rest wait their turn.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(_get_retrieval_executor(), retrieve), timeout)
+        except asyncio.TimeoutError:
+            print(f"{source_name} RETRIEVAL TIMED OUT after {timeout:.1f}s")
+        except Exception as e:
+            print(f"{source_name} RETRIEVAL FAILED: {e}")
+        return []
+
+    async def _retrieve_cda_metadata(self, query: str, query_embeddings: Dict[str, np.ndarray],
+                                     timeout: float) -> List[RetrievalResult]:
         cda_retriever = await self.retriever_service.get_retriever(DatabaseEnum.CDA_VECTORDB)
         print("CDA RETRIEVER INVOKED")
-        cda_metadata = cda_retriever.retrieve(query)
-
-        return cda_metadata
+        return await self._retrieve_from_source(
+            "CDA", lambda: cda_retriever.retrieve(query, query_embeddings=query_embeddings), timeout
+        )
 
-    async def _retrieve_user_metadata(self, query: str, user_id: int) -> List[RetrievalResult]:
+    async def _retrieve_user_metadata(self, query: str, user_id: int, query_embeddings: Dict[str, np.ndarray],
+                                      timeout: float) -> List[RetrievalResult]:
         user_retriever = await self.retriever_service.get_retriever(DatabaseEnum.USER_VECTORDB)
         print("USER RETRIEVER INVOKED")
-        user_metadata = user_retriever.retrieve(query, user_id)
-
-        return user_metadata
+        return await self._retrieve_from_source(
+            "USER", lambda: user_retriever.retrieve(query, user_id, query_embeddings=query_embeddings), timeout
+        )
@@ -2,19 +2,20 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from fastapi import HTTPException, UploadFile
 from typing import List, Optional
+import asyncio
 import uuid
 from pathlib import Path
 
-from app.models.drug import Drug, DrugFile
+from app.core.config import settings
+from app.models.drug import Drug, DrugFile, IngestionJob
 from app.schemas.drug import DrugCreate, DrugUpdate, DrugRead, DrugListItem
-from app.services.vectorDBServices.file_processing_service import FileProcessingService
 from app.services.vectorDBServices.azure_blob_service import AzureBlobService
 from app.services.vectorDBServices.vector_db_service import VectorDBService
+from app.services.ingestion_queue import ingestion_queue
 
 class DrugService:
     def __init__(self, db: AsyncSession):
         self.db = db
-        self.file_processor = FileProcessingService()
         self.blob_service = AzureBlobService()
         self.vector_db = VectorDBService()
 
@@ -62,10 +63,12 @@ class DrugService:
         await self.db.flush()  # get ID without committing
 
         # Process PDF files if provided
+        jobs = []
         if files:
-            await self._process_drug_files(user_id, drug, files)
+            jobs = await self._process_drug_files(user_id, drug, files)
 
         await self.db.commit()
+        ingestion_queue.submit(job.id for job in jobs)
 
         # Eager-load the files relationship to avoid MissingGreenlet error
         await self.db.refresh(drug, attribute_names=["files"])
@@ -89,10 +92,12 @@ class DrugService:
             setattr(drug, field, value)
         
         # Process new PDF files if provided
+        jobs = []
         if files:
-            await self._process_drug_files(user_id, drug, files)
+            jobs = await self._process_drug_files(user_id, drug, files)
         
         await self.db.commit()
+        ingestion_queue.submit(job.id for job in jobs)
         await self.db.refresh(drug)
         
         return DrugRead.from_orm(drug)
@@ -117,16 +122,15 @@ class DrugService:
             # Delete from blob storage
             if file.blob_url:
                 await self.blob_service.delete_blob(file.filename)
-            
-            # Delete from FAISS vector database
-            await self.vector_db.delete_file_documents(user_id, file.id)
-        
-        # Delete all drug documents from FAISS vector DB
-        await self.vector_db.delete_drug_documents(user_id, drug_id)
         
-        # Delete the drug (cascade will handle drug_files)
+        # Delete the drug (cascade will handle drug_files and ingestion jobs). Rows go first:
+        # a running ingestion job then either indexes before the chunks below are removed,
+        # or finds its job gone and removes what it indexed itself
         await self.db.delete(drug)
         await self.db.commit()
+        
+        # Delete all drug documents (every file's chunks) from FAISS vector DB in one tombstone write
+        await self.vector_db.delete_drug_documents(user_id, drug_id)
 
     async def get_drug_files(self, user_id: int, drug_id: int):
         """Get all PDF files associated with a drug"""
@@ -160,8 +164,47 @@ class DrugService:
         """Search through user's drug documents using FAISS vector similarity"""
         return await self.vector_db.search_user_documents(user_id, query, drug_id, top_k)
 
-    async def _process_drug_files(self, user_id: int, drug: Drug, files: List[UploadFile]) -> object:
-        """Process and upload PDF files for a drug to blob storage and FAISS vector DB"""
+    async def get_ingestion_jobs(self, user_id: int, drug_id: int):
+        """Get the background ingestion job of every file of a drug"""
+        result = await self.db.execute(
+            select(Drug).where(Drug.id == drug_id, Drug.user_id == user_id)
+        )
+        drug = result.scalar_one_or_none()
+        
+        if not drug:
+            raise HTTPException(status_code=404, detail="Drug not found")
+        
+        job_result = await self.db.execute(
+            select(IngestionJob, DrugFile)
+            .join(DrugFile, IngestionJob.drug_file_id == DrugFile.id)
+            .where(IngestionJob.drug_id == drug_id)
+            .order_by(IngestionJob.id)
+        )
+        
+        return [
+            {
+                "job_id": job.id,
+                "file_id": f.id,
+                "filename": f.original_filename,
+                "status": job.status,
+                "processing_status": f.processing_status,
+                "attempts": job.attempts,
+                "last_error": job.last_error,
+                "next_attempt_at": job.run_after if job.status == "queued" else None,
+                "created_at": job.created_at,
+                "updated_at": job.updated_at
+            } for job, f in job_result.all()
+        ]
+
+    async def _process_drug_files(self, user_id: int, drug: Drug, files: List[UploadFile]) -> List[IngestionJob]:
+        """
+        Upload PDF files for a drug to blob storage and create their ingestion jobs.
+
+        Extraction, embedding and indexing run later on the background ingestion
+        queue; the caller submits the returned jobs once they are committed.
+        """
+        # Create file records first; the session is not safe to share across the concurrent uploads below
+        uploads = []
         for file in files:
             if file.size == 0:
                 continue
@@ -170,7 +213,6 @@ class DrugService:
             file_extension = Path(file.filename).suffix
             unique_filename = f"{user_id}_{drug.id}_{uuid.uuid4()}{file_extension}"
             
-            # Create file record first
             drug_file = DrugFile(
                 drug_id=drug.id,
                 user_id=user_id,
@@ -179,52 +221,35 @@ class DrugService:
                 file_size=file.size,
                 content_type=file.content_type,
                 file_type="pdf",
-                processing_status="processing"
+                processing_status="pending"
             )
-            
             self.db.add(drug_file)
-            await self.db.flush()  # Get the file ID
-            
-            try:
-                # Read file content
+            uploads.append((file, drug_file))
+        
+        if not uploads:
+            return []
+        await self.db.flush()  # Get the file IDs
+        
+        semaphore = asyncio.Semaphore(settings.INGESTION_MAX_CONCURRENT_FILES)
+        
+        async def upload(file: UploadFile, drug_file: DrugFile):
+            async with semaphore:
                 content = await file.read()
-                
-                # Upload to blob storage
-                blob_url = await self.blob_service.upload_blob(
-                    unique_filename, content, file.content_type
-                )
-                drug_file.blob_url = blob_url
-                
-                # Process PDF file (chunk and embed)
-                chunks, embeddings = await self.file_processor.process_file(
-                    content, file.filename, drug.id
-                )
-                
-                # Prepare drug data for FAISS vector DB
-                drug_data = {
-                    "id": drug.id,
-                    "title": drug.title,
-                    "therapeutic_area": drug.therapeutic_area or "",
-                    "drug_type": drug.drug_type or "",
-                    "submission_pathway": drug.submission_pathway or ""
-                }
-                
-                file_data = {
-                    "id": drug_file.id,
-                    "original_filename": drug_file.original_filename
-                }
-                
-                # Add to FAISS vector database
-                vector_ids = await self.vector_db.add_document_chunks(
-                    user_id, chunks, embeddings, drug_data, file_data
-                )
-                
-                # Update file record with vector DB info
-                drug_file.vector_ids = vector_ids
-                drug_file.chunk_count = len(chunks)
-                drug_file.processing_status = "completed"
-                
-            except Exception as e:
-                print(f"Error processing file {file.filename}: {e}")
-                drug_file.processing_status = "failed"
-                raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
\ No newline at end of file
+                return await self.blob_service.upload_blob(drug_file.filename, content, file.content_type)
+        
+        results = await asyncio.gather(*[upload(file, drug_file) for file, drug_file in uploads], return_exceptions=True)
+        
+        for (file, drug_file), result in zip(uploads, results):
+            if isinstance(result, Exception):
+                # Nothing is committed yet, so the request can fail as a whole
+                print(f"Error uploading file {file.filename}: {result}")
+                raise HTTPException(status_code=500, detail=f"Error uploading file {file.filename}: {str(result)}")
+            drug_file.blob_url = result
+        
+        jobs = [
+            IngestionJob(drug_file_id=drug_file.id, drug_id=drug.id, user_id=user_id, status="queued")
+            for _, drug_file in uploads
+        ]
+        self.db.add_all(jobs)
+        await self.db.flush()  # Get the job IDs
+        return jobs
@@ -0,0 +1,267 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import and_, or_, select, update
+
+from app.core.config import settings
+from app.models.drug import Drug, DrugFile, IngestionJob
+from app.services.vectorDBServices.file_processing_service import FileProcessingService
+from app.services.vectorDBServices.azure_blob_service import AzureBlobService
+from app.services.vectorDBServices.vector_db_service import VectorDBService
+from app.services.vectorDBServices.embedding_backfill import EmbeddingBackfillService, PENDING_EMBEDDINGS_STATUS
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _due_condition(now: datetime):
+    """Jobs a worker may claim: queued ones whose backoff has passed, and running ones whose worker died"""
+    return or_(
+        and_(IngestionJob.status == "queued", IngestionJob.run_after <= now),
+        and_(IngestionJob.status == "running", IngestionJob.lease_expires_at < now),
+    )
+
+
+class IngestionQueue:
+    """
+    In-process worker pool for drug file ingestion.
+
+    Every uploaded file gets a row in ingestion_jobs; the upload request only
+    stores the PDF and the row. Workers claim a job with a conditional UPDATE,
+    so a job submitted twice (or found again by the poller) runs once. While a
+    job runs its lease is renewed every third of INGESTION_JOB_LEASE_SECONDS and
+    no database session is held; a worker that finds its lease taken over stops
+    and leaves the job to the new owner. A retry first removes whatever an
+    earlier attempt indexed or queued for back-fill, which makes every attempt
+    start from the stored PDF. Failed attempts are retried with exponential
+    backoff up to INGESTION_MAX_ATTEMPTS; jobs left queued or running by a
+    restart are found again by the poller.
+    """
+
+    def __init__(self, workers: Optional[int] = None, session_factory=None):
+        self.workers = workers or settings.INGESTION_WORKERS
+        self._session_factory = session_factory
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.file_processor = None
+        self.blob_service = None
+        self.vector_db = None
+        self.backfill = None
+
+    def _session(self):
+        if self._session_factory is None:
+            from app.db.supabase import SessionLocal
+            self._session_factory = SessionLocal
+        return self._session_factory()
+
+    async def start(self):
+        if self._tasks:
+            return
+        self.file_processor = self.file_processor or FileProcessingService()
+        self.blob_service = self.blob_service or AzureBlobService()
+        self.vector_db = self.vector_db or VectorDBService()
+        self.backfill = self.backfill or EmbeddingBackfillService(self.vector_db)
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._poll()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, job_ids: Iterable[int]):
+        """Hand committed jobs to the workers; without running workers the poller picks them up later"""
+        if self._queue is None:
+            return
+        for job_id in job_ids:
+            self._queue.put_nowait(job_id)
+
+    async def enqueue_due(self) -> int:
+        """Submit every job that is due; returns how many were found"""
+        async with self._session() as db:
+            result = await db.execute(select(IngestionJob.id).where(_due_condition(_utcnow())))
+            job_ids = result.scalars().all()
+        self.submit(job_ids)
+        return len(job_ids)
+
+    async def _poll(self):
+        while True:
+            try:
+                await self.enqueue_due()
+            except Exception as e:
+                print(f"Error polling ingestion jobs: {e}")
+            await asyncio.sleep(settings.INGESTION_POLL_SECONDS)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self.run_job(job_id)
+            except Exception as e:
+                print(f"Error running ingestion job {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def run_job(self, job_id: int) -> bool:
+        """Claim and run one job; False if it was not due or another worker has it"""
+        now = _utcnow()
+        async with self._session() as db:
+            claimed = await db.execute(
+                update(IngestionJob)
+                .where(IngestionJob.id == job_id, _due_condition(now))
+                .values(
+                    status="running",
+                    attempts=IngestionJob.attempts + 1,
+                    lease_expires_at=now + timedelta(seconds=settings.INGESTION_JOB_LEASE_SECONDS),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            if claimed.rowcount == 0:
+                return False
+
+            job = await db.get(IngestionJob, job_id)
+            drug_file = await db.get(DrugFile, job.drug_file_id)
+            drug = await db.get(Drug, job.drug_id)
+            drug_file.processing_status = "processing"
+            await db.commit()
+
+        # No session is held while the file is processed; the lease is renewed instead
+        attempt = job.attempts
+        user_id, file_id = job.user_id, drug_file.id
+        ingestion = asyncio.create_task(self._ingest(job, drug, drug_file))
+        heartbeat = asyncio.create_task(self._renew_lease(job_id, attempt))
+        try:
+            await asyncio.wait({ingestion, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            heartbeat.cancel()
+            if not ingestion.done():
+                # The heartbeat found the job taken over, or the worker is stopping
+                ingestion.cancel()
+            await asyncio.gather(ingestion, heartbeat, return_exceptions=True)
+
+        async with self._session() as db:
+            job = await db.get(IngestionJob, job_id)
+            drug_file = await db.get(DrugFile, file_id)
+        if job is None or drug_file is None:
+            # The drug or file was deleted while it was being ingested (its jobs go with it);
+            # drop whatever this attempt indexed after the deletion removed the file's chunks
+            print(f"File {file_id} was deleted during ingestion job {job_id}; removing its chunks")
+            await self.backfill.discard(user_id, file_id)
+            await self.vector_db.delete_file_documents(user_id, file_id)
+            return True
+        if ingestion.cancelled():
+            print(f"Lost the lease of ingestion job {job_id}; another worker is running it")
+            return True
+        error = ingestion.exception()
+
+        async with self._session() as db:
+            job = await db.get(IngestionJob, job_id)
+            drug_file = await db.get(DrugFile, file_id)
+            if job is None or drug_file is None or job.status != "running" or job.attempts != attempt:
+                # The lease ran out and another worker took the job over, or the drug was deleted
+                # just now and delete_drug removes the chunks once its rows are gone
+                return True
+
+            if error is not None:
+                print(f"Error ingesting file {drug_file.original_filename} (attempt {attempt}): {error}")
+                job.last_error = str(error)
+                # Whatever this attempt indexed is removed before the next one
+                drug_file.vector_ids = []
+                drug_file.chunk_count = 0
+                if attempt >= settings.INGESTION_MAX_ATTEMPTS:
+                    job.status = "failed"
+                    drug_file.processing_status = "failed"
+                else:
+                    job.status = "queued"
+                    job.run_after = _utcnow() + timedelta(
+                        seconds=settings.INGESTION_RETRY_BASE_SECONDS * 2 ** (attempt - 1)
+                    )
+                    drug_file.processing_status = "pending"
+            else:
+                result = ingestion.result()
+                job.status = "succeeded"
+                job.last_error = None
+                drug_file.vector_ids = result["vector_ids"]
+                drug_file.chunk_count = len(result["vector_ids"])
+                drug_file.processing_status = result["processing_status"]
+            job.lease_expires_at = None
+            await db.commit()
+            return True
+
+    async def _renew_lease(self, job_id: int, attempt: int):
+        """Extend a running job's lease until cancelled; returns once the job is no longer ours"""
+        lease = settings.INGESTION_JOB_LEASE_SECONDS
+        while True:
+            await asyncio.sleep(lease / 3)
+            try:
+                async with self._session() as db:
+                    renewed = await db.execute(
+                        update(IngestionJob)
+                        .where(IngestionJob.id == job_id, IngestionJob.status == "running",
+                               IngestionJob.attempts == attempt)
+                        .values(lease_expires_at=_utcnow() + timedelta(seconds=lease))
+                        .execution_options(synchronize_session=False)
+                    )
+                    await db.commit()
+            except Exception as e:
+                # Try again next beat; one missed renewal still leaves a third of the lease
+                print(f"Error renewing the lease of ingestion job {job_id}: {e}")
+                continue
+            if renewed.rowcount == 0:
+                return
+
+    async def _ingest(self, job: IngestionJob, drug: Drug, drug_file: DrugFile) -> Dict[str, Any]:
+        """
+        Extract, embed and index one file, replacing anything an earlier attempt left behind.
+        Returns the file's new vector_ids and processing_status.
+        """
+        user_id = job.user_id
+        await self.backfill.discard(user_id, drug_file.id)
+        if not await self.vector_db.delete_file_documents(user_id, drug_file.id):
+            raise RuntimeError("could not remove chunks indexed by an earlier attempt")
+
+        content = await self.blob_service.download_blob(drug_file.filename)
+        # Chunks must be embedded with the model the user's vector DB was built with
+        embedding_model = await self.vector_db.get_user_embedding_model(user_id)
+        chunks, embeddings = await self.file_processor.process_file(
+            content, drug_file.original_filename, drug.id, embedding_model
+        )
+
+        drug_data = {
+            "id": drug.id,
+            "title": drug.title,
+            "therapeutic_area": drug.therapeutic_area or "",
+            "drug_type": drug.drug_type or "",
+            "submission_pathway": drug.submission_pathway or ""
+        }
+        file_data = {
+            "id": drug_file.id,
+            "original_filename": drug_file.original_filename
+        }
+
+        # Index what was embedded; chunks whose embeddings failed wait in the retry queue
+        embedded = [(chunk, embedding) for chunk, embedding in zip(chunks, embeddings) if embedding is not None]
+        failed = [chunk for chunk, embedding in zip(chunks, embeddings) if embedding is None]
+        vector_ids = await self.vector_db.add_document_chunks(
+            user_id,
+            [chunk for chunk, _ in embedded],
+            [embedding for _, embedding in embedded],
+            drug_data,
+            file_data,
+            embedding_model,
+        )
+        if failed:
+            await self.backfill.enqueue(user_id, failed, drug_data, file_data)
+
+        return {
+            "vector_ids": vector_ids,
+            "processing_status": PENDING_EMBEDDINGS_STATUS if failed else "completed",
+        }
+
+
+ingestion_queue = IngestionQueue()
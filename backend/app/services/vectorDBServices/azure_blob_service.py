@@ -1,11 +1,15 @@
-from typing import List
+from typing import List, Optional
 from azure.storage.blob.aio import BlobServiceClient
-from azure.core.exceptions import ResourceNotFoundError
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError, ResourceModifiedError, ResourceExistsError
 from app.core.config import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
+class BlobConflictError(Exception):
+    """A conditional blob write found the blob changed (or created) by another writer"""
+
 class AzureBlobService:
     def __init__(self):
         self.connection_string = settings.AZURE_STORAGE_CONNECTION_STRING
@@ -34,6 +38,41 @@ class AzureBlobService:
             logger.error(f"Error uploading blob {filename}: {str(e)}")
             raise
 
+    async def upload_blob_with_etag(self, filename: str, data: bytes, content_type: str = None, container_name: str = None,
+                                    if_match: Optional[str] = None, if_none_match: bool = False) -> str:
+        """
+        Upload a blob to Azure Storage and return the ETag of the written version.
+
+        if_match only overwrites the version with that ETag; if_none_match only creates a new blob.
+        Either precondition failing raises BlobConflictError.
+        """
+        try:
+            container = container_name or self.container_name
+            blob_client = self.client.get_blob_client(
+                container=container, 
+                blob=filename
+            )
+
+            conditions = {}
+            if if_match is not None:
+                conditions = {"etag": if_match, "match_condition": MatchConditions.IfNotModified}
+            
+            result = await blob_client.upload_blob(
+                data, 
+                content_type=content_type,
+                overwrite=not if_none_match,
+                **conditions
+            )
+            
+            return result.get("etag")
+            
+        except (ResourceModifiedError, ResourceExistsError) as e:
+            logger.warning(f"Conditional upload of blob {filename} lost a race: {str(e)}")
+            raise BlobConflictError(filename) from e
+        except Exception as e:
+            logger.error(f"Error uploading blob {filename}: {str(e)}")
+            raise
+
     async def download_blob(self, filename: str, container_name: str = None) -> bytes:
         """Download a blob from Azure Storage"""
         try:
@@ -53,6 +92,44 @@ class AzureBlobService:
             logger.error(f"Error downloading blob {filename}: {str(e)}")
             raise
 
+    async def download_blob_with_etag(self, filename: str, container_name: str = None) -> tuple[bytes, str]:
+        """Download a blob from Azure Storage together with its ETag"""
+        try:
+            container = container_name or self.container_name
+            blob_client = self.client.get_blob_client(
+                container=container, 
+                blob=filename
+            )
+            
+            download_stream = await blob_client.download_blob()
+            data = await download_stream.readall()
+            return data, download_stream.properties.etag
+            
+        except ResourceNotFoundError:
+            logger.warning(f"Blob {filename} not found")
+            raise
+        except Exception as e:
+            logger.error(f"Error downloading blob {filename}: {str(e)}")
+            raise
+
+    async def get_blob_etag(self, filename: str, container_name: str = None) -> Optional[str]:
+        """Get the current ETag of a blob, or None if it does not exist"""
+        try:
+            container = container_name or self.container_name
+            blob_client = self.client.get_blob_client(
+                container=container, 
+                blob=filename
+            )
+            
+            properties = await blob_client.get_blob_properties()
+            return properties.etag
+            
+        except ResourceNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error getting ETag for blob {filename}: {str(e)}")
+            raise
+
     async def delete_blob(self, filename: str, container_name: str = None) -> bool:
         """Delete a blob from Azure Storage"""
         try:
@@ -0,0 +1,178 @@
+import io
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional
+
+# Fixed-width numeric columns and their dtypes
+_INT_COLUMNS = {
+    "vector_index": np.int64,
+    "drug_id": np.int64,
+    "file_id": np.int64,
+    "user_id": np.int64,
+    "chunk_index": np.int32,
+    "page_number": np.int32,
+    "word_count": np.int32,
+    "char_count": np.int32,
+}
+
+# Low-cardinality strings, stored as int32 codes into a per-column vocabulary
+_CATEGORY_COLUMNS = ("drug_title", "filename", "therapeutic_area", "drug_type", "submission_pathway", "section_title")
+
+
+class ChunkStore:
+    """
+    Columnar metadata for a user's document chunks.
+
+    Every chunk is one row across numpy columns. Chunk text lives in a single
+    UTF-8 buffer addressed by (offset, length) columns, so nothing is decoded
+    until a row is actually returned. Rows removed by tombstones leave their
+    text behind in the buffer until the store is re-serialized.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], vocabularies: Dict[str, List[str]], text: bytes):
+        self.columns = columns
+        self.vocabularies = vocabularies
+        self.text = text
+        self._order: Optional[np.ndarray] = None  # argsort of vector_index, built on first lookup
+
+    @classmethod
+    def empty(cls) -> "ChunkStore":
+        return cls.from_records([])
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]]) -> "ChunkStore":
+        """Build a store from per-chunk dicts in the shape returned by row()"""
+        records = list(records)
+        columns = {
+            name: np.array([record.get(name) or 0 for record in records], dtype=dtype)
+            for name, dtype in _INT_COLUMNS.items()
+        }
+        columns["doc_id"] = np.array([record["doc_id"] for record in records], dtype="S36")
+        columns["created_at"] = np.array(
+            [record.get("created_at") or "NaT" for record in records], dtype="datetime64[us]"
+        )
+
+        vocabularies = {}
+        for name in _CATEGORY_COLUMNS:
+            vocabulary: Dict[str, int] = {}
+            columns[name] = np.array(
+                [vocabulary.setdefault(record.get(name) or "", len(vocabulary)) for record in records],
+                dtype=np.int32
+            )
+            vocabularies[name] = list(vocabulary)
+
+        encoded = [record.get("content", "").encode("utf-8") for record in records]
+        lengths = np.array([len(data) for data in encoded], dtype=np.int64)
+        columns["text_length"] = lengths
+        columns["text_offset"] = np.cumsum(lengths) - lengths
+        return cls(columns, vocabularies, b"".join(encoded))
+
+    @classmethod
+    def from_documents(cls, documents: Dict[str, Dict[str, Any]]) -> "ChunkStore":
+        """Convert the pre-columnar JSON layout (document_id -> document_info)"""
+        return cls.from_records({**doc_info, "doc_id": doc_id} for doc_id, doc_info in documents.items())
+
+    @classmethod
+    def concat(cls, stores: List["ChunkStore"]) -> "ChunkStore":
+        merged = cls.empty()
+        for store in stores:
+            merged.append(store)
+        return merged
+
+    def __len__(self) -> int:
+        return len(self.columns["vector_index"])
+
+    @property
+    def nbytes(self) -> int:
+        """Resident size of the columns and text buffer"""
+        return sum(column.nbytes for column in self.columns.values()) + len(self.text)
+
+    def append(self, other: "ChunkStore"):
+        """Append another store's rows in place"""
+        columns = dict(other.columns)
+        columns["text_offset"] = other.columns["text_offset"] + len(self.text)
+        for name in _CATEGORY_COLUMNS:
+            # Re-code the other store's categories against this store's vocabulary
+            vocabulary = {value: code for code, value in enumerate(self.vocabularies[name])}
+            remap = np.array(
+                [vocabulary.setdefault(value, len(vocabulary)) for value in other.vocabularies[name]],
+                dtype=np.int32
+            )
+            self.vocabularies[name] = list(vocabulary)
+            columns[name] = remap[other.columns[name]] if len(remap) else other.columns[name]
+
+        self.columns = {name: np.concatenate([column, columns[name]]) for name, column in self.columns.items()}
+        self.text = self.text + other.text
+        self._order = None
+
+    def remove(self, vector_ids: Iterable[int]):
+        """Drop the rows of the given vector ids; their text is reclaimed on the next serialization"""
+        keep = ~np.isin(self.columns["vector_index"], np.fromiter(vector_ids, dtype=np.int64))
+        if keep.all():
+            return
+        self.columns = {name: column[keep] for name, column in self.columns.items()}
+        self._order = None
+
+    def rows_for(self, vector_ids: np.ndarray) -> np.ndarray:
+        """Row position of each vector id, or -1 where the store has no such vector"""
+        ids = self.columns["vector_index"]
+        if self._order is None:
+            self._order = np.argsort(ids, kind="stable")
+        vector_ids = np.asarray(vector_ids, dtype=np.int64)
+        if not len(ids):
+            return np.full(len(vector_ids), -1, dtype=np.int64)
+        sorted_ids = ids[self._order]
+        positions = np.minimum(np.searchsorted(sorted_ids, vector_ids), len(ids) - 1)
+        return np.where(sorted_ids[positions] == vector_ids, self._order[positions], -1)
+
+    def vector_ids_where(self, field: str, value: int) -> np.ndarray:
+        """Vector ids of every row whose integer column equals value"""
+        return self.columns["vector_index"][self.columns[field] == value]
+
+    def content(self, row: int) -> str:
+        offset = int(self.columns["text_offset"][row])
+        return self.text[offset:offset + int(self.columns["text_length"][row])].decode("utf-8")
+
+    def row(self, row: int) -> Dict[str, Any]:
+        """Materialize a single chunk as a dict, decoding only its own text"""
+        created_at = self.columns["created_at"][row]
+        record = {name: int(self.columns[name][row]) for name in _INT_COLUMNS}
+        record.update({
+            name: self.vocabularies[name][self.columns[name][row]]
+            for name in _CATEGORY_COLUMNS
+        })
+        record["doc_id"] = self.columns["doc_id"][row].decode("ascii")
+        record["content"] = self.content(row)
+        record["created_at"] = "" if np.isnat(created_at) else np.datetime_as_string(created_at, unit="us")
+        return record
+
+    def to_bytes(self) -> tuple[bytes, bytes]:
+        """Serialize as (columns blob, text blob), packing the text of live rows only"""
+        offsets = self.columns["text_offset"]
+        lengths = self.columns["text_length"]
+        view = memoryview(self.text)
+        text = b"".join(view[offset:offset + length] for offset, length in zip(offsets.tolist(), lengths.tolist()))
+
+        arrays = {name: column for name, column in self.columns.items()}
+        arrays["text_offset"] = np.cumsum(lengths) - lengths
+        for name in _CATEGORY_COLUMNS:
+            arrays[f"vocabulary_{name}"] = np.array(self.vocabularies[name], dtype=np.str_)
+
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        return buffer.getvalue(), text
+
+    @classmethod
+    def from_bytes(cls, columns_data: bytes, text: bytes) -> "ChunkStore":
+        """Rebuild a store from blobs produced by to_bytes"""
+        with np.load(io.BytesIO(columns_data), allow_pickle=False) as arrays:
+            columns = {name: arrays[name] for name in arrays.files if not name.startswith("vocabulary_")}
+            vocabularies = {
+                name: arrays[f"vocabulary_{name}"].tolist()
+                for name in _CATEGORY_COLUMNS if f"vocabulary_{name}" in arrays.files
+            }
+        # Segments written before a category column existed hold "" in every row
+        for name in _CATEGORY_COLUMNS:
+            if name not in vocabularies:
+                columns[name] = np.zeros(len(columns["vector_index"]), dtype=np.int32)
+                vocabularies[name] = [""]
+        return cls(columns, vocabularies, text)
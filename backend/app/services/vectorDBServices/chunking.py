@@ -0,0 +1,119 @@
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Tuple
+
+import tiktoken
+
+# Section headings: all-caps lines ("CLINICAL EVIDENCE") and short numbered titles ("3. Economic Review",
+# "2.1 Dosing"); numbered sentences such as list items ending in a period are body text
+_HEADER_PATTERNS = (
+    re.compile(r"^[A-Z][A-Z\s\d:]{3,}$"),
+    re.compile(r"^\d+\.(\d+\.?)*\s+[A-Z][^.!?;:]{0,80}$"),
+)
+
+DEFAULT_SECTION_TITLE = "Untitled Section"
+
+
+@lru_cache(maxsize=None)
+def get_encoder(model: str) -> tiktoken.Encoding:
+    """Tokenizer of an embedding model, built once per process"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def is_header(line: str) -> bool:
+    return any(pattern.match(line) for pattern in _HEADER_PATTERNS)
+
+
+class TokenChunker:
+    """
+    Streaming, structure-aware chunker over lines of text.
+
+    Lines are fed one at a time with their page number and each is encoded
+    exactly once. A chunk is emitted as soon as the next line would push it past
+    max_tokens; the last overlap token ids of that chunk start the next one, so
+    overlap is carried over rather than re-encoded. Lines longer than the budget
+    are split at token boundaries, so no chunk ever exceeds max_tokens. Heading
+    lines close the current chunk without overlap, start the next one and
+    become the section_title of the chunks that follow. Chunks are dicts with text, page (first page),
+    page_end, section_title, token_count and the source of their first line.
+    """
+
+    def __init__(self, encoder: tiktoken.Encoding, max_tokens: int = 650, overlap: int = 50):
+        if not 0 <= overlap < max_tokens:
+            raise ValueError(f"overlap must be in [0, max_tokens), got {overlap} for max_tokens={max_tokens}")
+        self.encoder = encoder
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.section_title = DEFAULT_SECTION_TITLE
+        self._tokens: List[int] = []
+        self._pages: List[Tuple[int, int]] = []  # (token offset, page) wherever the page changes
+        self._source: Any = None
+        self._fresh = 0  # tokens added since the last chunk was emitted
+
+    def feed(self, line: str, page: int, source: Any = None) -> Iterator[Dict[str, Any]]:
+        line = line.strip()
+        if not line:
+            return
+        if is_header(line):
+            # The heading opens the next chunk, so its text stays searchable
+            yield from self._emit(keep_overlap=False)
+            self.section_title = line
+
+        tokens = self.encoder.encode(line + " ")
+        # Keep lines whole where they fit in a chunk of their own
+        if self._fresh and len(self._tokens) + len(tokens) > self.max_tokens:
+            yield from self._emit(keep_overlap=True)
+
+        position = 0
+        while position < len(tokens):
+            room = self.max_tokens - len(self._tokens)
+            if room == 0:
+                yield from self._emit(keep_overlap=True)
+                continue
+            if not self._tokens:
+                self._source = source
+            if not self._pages or self._pages[-1][1] != page:
+                self._pages.append((len(self._tokens), page))
+            taken = tokens[position:position + room]
+            self._tokens.extend(taken)
+            self._fresh += len(taken)
+            position += len(taken)
+
+    def finish(self) -> Iterator[Dict[str, Any]]:
+        yield from self._emit(keep_overlap=False)
+
+    def _emit(self, keep_overlap: bool) -> Iterator[Dict[str, Any]]:
+        if self._fresh:
+            yield {
+                "text": self.encoder.decode(self._tokens),
+                "page": self._pages[0][1],
+                "page_end": self._pages[-1][1],
+                "section_title": self.section_title,
+                "token_count": len(self._tokens),
+                "source": self._source,
+            }
+
+        keep = min(self.overlap, len(self._tokens)) if keep_overlap and self._fresh else 0
+        cut = len(self._tokens) - keep
+        # Pages of the carried-over tokens: the mark in effect at the cut, then any later marks
+        pages = [(max(offset - cut, 0), page) for offset, page in self._pages if offset > cut]
+        carried = [mark for mark in self._pages if mark[0] <= cut]
+        if keep and carried and (not pages or pages[0][0] > 0):
+            pages.insert(0, (0, carried[-1][1]))
+        self._tokens = self._tokens[cut:] if keep else []
+        self._pages = pages if keep else []
+        self._fresh = 0
+
+
+def chunk_lines(lines: List[Dict[str, Any]], encoder: tiktoken.Encoding, max_tokens: int = 650,
+                overlap: int = 50) -> List[Dict[str, Any]]:
+    """Chunk {'text', 'page'[, 'source']} line dicts in one pass"""
+    chunker = TokenChunker(encoder, max_tokens, overlap)
+    chunks = []
+    for line in lines:
+        chunks.extend(chunker.feed(line["text"], line["page"], line.get("source")))
+    chunks.extend(chunker.finish())
+    return chunks
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from app.core.config import settings
+from app.services.vectorDBServices.azure_blob_service import AzureBlobService, BlobConflictError
+from app.services.vectorDBServices.embedding_service import EmbeddingService
+from app.services.vectorDBServices.vector_db_service import VectorDBService
+
+# Blob prefix of the retry queue; one entry per file whose chunks still lack embeddings
+RETRY_QUEUE_PREFIX = "embedding-retry/"
+
+# DrugFile.processing_status while some of a file's chunks wait in the retry queue
+PENDING_EMBEDDINGS_STATUS = "pending_embeddings"
+
+
+class EmbeddingBackfillService:
+    """
+    Retry queue for chunks whose embeddings failed during upload.
+
+    Instead of indexing placeholder vectors, failed chunks are written to a
+    blob under RETRY_QUEUE_PREFIX with the drug and file metadata they need.
+    backfill_once re-embeds them, adds them to the user's vector DB and marks
+    the DrugFile completed once nothing is left. Entries that still hold chunks
+    are retried with exponential backoff; after EMBEDDING_BACKFILL_MAX_ATTEMPTS
+    rounds the entry is dropped and the DrugFile marked failed. An entry is
+    leased through an If-Match write before it is processed, so concurrent
+    workers never index the same chunks twice.
+    """
+
+    def __init__(self, vector_db: Optional[VectorDBService] = None):
+        self.blob_service = AzureBlobService()
+        self.embedding_service = EmbeddingService()
+        self.vector_db = vector_db or VectorDBService()
+
+    async def enqueue(self, user_id: int, chunks: List[Dict[str, Any]], drug_data: Dict[str, Any],
+                      file_data: Dict[str, Any]) -> str:
+        """Persist chunks that still need embeddings; returns the queue entry's blob name"""
+        blob_name = f"{RETRY_QUEUE_PREFIX}{user_id}/{file_data['id']}-{uuid.uuid4()}.json"
+        entry = {
+            "user_id": user_id,
+            "drug": drug_data,
+            "file": file_data,
+            "chunks": chunks,
+            "attempts": 0,
+            "leased_until": 0.0,
+            "retry_after": 0.0,
+        }
+        await self.blob_service.upload_blob(blob_name, json.dumps(entry).encode("utf-8"), "application/json")
+        return blob_name
+
+    async def discard(self, user_id: int, file_id: int):
+        """Drop every queue entry of a file, e.g. before the file is ingested again"""
+        await asyncio.gather(*[
+            self.blob_service.delete_blob(name)
+            for name in await self.blob_service.list_blobs(prefix=f"{RETRY_QUEUE_PREFIX}{user_id}/{file_id}-")
+        ])
+
+    async def backfill_once(self) -> int:
+        """Process every queue entry once; returns the number of chunks that were indexed"""
+        indexed = 0
+        for blob_name in await self.blob_service.list_blobs(prefix=RETRY_QUEUE_PREFIX):
+            try:
+                indexed += await self._backfill_entry(blob_name)
+            except Exception as e:
+                print(f"Error back-filling embeddings for {blob_name}: {e}")
+        return indexed
+
+    async def _backfill_entry(self, blob_name: str) -> int:
+        try:
+            data, etag = await self.blob_service.download_blob_with_etag(blob_name)
+        except ResourceNotFoundError:
+            return 0
+        entry = json.loads(data)
+        if max(entry.get("leased_until", 0.0), entry.get("retry_after", 0.0)) > time.time():
+            return 0
+
+        # Take the lease; losing the race means another worker has the entry
+        entry["leased_until"] = time.time() + settings.EMBEDDING_BACKFILL_LEASE_SECONDS
+        try:
+            etag = await self.blob_service.upload_blob_with_etag(
+                blob_name, json.dumps(entry).encode("utf-8"), "application/json", if_match=etag
+            )
+        except BlobConflictError:
+            return 0
+
+        drug_file = await self._get_drug_file(entry["file"]["id"])
+        if drug_file is None:
+            # File or drug was deleted while its chunks waited
+            await self.blob_service.delete_blob(blob_name)
+            return 0
+
+        file_id = entry["file"]["id"]
+        chunks = entry["chunks"]
+        try:
+            embedding_model = await self.vector_db.get_user_embedding_model(entry["user_id"])
+            embeddings = await self.embedding_service.generate_embeddings_batch(
+                [chunk["text"] for chunk in chunks], model=embedding_model
+            )
+            embedded = [(chunk, embedding) for chunk, embedding in zip(chunks, embeddings) if embedding is not None]
+            remaining = [chunk for chunk, embedding in zip(chunks, embeddings) if embedding is None]
+
+            vector_ids = []
+            if embedded:
+                vector_ids = await self.vector_db.add_document_chunks(
+                    entry["user_id"],
+                    [chunk for chunk, _ in embedded],
+                    [embedding for _, embedding in embedded],
+                    entry["drug"],
+                    entry["file"],
+                    embedding_model,
+                )
+        except Exception as e:
+            # Counts as a round in which nothing could be indexed
+            print(f"Error back-filling embeddings for file {file_id}: {e}")
+            embedded, remaining, vector_ids = [], chunks, []
+
+        if not remaining:
+            await self._record_progress(file_id, vector_ids, status="completed")
+            await self.blob_service.delete_blob(blob_name)
+            return len(embedded)
+
+        entry["attempts"] += 1
+        if entry["attempts"] >= settings.EMBEDDING_BACKFILL_MAX_ATTEMPTS:
+            print(f"Giving up on embeddings for {len(remaining)} chunks of file {file_id} "
+                  f"after {entry['attempts']} attempts")
+            await self._record_progress(file_id, vector_ids, status="failed")
+            await self.blob_service.delete_blob(blob_name)
+            return len(embedded)
+
+        await self._record_progress(file_id, vector_ids)
+        entry["chunks"] = remaining
+        entry["leased_until"] = 0.0
+        entry["retry_after"] = time.time() + settings.EMBEDDING_BACKFILL_RETRY_BASE_SECONDS * 2 ** (entry["attempts"] - 1)
+        await self.blob_service.upload_blob_with_etag(
+            blob_name, json.dumps(entry).encode("utf-8"), "application/json", if_match=etag
+        )
+        return len(embedded)
+
+    async def _get_drug_file(self, file_id: int):
+        from app.db.supabase import SessionLocal
+        from app.models.drug import DrugFile
+
+        async with SessionLocal() as db:
+            return await db.get(DrugFile, file_id)
+
+    async def _record_progress(self, file_id: int, vector_ids: List[str], status: Optional[str] = None):
+        """Add newly indexed vectors to a DrugFile and, once the entry is settled, set its processing_status"""
+        from app.db.supabase import SessionLocal
+        from app.models.drug import DrugFile
+
+        async with SessionLocal() as db:
+            drug_file = await db.get(DrugFile, file_id)
+            if drug_file is None:
+                return
+            drug_file.vector_ids = list(drug_file.vector_ids or []) + list(vector_ids)
+            drug_file.chunk_count = (drug_file.chunk_count or 0) + len(vector_ids)
+            if status is not None:
+                drug_file.processing_status = status
+            await db.commit()
+
+    async def run_forever(self, interval_seconds: float):
+        """Drain the queue every interval_seconds until cancelled"""
+        while True:
+            indexed = await self.backfill_once()
+            if indexed:
+                print(f"Back-filled embeddings for {indexed} chunks")
+            await asyncio.sleep(interval_seconds)
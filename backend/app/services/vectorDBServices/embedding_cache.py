@@ -0,0 +1,124 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from typing import Any, Dict, List, Optional
+
+
+class EmbeddingCache:
+    """
+    Persistent content-addressed cache of embeddings in a local SQLite file.
+
+    Keys are sha256(model, text), so the same text is never embedded twice for a
+    model across runs or processes. Vectors are stored as raw float32 blobs and
+    read through SQLite's mmap I/O. Least recently used rows are evicted once the
+    stored vectors exceed max_bytes. The last_used time of hits is buffered and
+    written TOUCH_BATCH_SIZE rows at a time, and before any eviction.
+    """
+
+    TOUCH_BATCH_SIZE = 256
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA mmap_size=268435456")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Cached vector for each text, or None where it has not been embedded yet"""
+        keys = [self.key(model, text) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+            now = time.time()
+            self._touched.update((key, now) for key in found)
+            if len(self._touched) >= self.TOUCH_BATCH_SIZE:
+                self._write_touches()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return [found.get(key) for key in keys]
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, texts: List[str], vectors: List[Any]):
+        now = time.time()
+        rows = [
+            (self.key(model, text), model, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for key, model_name, blob, last_used in rows:
+                previous = self._conn.execute("SELECT LENGTH(vector) FROM embeddings WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+                    (key, model_name, blob, last_used)
+                )
+                self._total_bytes += len(blob) - (previous[0] if previous else 0)
+            self._conn.execute("COMMIT")
+            if self._total_bytes > self.max_bytes:
+                self._write_touches()
+                self._evict()
+
+    def put(self, model: str, text: str, vector: Any):
+        self.put_many(model, [text], [vector])
+
+    def _write_touches(self):
+        """Store the buffered last_used times of hits; caller holds the lock"""
+        touched, self._touched = self._touched, {}
+        if touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key, now in touched.items()]
+            )
+
+    def _evict(self):
+        """Drop least recently used rows until the cache is back under 90% of its budget"""
+        excess = self._total_bytes - int(self.max_bytes * 0.9)
+        victims = []
+        for key, size in self._conn.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used"):
+            if excess <= 0:
+                break
+            victims.append(key)
+            excess -= size
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", [(key,) for key in victims])
+        self.evictions += len(victims)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "total_bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
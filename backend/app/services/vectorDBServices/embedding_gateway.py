@@ -0,0 +1,156 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from openai import AsyncOpenAI
+
+from app.core.config import settings
+from app.services.vectorDBServices.embedding_cache import EmbeddingCache
+
+
+class EmbeddingGateway:
+    """
+    Process-wide embeddings client that micro-batches single-text requests.
+
+    Requests from any thread or event loop are queued on the gateway's own
+    background loop. A batch is sent as one embeddings call once it reaches
+    max_batch_size texts or its oldest text has waited max_wait_ms. Running on
+    a dedicated loop lets synchronous callers (the chat retrievers) share
+    batches and the pooled HTTP client with async callers (the upload path).
+    Each batch is first looked up in the embedding cache with one query, in a
+    worker thread so neither the callers' loops nor the gateway loop wait on
+    SQLite; only the texts it misses are sent to the API.
+    """
+
+    def __init__(self, model: str, max_batch_size: int, max_wait_ms: float, client: Optional[AsyncOpenAI] = None,
+                 cache: Optional[EmbeddingCache] = None, dimensions: Optional[int] = None):
+        self.model = model
+        # Only the text-embedding-3 models accept a dimensions parameter; others return their native size
+        self.dimensions = dimensions if model.startswith("text-embedding-3") else None
+        # Vectors of different sizes from the same model must not share cache entries
+        self.cache_model = f"{model}@{self.dimensions}" if self.dimensions else model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.cache = cache
+        self._client = client
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._start_lock = threading.Lock()
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.texts = 0
+        self.batches = 0
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name=f"embedding-gateway-{self.model}", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def _submit(self, text: str) -> Future:
+        return asyncio.run_coroutine_threadsafe(self._enqueue(text), self._ensure_started())
+
+    async def embed(self, text: str) -> List[float]:
+        """Embed one text, sharing an API call with whatever else is queued"""
+        return await asyncio.wrap_future(self._submit(text))
+
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """Embed several texts; they are split into batches of at most max_batch_size"""
+        return await asyncio.gather(*[self.embed(text) for text in texts])
+
+    def embed_blocking(self, text: str) -> List[float]:
+        """Synchronous embed for code that is not running on an event loop it can await on"""
+        return self._submit(text).result()
+
+    async def _enqueue(self, text: str) -> List[float]:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._send(batch))
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]):
+        if self.cache is not None:
+            try:
+                cached = await asyncio.to_thread(self.cache.get_many, self.cache_model, [text for text, _ in batch])
+            except Exception as e:
+                print(f"Error reading cached embeddings: {e}")
+                cached = [None] * len(batch)
+            for (_, future), vector in zip(batch, cached):
+                if vector is not None and not future.done():
+                    future.set_result(vector.tolist())
+            batch = [item for item, vector in zip(batch, cached) if vector is None]
+            if not batch:
+                return
+
+        self.texts += len(batch)
+        self.batches += 1
+        try:
+            if self._client is None:
+                # Created on the gateway loop so its connection pool lives there
+                self._client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+            kwargs = {"dimensions": self.dimensions} if self.dimensions else {}
+            response = await self._client.embeddings.create(model=self.model, input=[text for text, _ in batch], **kwargs)
+            embeddings = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        if self.cache is not None:
+            try:
+                await asyncio.to_thread(self.cache.put_many, self.cache_model, [text for text, _ in batch], embeddings)
+            except Exception as e:
+                print(f"Error caching embeddings: {e}")
+
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "texts": self.texts,
+            "batches": self.batches,
+            "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+        }
+
+
+_gateways: Dict[Tuple[str, Optional[int]], EmbeddingGateway] = {}
+_gateways_lock = threading.Lock()
+_embedding_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Shared on-disk embedding cache, or None when EMBEDDING_CACHE_PATH is empty"""
+    global _embedding_cache
+    if _embedding_cache is None and settings.EMBEDDING_CACHE_PATH:
+        _embedding_cache = EmbeddingCache(settings.EMBEDDING_CACHE_PATH, settings.EMBEDDING_CACHE_MAX_BYTES)
+    return _embedding_cache
+
+
+def get_embedding_gateway(model: str, dimensions: Optional[int] = None) -> EmbeddingGateway:
+    """Shared gateway for an embedding model and output size"""
+    with _gateways_lock:
+        gateway = _gateways.get((model, dimensions))
+        if gateway is None:
+            gateway = _gateways[(model, dimensions)] = EmbeddingGateway(
+                model,
+                max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+                max_wait_ms=settings.EMBEDDING_BATCH_MAX_WAIT_MS,
+                cache=get_embedding_cache(),
+                dimensions=dimensions,
+            )
+        return gateway
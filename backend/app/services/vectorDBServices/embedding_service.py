@@ -1,43 +1,42 @@
-import openai
-from typing import List
+from typing import List, Optional
 from app.core.config import settings
+from app.services.vectorDBServices.embedding_gateway import get_embedding_gateway
+
+
+class EmbeddingUnavailableError(Exception):
+    """The embeddings API could not produce a vector; callers must not substitute one"""
+
 
 class EmbeddingService:
     def __init__(self):
-        openai.api_key = settings.OPENAI_API_KEY
+        self.model = settings.EMBEDDING_MODEL
+        self.gateway = self._gateway(self.model)
 
-    async def generate_embedding(self, text: str) -> List[float]:
-        """Generate embedding for a single text"""
+    def _gateway(self, model: Optional[str]):
+        return get_embedding_gateway(model or self.model, settings.EMBEDDING_DIMENSIONS)
+
+    async def generate_embedding(self, text: str, model: Optional[str] = None) -> List[float]:
+        """Generate embedding for a single text, with EMBEDDING_MODEL unless an index's model is given"""
         try:
-            response = await openai.Embedding.acreate(
-                model="text-embedding-ada-002",
-                input=text
-            )
-            return response['data'][0]['embedding']
+            return await self._gateway(model).embed(text)
         except Exception as e:
             print(f"Error generating embedding: {e}")
-            # Return zero vector as fallback
-            return [0.0] * 1536
+            raise EmbeddingUnavailableError(str(e)) from e
 
-    async def generate_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for multiple texts"""
+    async def generate_embeddings_batch(self, texts: List[str], model: Optional[str] = None) -> List[Optional[List[float]]]:
+        """Generate embeddings for multiple texts; texts whose batch failed get None"""
         embeddings = []
         
-        batch_size = 100
+        gateway = self._gateway(model)
+        batch_size = gateway.max_batch_size
         for i in range(0, len(texts), batch_size):
             batch = texts[i:i + batch_size]
             
             try:
-                response = await openai.Embedding.acreate(
-                    model="text-embedding-ada-002",
-                    input=batch
-                )
-                
-                batch_embeddings = [item['embedding'] for item in response['data']]
-                embeddings.extend(batch_embeddings)
+                embeddings.extend(await gateway.embed_many(batch))
                 
             except Exception as e:
                 print(f"Error generating embeddings for batch {i//batch_size}: {e}")
-                embeddings.extend([[0.0] * 1536] * len(batch))
+                embeddings.extend([None] * len(batch))
         
-        return embeddings
\ No newline at end of file
+        return embeddings
@@ -1,72 +1,85 @@
-import io
-import PyPDF2
-from typing import List, Tuple, Dict, Any
+import asyncio
+from typing import List, Tuple, Dict, Any, Optional
+from app.core.config import settings
+from app.services.vectorDBServices.chunking import TokenChunker, get_encoder
 from app.services.vectorDBServices.embedding_service import EmbeddingService
+from app.services.vectorDBServices.pdf_extraction import iter_pdf_pages
 
 class FileProcessingService:
     def __init__(self):
         self.embedding_service = EmbeddingService()
 
-    async def process_file(self, content: bytes, filename: str, drug_id: int) -> Tuple[List[Dict], List[List[float]]]:
-        """Process PDF file content, extract text, chunk, and generate embeddings"""
+    async def process_file(self, content: bytes, filename: str, drug_id: int,
+                           embedding_model: Optional[str] = None) -> Tuple[List[Dict], List[Optional[List[float]]]]:
+        """
+        Process PDF file content, extract text, chunk, and generate embeddings (None where embedding failed).
+
+        Pages are split into token-bounded, heading-aware chunks (see TokenChunker)
+        as they come back from the extraction pool, and every
+        EMBEDDING_BATCH_MAX_SIZE chunks are sent for embedding while later pages
+        are still being parsed.
+        """
         
         if not filename.lower().endswith('.pdf'):
             raise ValueError(f"Only PDF files are supported. Received: {filename}")
         
-        # Extract all text from PDF
-        text_content = await self._extract_text_from_pdf(content)
-        
-        # Chunk the text
-        chunks = self._chunk_text(text_content, drug_id, filename)
+        chunks = []
+        batches = []
+        embedded_upto = 0
+        chunker = TokenChunker(
+            get_encoder(embedding_model or settings.EMBEDDING_MODEL),
+            settings.CHUNK_MAX_TOKENS,
+            settings.CHUNK_OVERLAP_TOKENS
+        )
         
-        # Generate embeddings for chunks
-        chunk_texts = [chunk["text"] for chunk in chunks]
-        embeddings = await self.embedding_service.generate_embeddings_batch(chunk_texts)
+        def collect(chunk: Dict):
+            if chunk["text"].strip():
+                chunks.append(self._chunk_metadata(chunk, len(chunks), drug_id, filename))
         
-        return chunks, embeddings
-
-    async def _extract_text_from_pdf(self, content: bytes) -> str:
-        """Extract all text from PDF"""
         try:
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
-            text = ""
-            
-            for page_num, page in enumerate(pdf_reader.pages, 1):
-                try:
-                    page_text = page.extract_text()
-                    if page_text.strip():
-                        text += f"\n[Page {page_num}]\n{page_text}\n"
-                except Exception as e:
-                    print(f"Error extracting text from page {page_num}: {e}")
-                    continue
-            
-            if not text.strip():
-                raise ValueError("No text could be extracted from the PDF")
-            
-            return text.strip()
-            
+            async for page_num, page_text in iter_pdf_pages(content):
+                for line in page_text.split("\n"):
+                    for chunk in chunker.feed(line, page_num):
+                        collect(chunk)
+                while len(chunks) - embedded_upto >= settings.EMBEDDING_BATCH_MAX_SIZE:
+                    batch = [chunk["text"] for chunk in chunks[embedded_upto:embedded_upto + settings.EMBEDDING_BATCH_MAX_SIZE]]
+                    batches.append(asyncio.create_task(
+                        self.embedding_service.generate_embeddings_batch(batch, model=embedding_model)
+                    ))
+                    embedded_upto += len(batch)
         except Exception as e:
+            for task in batches:
+                task.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                raise ValueError(f"Timed out after {settings.PDF_EXTRACTION_TIMEOUT_SECONDS}s extracting text from {filename}")
             raise ValueError(f"Error processing PDF: {str(e)}")
-
-    def _chunk_text(self, text: str, drug_id: int, filename: str, 
-                   chunk_size: int = 1000, overlap: int = 200) -> List[Dict]:
-        """Split text into overlapping chunks"""
-        chunks = []
-        words = text.split()
         
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk_words = words[i:i + chunk_size]
-            chunk_text = " ".join(chunk_words)
-            
-            if chunk_text.strip():
-                chunk_metadata = {
-                    "drug_id": drug_id,
-                    "filename": filename,
-                    "chunk_index": len(chunks),
-                    "text": chunk_text.strip(),
-                    "word_count": len(chunk_words),
-                    "char_count": len(chunk_text)
-                }
-                chunks.append(chunk_metadata)
+        for chunk in chunker.finish():
+            collect(chunk)
+        if not chunks:
+            raise ValueError("Error processing PDF: No text could be extracted from the PDF")
+        
+        # Embed what is left, then wait for the batches started during extraction
+        tail = [chunk["text"] for chunk in chunks[embedded_upto:]]
+        if tail:
+            batches.append(asyncio.create_task(
+                self.embedding_service.generate_embeddings_batch(tail, model=embedding_model)
+            ))
+        embeddings = [embedding for batch in await asyncio.gather(*batches) for embedding in batch]
         
-        return chunks
\ No newline at end of file
+        return chunks, embeddings
+
+    def _chunk_metadata(self, chunk: Dict, chunk_index: int, drug_id: int, filename: str) -> Dict:
+        chunk_text = chunk["text"].strip()
+        return {
+            "drug_id": drug_id,
+            "filename": filename,
+            "chunk_index": chunk_index,
+            "text": chunk_text,
+            "page_number": chunk["page"],
+            "page_end": chunk["page_end"],
+            "section_title": chunk["section_title"],
+            "token_count": chunk["token_count"],
+            "word_count": len(chunk_text.split()),
+            "char_count": len(chunk_text)
+        }
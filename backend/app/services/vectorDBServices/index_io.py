@@ -0,0 +1,13 @@
+import faiss
+import numpy as np
+
+
+def serialize_index(index: faiss.Index) -> bytes:
+    """Serialize a FAISS index straight into bytes, without going through a file"""
+    return faiss.serialize_index(index).tobytes()
+
+
+def deserialize_index(data: bytes) -> faiss.Index:
+    """Rebuild a FAISS index from bytes produced by serialize_index"""
+    # np.frombuffer wraps the downloaded bytes without copying them
+    return faiss.deserialize_index(np.frombuffer(data, dtype=np.uint8))
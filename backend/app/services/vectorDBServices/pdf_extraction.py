@@ -0,0 +1,119 @@
+import asyncio
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, List, Optional, Tuple
+
+import PyPDF2
+
+from app.core.config import settings
+
+# Shared by every request of this server process; created on first use
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn, because forking a process that runs the embedding gateway's thread is unsafe
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.PDF_EXTRACTION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _discard_executor(executor: ProcessPoolExecutor):
+    """Stop a pool whose task hung; the next file gets a fresh one"""
+    global _executor
+    if _executor is executor:
+        _executor = None
+    # A running task cannot be cancelled, so its worker is terminated; the pool has no public API for that
+    for process in list((executor._processes or {}).values()):
+        process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _split_pages(content: bytes, pages_per_part: int) -> List[Tuple[List[int], bytes]]:
+    """
+    Parse a PDF once and cut it into standalone PDFs of up to pages_per_part pages,
+    each with the 1-based numbers of the pages it holds; pages that cannot be copied are skipped
+    """
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
+    parts = []
+    for start in range(0, len(pdf_reader.pages), pages_per_part):
+        writer = PyPDF2.PdfWriter()
+        page_numbers = []
+        for page_index in range(start, min(start + pages_per_part, len(pdf_reader.pages))):
+            try:
+                writer.add_page(pdf_reader.pages[page_index])
+                page_numbers.append(page_index + 1)
+            except Exception as e:
+                print(f"Error reading page {page_index + 1}: {e}")
+        if page_numbers:
+            part = io.BytesIO()
+            writer.write(part)
+            parts.append((page_numbers, part.getvalue()))
+    return parts
+
+
+def _extract_pages(part: bytes, page_numbers: List[int]) -> List[Tuple[int, str]]:
+    """Text of the pages of one part as (page number, text); pages that fail or are empty are skipped"""
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(part))
+    pages = []
+    for page, page_number in zip(pdf_reader.pages, page_numbers):
+        try:
+            page_text = page.extract_text()
+            if page_text.strip():
+                pages.append((page_number, page_text))
+        except Exception as e:
+            print(f"Error extracting text from page {page_number}: {e}")
+    return pages
+
+
+async def iter_pdf_pages(content: bytes) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Yield (page number, text) for every page with text, in page order.
+
+    Parsing runs in a process pool of PDF_EXTRACTION_WORKERS, so it never blocks
+    the event loop. The document is parsed once and cut into parts of
+    PDF_EXTRACTION_PAGES_PER_TASK pages, whose text is extracted in parallel; each
+    task receives only its own part. A part is yielded as soon as it and all parts
+    before it are done. Raises TimeoutError when the whole file takes longer than
+    PDF_EXTRACTION_TIMEOUT_SECONDS; the pool's workers are then terminated, since a
+    hung parse cannot be cancelled, and other files being extracted at that moment
+    fail with it and are retried by their ingestion job.
+    """
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    deadline = loop.time() + settings.PDF_EXTRACTION_TIMEOUT_SECONDS
+
+    def remaining() -> float:
+        return max(deadline - loop.time(), 0.0)
+
+    futures = []
+    try:
+        parts = await asyncio.wait_for(
+            loop.run_in_executor(executor, _split_pages, content, settings.PDF_EXTRACTION_PAGES_PER_TASK),
+            remaining()
+        )
+        futures = [
+            loop.run_in_executor(executor, _extract_pages, part, page_numbers)
+            for page_numbers, part in parts
+        ]
+        for future in futures:
+            for page in await asyncio.wait_for(future, remaining()):
+                yield page
+    except asyncio.TimeoutError:
+        _discard_executor(executor)
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
@@ -0,0 +1,174 @@
+import argparse
+import asyncio
+import json
+import time
+import faiss
+import numpy as np
+from typing import Dict, List, Tuple
+
+# Vector storage modes for user indexes:
+#   flat - float32 vectors, searched exactly
+#   fp16 - float16 vectors, searched directly; half the bytes of flat
+#   sq8  - float16 vectors as the stored form, searched through an 8-bit scalar-quantized
+#          copy whose top candidates are re-ranked exactly against the float16 vectors
+STORAGE_MODES = ("flat", "fp16", "sq8")
+
+# Below this many vectors the float16 scan is already cheap, so sq8 skips the quantized copy
+SQ8_MIN_VECTORS = 1024
+
+
+def new_storage_index(d: int, mode: str) -> faiss.IndexIDMap2:
+    """Empty ID-mapped inner-product index holding vectors in the given storage mode"""
+    if mode not in STORAGE_MODES:
+        raise ValueError(f"Unknown vector storage mode '{mode}', expected one of {STORAGE_MODES}")
+    if mode == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(d))
+    return faiss.IndexIDMap2(faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT))
+
+
+def _stores_fp16(index: faiss.Index) -> bool:
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    return isinstance(inner, faiss.IndexScalarQuantizer) and inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16
+
+
+def matches_storage(index: faiss.Index, mode: str) -> bool:
+    if not isinstance(index, faiss.IndexIDMap2):
+        return False
+    inner = faiss.downcast_index(index.index)
+    if mode == "flat":
+        return isinstance(inner, faiss.IndexFlat)
+    return _stores_fp16(index)
+
+
+def vectors_and_ids(index: faiss.Index) -> Tuple[np.ndarray, np.ndarray]:
+    """All stored vectors as float32 with their ids; positional indexes use each vector's position"""
+    if index.ntotal == 0:
+        return np.empty((0, index.d), dtype=np.float32), np.empty(0, dtype=np.int64)
+    if isinstance(index, faiss.IndexIDMap2):
+        return index.index.reconstruct_n(0, index.ntotal), faiss.vector_to_array(index.id_map).astype(np.int64)
+    return index.reconstruct_n(0, index.ntotal), np.arange(index.ntotal, dtype=np.int64)
+
+
+def to_storage(index: faiss.Index, mode: str) -> faiss.IndexIDMap2:
+    """The same vectors and ids in the given storage mode, converting only when the layout differs"""
+    if matches_storage(index, mode):
+        return index
+    converted = new_storage_index(index.d, mode)
+    vectors, ids = vectors_and_ids(index)
+    if len(ids):
+        converted.add_with_ids(vectors, ids)
+    return converted
+
+
+def vector_nbytes(index: faiss.Index) -> int:
+    """Resident bytes of an index's vector codes"""
+    inner = faiss.downcast_index(index.index) if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) else index
+    return index.ntotal * getattr(inner, "code_size", index.d * 4)
+
+
+def build_sq8_index(index: faiss.Index) -> faiss.IndexIDMap2:
+    """8-bit scalar-quantized copy of an index, trained per dimension on its own vectors"""
+    vectors, ids = vectors_and_ids(index)
+    sq8 = faiss.IndexScalarQuantizer(index.d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    sq8.train(vectors)
+    quantized = faiss.IndexIDMap2(sq8)
+    quantized.add_with_ids(vectors, ids)
+    return quantized
+
+
+def rerank(index: faiss.IndexIDMap2, query: np.ndarray, candidate_ids: np.ndarray, k: int
+           ) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact inner-product scores of candidate ids against the stored vectors; returns the top k (scores, ids)"""
+    candidate_ids = candidate_ids[candidate_ids != -1]
+    if not len(candidate_ids):
+        return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+    vectors = np.vstack([index.reconstruct(int(i)) for i in candidate_ids])
+    scores = vectors @ query.reshape(-1)
+    order = np.argsort(-scores, kind="stable")[:k]
+    return scores[order], candidate_ids[order]
+
+
+def recall_report(vectors: np.ndarray, n_queries: int = 200, k: int = 10, rerank_factor: int = 4,
+                  seed: int = 0) -> List[Dict]:
+    """
+    Recall@k and per-query latency of each storage mode against exact float32 search.
+
+    The queries are stored vectors held out of the indexed set, so no query
+    trivially finds itself; sq8 is reported both with and without re-ranking.
+    """
+    if len(vectors) < 10:
+        raise ValueError(f"Need at least 10 vectors to hold out queries, index has {len(vectors)}")
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    held_out = rng.choice(len(vectors), size=min(n_queries, len(vectors) // 10), replace=False)
+    keep = np.ones(len(vectors), dtype=bool)
+    keep[held_out] = False
+    queries, base = vectors[held_out], vectors[keep]
+    ids = np.arange(len(base), dtype=np.int64)
+
+    exact = new_storage_index(base.shape[1], "flat")
+    exact.add_with_ids(base, ids)
+    _, truth = exact.search(queries, k)
+
+    fp16 = to_storage(exact, "fp16")
+    sq8 = build_sq8_index(fp16)
+    candidates = min(len(base), k * rerank_factor)
+
+    def search_fp16(query):
+        return fp16.search(query, k)[1][0]
+
+    def search_sq8(query):
+        return sq8.search(query, k)[1][0]
+
+    def search_sq8_rerank(query):
+        return rerank(fp16, query, sq8.search(query, candidates)[1][0], k)[1]
+
+    report = []
+    for mode, search, nbytes in (
+        ("flat", lambda query: exact.search(query, k)[1][0], vector_nbytes(exact)),
+        ("fp16", search_fp16, vector_nbytes(fp16)),
+        ("sq8", search_sq8, vector_nbytes(sq8)),
+        ("sq8+rerank", search_sq8_rerank, vector_nbytes(sq8) + vector_nbytes(fp16)),
+    ):
+        latencies = []
+        hits = 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            found = search(query.reshape(1, -1))
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(set(found.tolist()) & set(expected.tolist()))
+        report.append({
+            "mode": mode,
+            f"recall@{k}": hits / truth.size,
+            "mean_latency_ms": float(np.mean(latencies)),
+            "p95_latency_ms": float(np.percentile(latencies, 95)),
+            "vector_bytes": int(nbytes),
+        })
+    return report
+
+
+async def _evaluate_user(user_id: int, n_queries: int, k: int, rerank_factor: int) -> Dict:
+    from app.services.vectorDBServices.vector_db_service import VectorDBService
+
+    index, _ = await VectorDBService()._load_user_vector_db(user_id)
+    vectors, _ = vectors_and_ids(index)
+    return {
+        "user_id": user_id,
+        "ntotal": index.ntotal,
+        "stored_as_fp16": _stores_fp16(index),
+        "k": k,
+        "modes": recall_report(vectors, n_queries=n_queries, k=k, rerank_factor=rerank_factor),
+    }
+
+
+if __name__ == "__main__":
+    from app.core.config import settings
+
+    parser = argparse.ArgumentParser(description="Recall vs size of quantized storage modes for a user's vector DB")
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--queries", type=int, default=200, help="Held-out query vectors")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank-factor", type=int, default=settings.USER_INDEX_RERANK_FACTOR)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(_evaluate_user(args.user_id, args.queries, args.k, args.rerank_factor)), indent=2))
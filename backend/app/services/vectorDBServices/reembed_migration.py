@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import io
+import faiss
+import numpy as np
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.services.vectorDBServices.embedding_service import EmbeddingService
+from app.services.vectorDBServices.vector_db_service import VectorDBService, _user_lock
+
+# Blob prefix of migration checkpoints: one part per re-embedded batch of a user's chunks
+CHECKPOINT_PREFIX = "embedding-migrations/"
+
+# Attempts at swapping in the re-embedded vectors while chunks keep arriving
+_FINALIZE_ATTEMPTS = 3
+
+
+class ReembedMigration:
+    """
+    Re-encodes existing user vector DBs with a new embedding model or at a new
+    EMBEDDING_DIMENSIONS.
+
+    Chunk texts are re-embedded in batches of batch_size and every batch is
+    written as its own checkpoint blob, so an interrupted run resumes where it
+    stopped. Once all chunks have vectors, the user's lock is taken, chunks
+    added in the meantime are embedded too, and the new vectors replace the
+    old ones as a single base segment whose manifest records the new model and
+    size. Search keeps using the old model until that swap. Only chunk text is
+    read from the old DB, so its vectors may be of any size.
+    """
+
+    def __init__(self, vector_db: Optional[VectorDBService] = None, target_model: Optional[str] = None,
+                 batch_size: Optional[int] = None):
+        self.vector_db = vector_db or VectorDBService()
+        self.blob_service = self.vector_db.blob_service
+        self.embedding_service = EmbeddingService()
+        self.target_model = target_model or settings.EMBEDDING_MODEL
+        self.batch_size = batch_size or settings.EMBEDDING_MIGRATION_BATCH_SIZE
+
+    def _checkpoint_prefix(self, user_id: int) -> str:
+        return f"{CHECKPOINT_PREFIX}user-{user_id}/{self.target_model}-{self.vector_db.embedding_dim}d/"
+
+    async def _load_checkpoints(self, user_id: int) -> Dict[int, np.ndarray]:
+        """Vectors already re-embedded for a user, keyed by vector id"""
+        vectors: Dict[int, np.ndarray] = {}
+        for name in await self.blob_service.list_blobs(prefix=self._checkpoint_prefix(user_id)):
+            part = np.load(io.BytesIO(await self.blob_service.download_blob(name)), allow_pickle=False)
+            vectors.update(zip(part["vector_ids"].tolist(), part["vectors"]))
+        return vectors
+
+    async def _write_checkpoint(self, user_id: int, vector_ids: List[int], vectors: np.ndarray):
+        buffer = io.BytesIO()
+        np.savez(buffer, vector_ids=np.array(vector_ids, dtype=np.int64), vectors=vectors)
+        name = f"{self._checkpoint_prefix(user_id)}part-{vector_ids[0]}-{len(vector_ids)}.npz"
+        await self.blob_service.upload_blob(name, buffer.getvalue(), "application/octet-stream")
+
+    async def _embed_missing(self, user_id: int, metadata: Dict, done: Dict[int, np.ndarray], checkpoint: bool):
+        """Re-embed every chunk of metadata without a vector in done, batch by batch"""
+        chunks = metadata["chunks"]
+        missing = [row for row, vector_id in enumerate(chunks.columns["vector_index"].tolist()) if vector_id not in done]
+        for start in range(0, len(missing), self.batch_size):
+            rows = missing[start:start + self.batch_size]
+            embeddings = await self.embedding_service.generate_embeddings_batch(
+                [chunks.content(row) for row in rows], model=self.target_model
+            )
+            if any(embedding is None for embedding in embeddings):
+                raise RuntimeError(f"Embeddings API failed while re-embedding user {user_id}; progress is checkpointed")
+            vectors = np.array(embeddings, dtype=np.float32)
+            faiss.normalize_L2(vectors)
+            vector_ids = [int(chunks.columns["vector_index"][row]) for row in rows]
+            if checkpoint:
+                await self._write_checkpoint(user_id, vector_ids, vectors)
+            done.update(zip(vector_ids, vectors))
+            print(f"User {user_id}: re-embedded {len(done)}/{len(chunks)} chunks with {self.target_model}", flush=True)
+
+    async def _load_source(self, user_id: int) -> tuple[faiss.Index, Dict]:
+        """A user's current vector DB, whatever the size of its vectors"""
+        index, metadata, _ = await self.vector_db._download_user_vector_db(user_id, check_dimensions=False)
+        return index, metadata
+
+    def _is_migrated(self, index: faiss.Index, metadata: Dict) -> bool:
+        return metadata["embedding_model"] == self.target_model and index.d == self.vector_db.embedding_dim
+
+    async def migrate_user(self, user_id: int) -> bool:
+        """Re-embed one user's vector DB; True once it is on the target model and size"""
+        index, metadata = await self._load_source(user_id)
+        if self._is_migrated(index, metadata):
+            return True
+
+        done = await self._load_checkpoints(user_id)
+        await self._embed_missing(user_id, metadata, done, checkpoint=True)
+
+        for _ in range(_FINALIZE_ATTEMPTS):
+            async with _user_lock(user_id):
+                await self.vector_db._flush_pending_additions(user_id)
+                index, current = await self._load_source(user_id)
+                if self._is_migrated(index, current):
+                    break
+                # Chunks that arrived during the run are few; embed them without checkpointing
+                await self._embed_missing(user_id, current, done, checkpoint=False)
+
+                vector_ids = current["chunks"].columns["vector_index"]
+                index = self.vector_db._new_index()
+                if len(vector_ids):
+                    index.add_with_ids(np.vstack([done[int(i)] for i in vector_ids]), vector_ids)
+
+                # current was downloaded for this attempt rather than taken from the cache,
+                # so it can become the migrated state directly
+                migrated = {**current, "embedding_model": self.target_model, "migrated_from": current["embedding_model"]}
+                migrated.pop("sq8_index", None)
+                if await self.vector_db._save_user_vector_db(user_id, index, migrated):
+                    break
+        else:
+            return False
+
+        await asyncio.gather(*[
+            self.blob_service.delete_blob(name)
+            for name in await self.blob_service.list_blobs(prefix=self._checkpoint_prefix(user_id))
+        ], return_exceptions=True)
+        print(f"User {user_id}: vector DB now embedded with {self.target_model}", flush=True)
+        return True
+
+    async def user_ids(self) -> List[int]:
+        """Every user with a segmented vector DB"""
+        suffix = "-drug-manifest.json"
+        return sorted(
+            int(name[len("user-"):-len(suffix)])
+            for name in await self.blob_service.list_blobs(prefix="user-")
+            if name.endswith(suffix)
+        )
+
+    async def migrate_all(self) -> Dict[int, bool]:
+        results = {}
+        for user_id in await self.user_ids():
+            try:
+                results[user_id] = await self.migrate_user(user_id)
+            except Exception as e:
+                print(f"User {user_id}: re-embedding stopped: {e}", flush=True)
+                results[user_id] = False
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-embed user vector DBs with EMBEDDING_MODEL, resuming from checkpoints")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--user-id", type=int)
+    target.add_argument("--all", action="store_true")
+    parser.add_argument("--model", default=settings.EMBEDDING_MODEL)
+    parser.add_argument("--batch-size", type=int, default=settings.EMBEDDING_MIGRATION_BATCH_SIZE)
+    args = parser.parse_args()
+
+    migration = ReembedMigration(target_model=args.model, batch_size=args.batch_size)
+    if args.all:
+        print(asyncio.run(migration.migrate_all()))
+    else:
+        print(asyncio.run(migration.migrate_user(args.user_id)))
@@ -0,0 +1,119 @@
+import time
+import faiss
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.services.vectorDBServices.quantization import vector_nbytes
+
+
+@dataclass
+class CachedUserIndex:
+    """A loaded user vector DB together with the blob version it was read from."""
+    index: faiss.Index
+    metadata: Any
+    etag: Optional[str]
+    nbytes: int
+    validated_at: float = field(default_factory=time.monotonic)
+
+
+def estimate_nbytes(index: faiss.Index, metadata: Dict[str, Any]) -> int:
+    """Rough resident size of a loaded user vector DB"""
+    index_bytes = vector_nbytes(index)
+    if metadata.get("sq8_index") is not None:
+        index_bytes += vector_nbytes(metadata["sq8_index"])
+    chunks = metadata.get("chunks")
+    return index_bytes + (chunks.nbytes if chunks is not None else 0)
+
+
+class UserIndexCache:
+    """
+    Bounded, memory-budgeted LRU cache of loaded user vector DBs keyed by user_id.
+
+    Entries remember the ETag of the blob they were loaded from so callers can
+    revalidate against Azure and only refetch stale entries.
+    """
+
+    def __init__(self, max_bytes: int, max_entries: int, revalidate_seconds: float = 0.0):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.revalidate_seconds = revalidate_seconds
+        self._entries: "OrderedDict[int, CachedUserIndex]" = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: int) -> Optional[CachedUserIndex]:
+        """Return the cached entry for a user (marking it most recently used)"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry
+
+    def peek(self, user_id: int) -> Optional[CachedUserIndex]:
+        """Return the cached entry for a user without touching recency or hit counters"""
+        return self._entries.get(user_id)
+
+    def is_fresh(self, entry: CachedUserIndex) -> bool:
+        """Whether an entry was validated recently enough to skip the ETag check"""
+        return time.monotonic() - entry.validated_at < self.revalidate_seconds
+
+    def mark_validated(self, user_id: int):
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            entry.validated_at = time.monotonic()
+
+    def put(self, user_id: int, index: faiss.Index, metadata: Any, etag: Optional[str], nbytes: Optional[int] = None):
+        """
+        Insert or replace a user's entry and evict least recently used entries over budget.
+
+        nbytes defaults to estimate_nbytes; pass it for metadata that is not a VectorDBService dict.
+        """
+        self.invalidate(user_id)
+
+        if nbytes is None:
+            nbytes = estimate_nbytes(index, metadata)
+        if nbytes > self.max_bytes:
+            # Too large to ever fit; serve it uncached rather than flushing everyone else
+            return
+
+        self._entries[user_id] = CachedUserIndex(index=index, metadata=metadata, etag=etag, nbytes=nbytes)
+        self._total_bytes += nbytes
+
+        while self._entries and (self._total_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            _, evicted = self._entries.popitem(last=False)
+            self._total_bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def invalidate(self, user_id: int):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._total_bytes -= entry.nbytes
+
+    def clear(self):
+        self._entries.clear()
+        self._total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "total_bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Shared by every VectorDBService instance in this process
+user_index_cache = UserIndexCache(
+    max_bytes=settings.USER_INDEX_CACHE_MAX_BYTES,
+    max_entries=settings.USER_INDEX_CACHE_MAX_ENTRIES,
+    revalidate_seconds=settings.USER_INDEX_CACHE_REVALIDATE_SECONDS,
+)
@@ -3,21 +3,82 @@ import numpy as np
 import json
 import uuid
 import pickle
+import weakref
 from datetime import datetime
-from typing import List, Dict, Any, Optional
-from pathlib import Path
+from typing import Callable, List, Dict, Any, Optional
 import asyncio
-import aiofiles
+from dataclasses import dataclass, field
+from azure.core.exceptions import ResourceNotFoundError
 
 from app.core.config import settings
-from app.services.vectorDBServices.azure_blob_service import AzureBlobService 
-from app.services.vectorDBServices.embedding_service import EmbeddingService
+from app.services.vectorDBServices.azure_blob_service import AzureBlobService, BlobConflictError
+from app.services.vectorDBServices.chunk_store import ChunkStore
+from app.services.vectorDBServices.embedding_service import EmbeddingService, EmbeddingUnavailableError
+from app.services.vectorDBServices.index_io import serialize_index, deserialize_index
+from app.services.vectorDBServices.quantization import SQ8_MIN_VECTORS, build_sq8_index, new_storage_index, rerank, to_storage
+from app.services.vectorDBServices.user_index_cache import user_index_cache
+
+# Attempts at a read-modify-write of a manifest before giving up on cross-process conflicts
+_MANIFEST_COMMIT_ATTEMPTS = 5
+
+# Model of vector DBs whose manifest predates recording it; uploads used to be embedded with it
+_LEGACY_EMBEDDING_MODEL = "text-embedding-ada-002"
+_LEGACY_EMBEDDING_DIM = 1536
+
+def _vector_id(doc_id: str) -> int:
+    """Stable int64 FAISS id for a chunk, derived from its document UUID"""
+    return uuid.UUID(doc_id).int >> 65
+
+
+@dataclass
+class _PendingAddition:
+    """Embeddings and chunk metadata from one add_document_chunks call, awaiting a coalesced write"""
+    embeddings: np.ndarray
+    chunks: ChunkStore
+    embedding_model: str
+    done: asyncio.Future
+
+
+@dataclass
+class _LoopState:
+    """
+    Per-user coordination state of one event loop. Locks, futures and tasks only
+    work on the loop that created them, so each loop gets its own registries and
+    they go away with it.
+    """
+    # Serializes mutations of a user's vector DB, keyed by user_id
+    user_locks: Dict[int, asyncio.Lock] = field(default_factory=dict)
+    # Chunk batches waiting to be written by whichever caller next holds the user's lock
+    pending_additions: Dict[int, List[_PendingAddition]] = field(default_factory=dict)
+    # Background compactions in flight, keyed by user_id
+    compaction_tasks: Dict[int, asyncio.Task] = field(default_factory=dict)
+
+
+_loop_states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState]" = weakref.WeakKeyDictionary()
+
+
+def _loop_state() -> _LoopState:
+    loop = asyncio.get_running_loop()
+    state = _loop_states.get(loop)
+    if state is None:
+        state = _loop_states[loop] = _LoopState()
+    return state
+
+
+def _user_lock(user_id: int) -> asyncio.Lock:
+    locks = _loop_state().user_locks
+    lock = locks.get(user_id)
+    if lock is None:
+        lock = locks[user_id] = asyncio.Lock()
+    return lock
+
 
 class VectorDBService:
     def __init__(self):
         self.blob_service = AzureBlobService()
         self.embedding_service = EmbeddingService()
-        self.embedding_dim = 1536  # OpenAI ada-002 embedding dimension
+        self.embedding_dim = settings.EMBEDDING_DIMENSIONS
+        self.cache = user_index_cache
         
     def _get_user_vector_path(self, user_id: int) -> str:
         """Generate unique vector DB path for each user"""
@@ -27,134 +88,469 @@ class VectorDBService:
         """Generate unique metadata path for each user"""
         return f"user-{user_id}-drug-metadata"
 
-    async def _load_user_vector_db(self, user_id: int) -> tuple[faiss.IndexFlatIP, Dict[str, Any]]:
-        """Load user's FAISS index and metadata from Azure Blob Storage"""
-        vector_path = self._get_user_vector_path(user_id)
-        metadata_path = self._get_user_metadata_path(user_id)
+    def _get_user_manifest_path(self, user_id: int) -> str:
+        """Manifest listing the base and delta segments of a user's vector DB"""
+        return f"user-{user_id}-drug-manifest.json"
 
-        print("VECTOR PATH", vector_path)
-        print("METADATA PATH", metadata_path)
-        
+    def _new_segment_paths(self, user_id: int, kind: str) -> Dict[str, str]:
+        """Fresh, never-overwritten blob names for a base or delta segment"""
+        generation = uuid.uuid4().hex[:12]
+        suffix = generation if kind == "base" else f"{kind}-{generation}"
+        return {
+            "id": generation,
+            "index": f"{self._get_user_vector_path(user_id)}-{suffix}.index",
+            "metadata": f"{self._get_user_metadata_path(user_id)}-{suffix}.npz",
+            "text": f"{self._get_user_metadata_path(user_id)}-{suffix}.text",
+        }
+
+    def _segment_blobs(self, segment: Dict[str, Any]) -> List[str]:
+        """Every blob a segment occupies; pre-columnar segments have no separate text blob"""
+        return [segment[key] for key in ("index", "metadata", "text") if segment.get(key)]
+
+    def _check_dimensions(self, index: faiss.Index, source: str):
+        """Refuse vectors of a different size than the one queries and new chunks are embedded at"""
+        if index.d != self.embedding_dim:
+            raise ValueError(
+                f"{source} holds {index.d}-d vectors but EMBEDDING_DIMENSIONS is {self.embedding_dim}; "
+                f"re-embed the vector DB or change the setting"
+            )
+
+    async def _download_segment(self, segment: Dict[str, Any]) -> tuple[faiss.Index, ChunkStore]:
+        if not segment.get("text"):
+            # Pre-columnar segment: one JSON document holding every chunk's metadata and text
+            vector_data, metadata_data = await asyncio.gather(
+                self.blob_service.download_blob(segment["index"]),
+                self.blob_service.download_blob(segment["metadata"]),
+            )
+            documents = json.loads(metadata_data.decode('utf-8'))["documents"]
+            return deserialize_index(vector_data), ChunkStore.from_documents(documents)
+
+        vector_data, columns_data, text = await asyncio.gather(
+            self.blob_service.download_blob(segment["index"]),
+            self.blob_service.download_blob(segment["metadata"]),
+            self.blob_service.download_blob(segment["text"]),
+        )
+        return deserialize_index(vector_data), ChunkStore.from_bytes(columns_data, text)
+
+    async def _upload_segment(self, segment: Dict[str, Any], index: faiss.Index, chunks: ChunkStore):
+        columns_data, text = chunks.to_bytes()
+        await asyncio.gather(
+            self.blob_service.upload_blob(segment["index"], serialize_index(index), "application/octet-stream"),
+            self.blob_service.upload_blob(segment["metadata"], columns_data, "application/octet-stream"),
+            self.blob_service.upload_blob(segment["text"], text, "text/plain; charset=utf-8"),
+        )
+
+    def _new_index(self, embedding_dim: Optional[int] = None) -> faiss.IndexIDMap2:
+        """Empty ID-mapped index so chunks keep the same id across deletes and compactions"""
+        return new_storage_index(embedding_dim or self.embedding_dim, settings.USER_INDEX_VECTOR_STORAGE)
+
+    def _as_id_mapped(self, index: faiss.Index) -> faiss.IndexIDMap2:
+        """
+        Bring a stored segment into the configured storage mode; positional (pre-IDMap)
+        indexes use each vector's position as its id. Segments written under another
+        mode are converted in memory and rewritten at the next compaction.
+        """
+        return to_storage(index, settings.USER_INDEX_VECTOR_STORAGE)
+
+    def _search_index(self, index: faiss.IndexIDMap2, metadata: Dict[str, Any]) -> faiss.IndexIDMap2:
+        """Index to run the candidate search on: an 8-bit copy in sq8 mode, otherwise the stored vectors"""
+        if settings.USER_INDEX_VECTOR_STORAGE != "sq8" or index.ntotal < SQ8_MIN_VECTORS:
+            return index
+        # Built on first search and dropped whenever the stored vectors change
+        if metadata.get("sq8_index") is None:
+            metadata["sq8_index"] = build_sq8_index(index)
+        return metadata["sq8_index"]
+
+    def _new_metadata(self, user_id: int) -> Dict[str, Any]:
+        return {
+            "user_id": user_id,
+            "embedding_model": settings.EMBEDDING_MODEL,  # model every stored vector was embedded with
+            "chunks": ChunkStore.empty(),  # one row per stored vector
+            "merged_deltas": [],  # delta segment ids folded into this in-memory state
+            "applied_tombstones": [],  # deleted vector ids already removed from this in-memory state
+            "created_at": datetime.utcnow().isoformat(),
+            "last_updated": datetime.utcnow().isoformat(),
+            "total_vectors": 0
+        }
+
+    def _new_manifest(self, user_id: int) -> Dict[str, Any]:
+        return {
+            "user_id": user_id,
+            "base": None,  # {"id", "index", "metadata"}
+            "deltas": [],  # [{"id", "index", "metadata", "count"}], oldest first
+            "tombstones": [],  # vector ids deleted since the segments holding them were written
+            "embedding_dim": self.embedding_dim,  # size of every vector in every segment
+            "embedding_model": settings.EMBEDDING_MODEL,  # model every vector in every segment was embedded with
+            "created_at": datetime.utcnow().isoformat(),
+            "last_updated": datetime.utcnow().isoformat(),
+            "total_vectors": 0
+        }
+
+    async def _read_manifest(self, user_id: int) -> tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Download a user's manifest, adopting a pre-segment (single blob pair) vector DB if needed"""
         try:
-            # Download existing vector DB
-            vector_data = await self.blob_service.download_blob(f"{vector_path}.index")
-            metadata_data = await self.blob_service.download_blob(f"{metadata_path}.json")
-            
-            # Load FAISS index from bytes
-            temp_vector_file = f"/tmp/{vector_path}.index"
-            async with aiofiles.open(temp_vector_file, 'wb') as f:
-                await f.write(vector_data)
-            
-            index = faiss.read_index(temp_vector_file)
-            
-            # Load metadata
-            metadata = json.loads(metadata_data.decode('utf-8'))
-            
-            # Clean up temp file
-            Path(temp_vector_file).unlink(missing_ok=True)
-            
-            return index, metadata
-            
-        except Exception as e:
-            print(f"No existing vector DB found for user {user_id}, creating new one: {e}")
-            # Create new index and metadata
-            index = faiss.IndexFlatIP(self.embedding_dim)
-            metadata = {
-                "user_id": user_id,
-                "documents": {},  # document_id -> document_info
-                "vector_to_doc": {},  # vector_index -> document_id
-                "created_at": datetime.utcnow().isoformat(),
-                "last_updated": datetime.utcnow().isoformat(),
-                "total_vectors": 0
-            }
-            return index, metadata
-
-    async def _save_user_vector_db(self, user_id: int, index: faiss.IndexFlatIP, metadata: Dict[str, Any]) -> bool:
-        """Save user's FAISS index and metadata to Azure Blob Storage"""
-        vector_path = self._get_user_vector_path(user_id)
-        metadata_path = self._get_user_metadata_path(user_id)
-        
+            manifest_data, etag = await self.blob_service.download_blob_with_etag(self._get_user_manifest_path(user_id))
+            return json.loads(manifest_data.decode('utf-8')), etag
+        except ResourceNotFoundError:
+            pass
+
+        legacy_index = f"{self._get_user_vector_path(user_id)}.index"
+        legacy_metadata = f"{self._get_user_metadata_path(user_id)}.json"
+        if not await self.blob_service.blob_exists(legacy_index):
+            return None, None
+
+        manifest = self._new_manifest(user_id)
+        manifest["base"] = {"id": "legacy", "index": legacy_index, "metadata": legacy_metadata}
+        # Single blob pairs predate the model switch, so they were embedded with the legacy model
+        manifest["embedding_model"] = _LEGACY_EMBEDDING_MODEL
+        manifest["embedding_dim"] = _LEGACY_EMBEDDING_DIM
         try:
-            # Save FAISS index to temp file
-            temp_vector_file = f"/tmp/{vector_path}.index"
-            faiss.write_index(index, temp_vector_file)
-            
-            # Read index file as bytes
-            async with aiofiles.open(temp_vector_file, 'rb') as f:
-                vector_data = await f.read()
-            
-            # Upload vector index to blob storage
-            await self.blob_service.upload_blob(
-                f"{vector_path}.index", 
-                vector_data, 
-                "application/octet-stream"
+            etag = await self._write_manifest(user_id, manifest, if_none_match=True)
+        except BlobConflictError:
+            # Another worker adopted the legacy blobs first; use its manifest
+            return await self._read_manifest(user_id)
+        return manifest, etag
+
+    async def _write_manifest(self, user_id: int, manifest: Dict[str, Any],
+                              if_match: Optional[str] = None, if_none_match: bool = False) -> str:
+        manifest["last_updated"] = datetime.utcnow().isoformat()
+        return await self.blob_service.upload_blob_with_etag(
+            self._get_user_manifest_path(user_id),
+            json.dumps(manifest, indent=2).encode('utf-8'),
+            "application/json",
+            if_match=if_match,
+            if_none_match=if_none_match
+        )
+
+    async def _commit_manifest(self, user_id: int, mutate: Callable[[Dict[str, Any]], bool]
+                               ) -> tuple[Dict[str, Any], Optional[str], Optional[str]]:
+        """
+        Read-modify-write a user's manifest with an If-Match on the ETag it was read at,
+        re-reading and re-applying mutate when another process wrote it in between.
+
+        mutate edits the manifest in place and returns False to skip the write.
+        Returns (manifest, etag it was read at, etag after the write).
+        """
+        for _ in range(_MANIFEST_COMMIT_ATTEMPTS):
+            manifest, etag = await self._read_manifest(user_id)
+            if manifest is None:
+                manifest = self._new_manifest(user_id)
+            manifest.setdefault("embedding_dim", self.embedding_dim)
+            manifest.setdefault("embedding_model", _LEGACY_EMBEDDING_MODEL)
+            if not mutate(manifest):
+                return manifest, etag, etag
+            try:
+                new_etag = await self._write_manifest(
+                    user_id, manifest, if_match=etag, if_none_match=etag is None
+                )
+                return manifest, etag, new_etag
+            except BlobConflictError:
+                print(f"Manifest for user {user_id} changed concurrently, retrying")
+        raise BlobConflictError(f"Could not commit manifest for user {user_id} after {_MANIFEST_COMMIT_ATTEMPTS} attempts")
+
+    async def _get_user_vector_db_etag(self, user_id: int) -> Optional[str]:
+        """Fetch the current version marker of a user's vector DB without downloading it"""
+        return await self.blob_service.get_blob_etag(self._get_user_manifest_path(user_id))
+
+    async def _load_user_vector_db(self, user_id: int) -> tuple[faiss.IndexIDMap2, Dict[str, Any]]:
+        """Load user's FAISS index and metadata, serving from the in-process cache when still current"""
+        cached = self.cache.get(user_id)
+        if cached is not None:
+            if self.cache.is_fresh(cached):
+                return cached.index, cached.metadata
+            try:
+                current_etag = await self._get_user_vector_db_etag(user_id)
+            except Exception as e:
+                print(f"Could not revalidate cached vector DB for user {user_id}: {e}")
+                current_etag = None
+            if current_etag is not None and current_etag == cached.etag:
+                self.cache.mark_validated(user_id)
+                return cached.index, cached.metadata
+            self.cache.invalidate(user_id)
+
+        index, metadata, etag = await self._download_user_vector_db(user_id)
+        # Build any quantized search copy up front so the cache accounts for it
+        self._search_index(index, metadata)
+        self.cache.put(user_id, index, metadata, etag)
+        return index, metadata
+
+    async def _download_user_vector_db(self, user_id: int, check_dimensions: bool = True
+                                       ) -> tuple[faiss.IndexIDMap2, Dict[str, Any], Optional[str]]:
+        """
+        Download the base segment and all delta segments of a user's vector DB and merge them.
+        check_dimensions=False loads vectors of any size, for a migration that only reads the chunks.
+        """
+        manifest, etag = await self._read_manifest(user_id)
+        if manifest is None:
+            print(f"No existing vector DB found for user {user_id}, creating new one")
+            return self._new_index(), self._new_metadata(user_id), None
+
+        embedding_dim = manifest.get("embedding_dim", self.embedding_dim)
+        if check_dimensions and embedding_dim != self.embedding_dim:
+            raise ValueError(
+                f"Vector DB for user {user_id} holds {manifest['embedding_dim']}-d vectors but "
+                f"EMBEDDING_DIMENSIONS is {self.embedding_dim}; re-embed it or change the setting"
             )
-            
+
+        base = manifest.get("base")
+        deltas = manifest.get("deltas", [])
+
+        # Fetch every segment concurrently
+        segment_blobs = []
+        if base:
+            segment_blobs.append(base)
+        segment_blobs.extend(deltas)
+        downloads = await asyncio.gather(*[self._download_segment(segment) for segment in segment_blobs])
+        for segment, (segment_index, _) in zip(segment_blobs, downloads):
+            # Manifests written before the size was recorded are checked segment by segment
+            if check_dimensions:
+                self._check_dimensions(segment_index, segment["index"])
+
+        metadata = self._new_metadata(user_id)
+        metadata["created_at"] = manifest.get("created_at", metadata["created_at"])
+        metadata["embedding_model"] = manifest.get("embedding_model", _LEGACY_EMBEDDING_MODEL)
+        if base:
+            base_index, metadata["chunks"] = downloads[0]
+            index = self._as_id_mapped(base_index)
+            metadata["total_vectors"] = index.ntotal
+            downloads = downloads[1:]
+        else:
+            index = self._new_index(embedding_dim)
+
+        for delta, (delta_index, delta_chunks) in zip(deltas, downloads):
+            self._merge_delta(index, metadata, delta["id"], delta_index, delta_chunks)
+
+        tombstones = manifest.get("tombstones", [])
+        if tombstones:
+            self._apply_tombstones(index, metadata, tombstones)
+
+        return index, metadata, etag
+
+    def _merge_delta(self, index: faiss.IndexIDMap2, metadata: Dict[str, Any], delta_id: str,
+                     delta_index: faiss.IndexIDMap2, delta_chunks: ChunkStore):
+        """Append a delta segment to a loaded vector DB"""
+        index.merge_from(self._as_id_mapped(delta_index))
+        metadata.pop("sq8_index", None)
+        metadata["chunks"].append(delta_chunks)
+        metadata["merged_deltas"].append(delta_id)
+        metadata["total_vectors"] = index.ntotal
+
+    def _apply_tombstones(self, index: faiss.IndexIDMap2, metadata: Dict[str, Any], vector_ids: List[int]):
+        """Drop deleted vectors from a loaded vector DB without touching storage"""
+        index.remove_ids(faiss.IDSelectorBatch(np.array(vector_ids, dtype=np.int64)))
+        metadata["chunks"].remove(vector_ids)
+        metadata.pop("sq8_index", None)
+
+        metadata["applied_tombstones"].extend(vector_ids)
+        metadata["total_vectors"] = index.ntotal
+
+    def _needs_compaction(self, manifest: Dict[str, Any]) -> bool:
+        """Rewrite the base once deltas pile up or too much of the stored data is deleted"""
+        if len(manifest["deltas"]) >= settings.USER_INDEX_MAX_DELTA_SEGMENTS:
+            return True
+        stored = manifest.get("total_vectors", 0)
+        tombstones = len(manifest.get("tombstones", []))
+        return stored > 0 and tombstones / stored > settings.USER_INDEX_TOMBSTONE_COMPACTION_RATIO
+
+    async def _append_delta_segment(self, user_id: int, embeddings: np.ndarray, delta_chunks: ChunkStore,
+                                    embedding_model: str):
+        """Persist newly ingested vectors as a small delta segment; only the new chunks are uploaded"""
+        delta_index = self._new_index()
+        delta_index.add_with_ids(embeddings, delta_chunks.columns["vector_index"])
+
+        # Write the segment to fresh blob names before it becomes visible through the manifest
+        segment = self._new_segment_paths(user_id, "delta")
+        await self._upload_segment(segment, delta_index, delta_chunks)
+
+        def append(manifest: Dict[str, Any]) -> bool:
+            if manifest["embedding_model"] != embedding_model:
+                # The DB was migrated to another model after these chunks were embedded
+                raise ValueError(
+                    f"Vector DB for user {user_id} is embedded with {manifest['embedding_model']}, "
+                    f"not {embedding_model}"
+                )
+            manifest["deltas"].append({**segment, "count": delta_index.ntotal})
+            manifest["total_vectors"] = manifest.get("total_vectors", 0) + delta_index.ntotal
+            return True
+
+        manifest, manifest_etag, new_etag = await self._commit_manifest(user_id, append)
+
+        # Fold the delta into the cached copy if it was current, rather than refetching everything
+        cached = self.cache.peek(user_id)
+        if cached is not None and manifest_etag is not None and cached.etag == manifest_etag:
+            self._merge_delta(cached.index, cached.metadata, segment["id"], delta_index, delta_chunks)
+            self.cache.put(user_id, cached.index, cached.metadata, new_etag)
+        else:
+            self.cache.invalidate(user_id)
+
+        if self._needs_compaction(manifest):
+            self._schedule_compaction(user_id)
+
+    async def _add_tombstones(self, user_id: int, vector_ids: List[int]):
+        """Mark vectors as deleted with a single small manifest write; segments are rewritten lazily"""
+        def tombstone(manifest: Dict[str, Any]) -> bool:
+            if manifest["base"] is None and not manifest["deltas"]:
+                return False
+            manifest["tombstones"] = sorted(set(manifest.get("tombstones", [])) | set(vector_ids))
+            return True
+
+        manifest, manifest_etag, new_etag = await self._commit_manifest(user_id, tombstone)
+        if new_etag == manifest_etag:
+            return
+
+        cached = self.cache.peek(user_id)
+        if cached is not None and manifest_etag is not None and cached.etag == manifest_etag:
+            self._apply_tombstones(cached.index, cached.metadata, vector_ids)
+            self.cache.put(user_id, cached.index, cached.metadata, new_etag)
+        else:
+            self.cache.invalidate(user_id)
+
+        if self._needs_compaction(manifest):
+            self._schedule_compaction(user_id)
+
+    def _schedule_compaction(self, user_id: int):
+        """Merge a user's delta segments into a new base segment in the background"""
+        tasks = _loop_state().compaction_tasks
+        task = tasks.get(user_id)
+        if task is not None and not task.done():
+            return
+        tasks[user_id] = asyncio.create_task(self._compact_user_vector_db(user_id))
+
+    async def _compact_user_vector_db(self, user_id: int) -> bool:
+        try:
+            async with _user_lock(user_id):
+                index, metadata = await self._load_user_vector_db(user_id)
+                if not metadata.get("merged_deltas") and not metadata.get("applied_tombstones"):
+                    return True
+                return await self._save_user_vector_db(user_id, index, metadata)
+        except Exception as e:
+            print(f"Error compacting vector DB for user {user_id}: {e}")
+            return False
+
+    async def _save_user_vector_db(self, user_id: int, index: faiss.IndexIDMap2, metadata: Dict[str, Any]) -> bool:
+        """
+        Write the full in-memory state as a new base segment, replacing the deltas and
+        tombstones it already contains. A re-embedding migration sets metadata's
+        embedding_model to the new model and "migrated_from" to the old one; that save
+        only succeeds if every delta in the manifest was folded into this state, and
+        records the new model and vector size.
+        """
+        try:
             # Update metadata timestamp
             metadata["last_updated"] = datetime.utcnow().isoformat()
             metadata["total_vectors"] = index.ntotal
-            
-            # Upload metadata to blob storage
-            metadata_json = json.dumps(metadata, indent=2).encode('utf-8')
-            await self.blob_service.upload_blob(
-                f"{metadata_path}.json", 
-                metadata_json, 
-                "application/json"
-            )
-            
-            # Clean up temp file
-            Path(temp_vector_file).unlink(missing_ok=True)
+
+            merged_deltas = set(metadata.get("merged_deltas", []))
+            applied_tombstones = set(metadata.get("applied_tombstones", []))
+
+            # Upload the new base segment under fresh names so concurrent readers of the old one are unaffected
+            segment = self._new_segment_paths(user_id, "base")
+            await self._upload_segment(segment, index, metadata["chunks"])
+
+            # Swap the manifest over, keeping any delta or tombstone that landed after this state was loaded
+            replaced: List[Dict[str, Any]] = []
+            old_base: List[Dict[str, Any]] = []
+
+            def swap_base(manifest: Dict[str, Any]) -> bool:
+                if manifest["embedding_model"] != metadata["embedding_model"] or manifest["embedding_dim"] != index.d:
+                    if (metadata.get("migrated_from") != manifest["embedding_model"]
+                            or any(d["id"] not in merged_deltas for d in manifest["deltas"])):
+                        raise ValueError(f"Vector DB for user {user_id} changed while this state was being written")
+                    manifest["embedding_model"] = metadata["embedding_model"]
+                    manifest["embedding_dim"] = index.d
+                old_base[:] = [manifest["base"]] if manifest.get("base") else []
+                replaced[:] = [d for d in manifest["deltas"] if d["id"] in merged_deltas]
+                manifest["base"] = segment
+                manifest["deltas"] = [d for d in manifest["deltas"] if d["id"] not in merged_deltas]
+                manifest["tombstones"] = [t for t in manifest.get("tombstones", []) if t not in applied_tombstones]
+                manifest["total_vectors"] = index.ntotal + sum(d["count"] for d in manifest["deltas"])
+                return True
+
+            manifest, _, etag = await self._commit_manifest(user_id, swap_base)
+            remaining = manifest["deltas"]
+            metadata.pop("migrated_from", None)
+
+            # Best-effort cleanup of segments no longer referenced by the manifest
+            stale = replaced + old_base
+            await asyncio.gather(*[
+                self.blob_service.delete_blob(name)
+                for s in stale for name in self._segment_blobs(s)
+            ], return_exceptions=True)
+
+            if remaining or manifest["tombstones"]:
+                self.cache.invalidate(user_id)
+            else:
+                # Keep serving this user from RAM at the version we just wrote
+                metadata["merged_deltas"] = []
+                metadata["applied_tombstones"] = []
+                self.cache.put(user_id, index, metadata, etag)
             
             return True
             
         except Exception as e:
             print(f"Error saving vector DB for user {user_id}: {e}")
+            # The cached copy may hold in-place changes that never reached storage
+            self.cache.invalidate(user_id)
             return False
 
     async def create_user_index(self, user_id: int) -> bool:
         """Create a new FAISS index for a user if it doesn't exist"""
         try:
-            # This will create a new index if one doesn't exist
-            index, metadata = await self._load_user_vector_db(user_id)
-            
-            # Save the new index if it was just created
-            if metadata["total_vectors"] == 0:
-                await self._save_user_vector_db(user_id, index, metadata)
+            async with _user_lock(user_id):
+                # This will create a new index if one doesn't exist
+                index, metadata = await self._load_user_vector_db(user_id)
+
+                # Save the new index if it was just created
+                if metadata["total_vectors"] == 0:
+                    await self._save_user_vector_db(user_id, index, metadata)
             
             return True
         except Exception as e:
             print(f"Error creating index for user {user_id}: {e}")
             return False
 
+    async def get_user_embedding_model(self, user_id: int) -> str:
+        """Model a user's vector DB is embedded with; new chunks and queries must use the same one"""
+        _, metadata = await self._load_user_vector_db(user_id)
+        return metadata["embedding_model"]
+
     async def add_document_chunks(self, user_id: int, chunks: List[Dict[str, Any]], embeddings: List[List[float]], 
-                                drug_data: Dict[str, Any], file_data: Dict[str, Any]) -> List[str]:
-        """Add document chunks with embeddings to user's FAISS index"""
+                                drug_data: Dict[str, Any], file_data: Dict[str, Any],
+                                embedding_model: Optional[str] = None) -> List[str]:
+        """
+        Add document chunks with embeddings to user's FAISS index as a new delta segment.
+        embedding_model is the model the embeddings came from (EMBEDDING_MODEL by default);
+        it must match the model of the user's vector DB.
+        """
+        embedding_model = embedding_model or settings.EMBEDDING_MODEL
+        if not chunks:
+            return []
         try:
-            # Load user's vector DB
-            index, metadata = await self._load_user_vector_db(user_id)
-            
             embeddings_array = np.array(embeddings, dtype=np.float32)
+            if embeddings_array.ndim != 2 or embeddings_array.shape[1] != self.embedding_dim:
+                raise ValueError(f"Expected {self.embedding_dim}-d embeddings, got shape {embeddings_array.shape}")
             faiss.normalize_L2(embeddings_array)
             
             vector_ids = []
-            current_vector_count = index.ntotal
+            records = []
             
             # Prepare document metadata
             for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
                 doc_id = str(uuid.uuid4())
                 vector_ids.append(doc_id)
-                vector_index = current_vector_count + i
                 
                 # Store document metadata
-                metadata["documents"][doc_id] = {
-                    "vector_index": vector_index,
+                records.append({
+                    "doc_id": doc_id,
+                    "vector_index": _vector_id(doc_id),
                     "content": chunk["text"],
                     "drug_id": drug_data["id"],
                     "drug_title": drug_data["title"],
                     "file_id": file_data["id"],
                     "filename": file_data["original_filename"],
-                    "chunk_index": i,
+                    "chunk_index": chunk.get("chunk_index", i),
                     "page_number": chunk.get("page_number", 0),
+                    "section_title": chunk.get("section_title", ""),
                     "user_id": user_id,
                     "created_at": datetime.utcnow().isoformat(),
                     "therapeutic_area": drug_data.get("therapeutic_area", ""),
@@ -162,21 +558,55 @@ class VectorDBService:
                     "submission_pathway": drug_data.get("submission_pathway", ""),
                     "word_count": chunk.get("word_count", 0),
                     "char_count": chunk.get("char_count", 0)
-                }
-                
-                # Map vector index to document ID
-                metadata["vector_to_doc"][str(vector_index)] = doc_id
-            
-            # Add vectors to FAISS index
-            index.add(embeddings_array)
-            
-            # Save updated index and metadata
-            await self._save_user_vector_db(user_id, index, metadata)
+                })
             
+            # Queue the batch; whoever holds the user's lock writes every queued batch as one delta,
+            # so the files of one upload being ingested at once usually share a segment
+            pending = _PendingAddition(
+                embeddings_array, ChunkStore.from_records(records), embedding_model, asyncio.get_running_loop().create_future()
+            )
+            _loop_state().pending_additions.setdefault(user_id, []).append(pending)
+            try:
+                async with _user_lock(user_id):
+                    if not pending.done.done():
+                        await self._flush_pending_additions(user_id)
+                await pending.done
+            except asyncio.CancelledError:
+                # Nobody is left to read this caller's outcome
+                if pending.done.done() and not pending.done.cancelled():
+                    pending.done.exception()
+                raise
+
             return vector_ids
             
         except Exception as e:
             print(f"Error adding documents to FAISS index: {e}")
+            self.cache.invalidate(user_id)
+            raise
+
+    async def _flush_pending_additions(self, user_id: int):
+        """Write all queued additions for a user as a single delta segment; caller holds the user's lock"""
+        batch = _loop_state().pending_additions.pop(user_id, [])
+        try:
+            # Additions embedded with different models (around a migration) cannot share a segment
+            for model in dict.fromkeys(p.embedding_model for p in batch):
+                group = [p for p in batch if p.embedding_model == model]
+                try:
+                    embeddings = np.concatenate([p.embeddings for p in group])
+                    await self._append_delta_segment(user_id, embeddings, ChunkStore.concat([p.chunks for p in group]), model)
+                except Exception as e:
+                    for p in group:
+                        p.done.set_exception(e)
+                else:
+                    for p in group:
+                        p.done.set_result(None)
+        except BaseException:
+            # The flushing caller was cancelled. The other callers in the batch only wait on their
+            # futures; whether the segment landed is unknown, so fail them rather than re-queue
+            error = RuntimeError(f"Writing queued chunks for user {user_id} was cancelled")
+            for p in batch:
+                if not p.done.done():
+                    p.done.set_exception(error)
             raise
 
     async def search_user_documents(self, user_id: int, query: str, drug_id: Optional[int] = None, 
@@ -189,33 +619,44 @@ class VectorDBService:
             if index.ntotal == 0:
                 return []
             
-            # Embedding for the query
-            query_embedding = await self.embedding_service.generate_embedding(query)
+            # Embed the query with the model the user's vectors came from; without it there is nothing to search with
+            try:
+                query_embedding = await self.embedding_service.generate_embedding(query, model=metadata["embedding_model"])
+            except EmbeddingUnavailableError:
+                return []
             
             query_vector = np.array([query_embedding], dtype=np.float32)
             faiss.normalize_L2(query_vector)
             
-            search_k = min(index.ntotal, top_k * 3)  
-            scores, vector_indices = index.search(query_vector, search_k)
+            chunks = metadata["chunks"]
+            params = None
+            search_k = min(index.ntotal, top_k)
+            if drug_id:
+                # Restrict the search to the drug's vectors up front instead of over-fetching and filtering
+                candidate_ids = chunks.vector_ids_where("drug_id", drug_id)
+                if not len(candidate_ids):
+                    return []
+                selector = faiss.IDSelectorBatch(candidate_ids)
+                params = faiss.SearchParameters(sel=selector)
+                search_k = min(len(candidate_ids), top_k)
+
+            search_index = self._search_index(index, metadata)
+            if search_index is index:
+                scores, vector_indices = index.search(query_vector, search_k, params=params)
+                scores, vector_indices = scores[0], vector_indices[0]
+            else:
+                # Over-fetch from the 8-bit codes, then order the candidates by their exact scores
+                fetch_k = min(search_index.ntotal, search_k * settings.USER_INDEX_RERANK_FACTOR)
+                _, candidates = search_index.search(query_vector, fetch_k, params=params)
+                scores, vector_indices = rerank(index, query_vector, candidates[0], search_k)
             
-            # Process results and apply filters
             search_results = []
-            for score, vector_idx in zip(scores[0], vector_indices[0]):
-                if vector_idx == -1:  # FAISS returns -1 for empty slots
-                    continue
-                    
-                doc_id = metadata["vector_to_doc"].get(str(vector_idx))
-                if not doc_id:
-                    continue
-                    
-                doc_info = metadata["documents"].get(doc_id)
-                if not doc_info:
-                    continue
-                
-                # Apply drug_id filter if specified
-                if drug_id and doc_info["drug_id"] != drug_id:
+            for score, row in zip(scores, chunks.rows_for(vector_indices)):
+                if row == -1:  # Empty FAISS slot or a vector with no metadata
                     continue
                 
+                # Only the rows actually returned are materialized
+                doc_info = chunks.row(row)
                 search_results.append({
                     "content": doc_info["content"],
                     "drug_id": doc_info["drug_id"],
@@ -228,9 +669,6 @@ class VectorDBService:
                     "drug_type": doc_info.get("drug_type", ""),
                     "created_at": doc_info.get("created_at", "")
                 })
-                
-                if len(search_results) >= top_k:
-                    break
             
             return search_results
             
@@ -241,112 +679,35 @@ class VectorDBService:
     async def delete_drug_documents(self, user_id: int, drug_id: int) -> bool:
         """Delete all documents related to a specific drug"""
         try:
-            # Load user's vector DB
-            index, metadata = await self._load_user_vector_db(user_id)
-            
-            # Find documents to delete
-            docs_to_delete = []
-            for doc_id, doc_info in metadata["documents"].items():
-                if doc_info["drug_id"] == drug_id:
-                    docs_to_delete.append(doc_id)
-            
-            if not docs_to_delete:
-                return True
-            
-            # Remove documents from metadata
-            vector_indices_to_remove = []
-            for doc_id in docs_to_delete:
-                doc_info = metadata["documents"][doc_id]
-                vector_idx = doc_info["vector_index"]
-                vector_indices_to_remove.append(vector_idx)
-                
-                # Remove from metadata
-                del metadata["documents"][doc_id]
-                del metadata["vector_to_doc"][str(vector_idx)]
-            
-            # Rebuild FAISS index without deleted vectors
-            await self._rebuild_index_without_vectors(user_id, index, metadata, vector_indices_to_remove)
-            
-            return True
-            
+            return await self._delete_documents(user_id, "drug_id", drug_id)
         except Exception as e:
             print(f"Error deleting drug documents: {e}")
+            self.cache.invalidate(user_id)
             return False
 
     async def delete_file_documents(self, user_id: int, file_id: int) -> bool:
         """Delete all documents related to a specific file"""
         try:
-            # Load user's vector DB
-            index, metadata = await self._load_user_vector_db(user_id)
-            
-            # Find documents to delete
-            docs_to_delete = []
-            for doc_id, doc_info in metadata["documents"].items():
-                if doc_info["file_id"] == file_id:
-                    docs_to_delete.append(doc_id)
-            
-            if not docs_to_delete:
-                return True
-            
-            # Remove documents from metadata
-            vector_indices_to_remove = []
-            for doc_id in docs_to_delete:
-                doc_info = metadata["documents"][doc_id]
-                vector_idx = doc_info["vector_index"]
-                vector_indices_to_remove.append(vector_idx)
-                
-                # Remove from metadata
-                del metadata["documents"][doc_id]
-                del metadata["vector_to_doc"][str(vector_idx)]
-            
-            # Rebuild FAISS index without deleted vectors
-            await self._rebuild_index_without_vectors(user_id, index, metadata, vector_indices_to_remove)
-            
-            return True
-            
+            return await self._delete_documents(user_id, "file_id", file_id)
         except Exception as e:
             print(f"Error deleting file documents: {e}")
+            self.cache.invalidate(user_id)
             return False
 
-    async def _rebuild_index_without_vectors(self, user_id: int, old_index: faiss.IndexFlatIP, 
-                                           metadata: Dict[str, Any], vector_indices_to_remove: List[int]):
-        """Rebuild FAISS index excluding specified vector indices"""
-        try:
-            # Get all vectors from old index
-            all_vectors = old_index.reconstruct_n(0, old_index.ntotal)
-            
-            # Create mask for vectors to keep
-            keep_mask = np.ones(old_index.ntotal, dtype=bool)
-            for idx in vector_indices_to_remove:
-                if idx < len(keep_mask):
-                    keep_mask[idx] = False
-            
-            # Keep only non-deleted vectors
-            kept_vectors = all_vectors[keep_mask]
-            
-            # Create new index
-            new_index = faiss.IndexFlatIP(self.embedding_dim)
-            if len(kept_vectors) > 0:
-                new_index.add(kept_vectors)
-            
-            # Update vector indices in metadata
-            new_metadata = metadata.copy()
-            new_metadata["vector_to_doc"] = {}
-            
-            new_vector_idx = 0
-            for old_vector_idx in range(old_index.ntotal):
-                if keep_mask[old_vector_idx]:
-                    # Find document ID for this vector
-                    doc_id = metadata["vector_to_doc"].get(str(old_vector_idx))
-                    if doc_id and doc_id in new_metadata["documents"]:
-                        # Update vector index in document metadata
-                        new_metadata["documents"][doc_id]["vector_index"] = new_vector_idx
-                        new_metadata["vector_to_doc"][str(new_vector_idx)] = doc_id
-                        new_vector_idx += 1
-            
-            # Save rebuilt index
-            await self._save_user_vector_db(user_id, new_index, new_metadata)
-            
-        except Exception as e:
-            print(f"Error rebuilding index: {e}")
-            raise
\ No newline at end of file
+    async def _delete_documents(self, user_id: int, field: str, value: int) -> bool:
+        """Tombstone every chunk whose metadata field matches value"""
+        async with _user_lock(user_id):
+            # Let queued additions land first so their chunks are deleted too
+            await self._flush_pending_additions(user_id)
+
+            # Load user's vector DB
+            index, metadata = await self._load_user_vector_db(user_id)
+
+            # Find vectors to delete
+            vector_ids = metadata["chunks"].vector_ids_where(field, value).tolist()
+
+            if not vector_ids:
+                return True
+
+            await self._add_tombstones(user_id, vector_ids)
+            return True
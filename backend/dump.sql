@@ -144,6 +144,19 @@ INSERT INTO drug_files VALUES(9,18,2,'2_18_88b96b3e-2e88-42dc-ba23-3c59fabed4f3.
 INSERT INTO drug_files VALUES(10,19,2,'2_19_8b7d5bab-f5d7-4053-8642-4279471f563b.pdf','Omar El Malak Resume 2025.pdf',115927,'application/pdf','https://ourpathsvectordb.blob.core.windows.net/ourpathsdata/2_19_8b7d5bab-f5d7-4053-8642-4279471f563b.pdf','["689ea8b1-6bb6-4d4a-ba25-1653285afecb"]',1,'pdf','completed','2025-08-28 18:02:37');
 INSERT INTO drug_files VALUES(11,20,2,'2_20_7dc5ae5b-5bb3-494d-9246-0560b4462ae3.pdf','Omar El Malak Resume 2025.pdf',115927,'application/pdf','https://ourpathsvectordb.blob.core.windows.net/ourpathsdata/2_20_7dc5ae5b-5bb3-494d-9246-0560b4462ae3.pdf','["91f9af8a-6e80-40b5-b58e-483f3dc4ee8b"]',1,'pdf','completed','2025-08-28 18:04:30');
 INSERT INTO drug_files VALUES(12,21,2,'2_21_dd837b9a-df08-4bc4-9805-42219cff6cff.pdf','Omar El Malak Resume 2025.pdf',115927,'application/pdf','https://ourpathsvectordb.blob.core.windows.net/ourpathsdata/2_21_dd837b9a-df08-4bc4-9805-42219cff6cff.pdf','["eb20e97e-0973-46e3-bac1-5d7b4f19d6b6"]',1,'pdf','completed','2025-08-28 18:11:42');
+CREATE TABLE ingestion_jobs (
+    id SERIAL PRIMARY KEY,
+    drug_file_id INTEGER NOT NULL UNIQUE REFERENCES drug_files(id) ON DELETE CASCADE,
+    drug_id INTEGER NOT NULL REFERENCES drugs(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    status VARCHAR(50) NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    run_after TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    lease_expires_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
 CREATE TABLE organization_drug_association (
     organization_id INTEGER NOT NULL REFERENCES organizations(id) ON DELETE CASCADE,
     drug_id INTEGER NOT NULL REFERENCES drugs(id) ON DELETE CASCADE,
@@ -152,4 +165,6 @@ CREATE TABLE organization_drug_association (
 CREATE INDEX ix_organizations_name ON organizations (name);
 CREATE INDEX ix_users_organization_id ON users (organization_id);
 CREATE UNIQUE INDEX ix_users_email ON users (email);
-CREATE INDEX ix_drug_files_id ON drug_files (id);
\ No newline at end of file
+CREATE INDEX ix_drug_files_id ON drug_files (id);
+CREATE INDEX ix_ingestion_jobs_drug_id ON ingestion_jobs (drug_id);
+CREATE INDEX ix_ingestion_jobs_status_run_after ON ingestion_jobs (status, run_after);
\ No newline at end of file
@@ -17,8 +17,13 @@ load_dotenv()
 from config import (
     UNIFIED_INDEX_PATH,
     UNIFIED_METADATA_PATH,
+    EMBEDDING_MODEL,
     EMBEDDING_MODEL_DIM,
+    INDEX_INFO_PATH,
+    ANN_INDEX_PATH,
+    ANN_PARAMS_PATH,
 )
+from index_tiers import build_tier_index, factory_string, flat_vectors, search_params
 from azure.storage.blob import BlobServiceClient
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
@@ -74,6 +79,11 @@ def load_embeddings():
     download_blob("unified_meta.pkl", UNIFIED_METADATA_PATH)
 
     _global_faiss_index = faiss.read_index(UNIFIED_INDEX_PATH)
+    if _global_faiss_index.d != EMBEDDING_MODEL_DIM:
+        raise ValueError(
+            f"unified.index holds {_global_faiss_index.d}-d vectors but EMBEDDING_DIMENSIONS is "
+            f"{EMBEDDING_MODEL_DIM}; rebuild the index or change the setting"
+        )
     with open(UNIFIED_METADATA_PATH, "rb") as f:
         _global_metadata = pickle.load(f)
 
@@ -133,12 +143,60 @@ def flush_embeddings_to_azure():
     with open(UNIFIED_METADATA_PATH, "wb") as f:
         pickle.dump(_global_metadata, f)
 
+    # Record what the vectors are so readers can check they embed queries the same way
+    with open(INDEX_INFO_PATH, "w") as f:
+        json.dump({
+            "embedding_model": EMBEDDING_MODEL,
+            "dimensions": _global_faiss_index.d,
+            "ntotal": _global_faiss_index.ntotal,
+            "updated_at": datetime.utcnow().isoformat(),
+        }, f, indent=2)
+
     # Upload to Azure
     upload_blob(UNIFIED_INDEX_PATH, "unified.index")
     upload_blob(UNIFIED_METADATA_PATH, "unified_meta.pkl")
+    upload_blob(INDEX_INFO_PATH, "unified_index_info.json")
 
     print(f"Flushed {_global_faiss_index.ntotal} vectors and metadata to Azure.", flush=True)
 
+
+def publish_ann_index(tier: str):
+    """
+    Train an ANN tier from the flat unified index and upload it next to it.
+
+    The flat index stays the source of truth that ingestion appends to; the
+    ANN index is rebuilt from it on every publish. Its search settings
+    (nprobe/efSearch) are written into the index and into a params blob.
+    """
+    if _global_faiss_index is None or _global_faiss_index.ntotal == 0:
+        print("No embeddings to index.", flush=True)
+        return
+
+    if tier == "flat":
+        # Retrievers fall back to the flat index once no ANN index is published
+        for blob_name in ("unified_ann.index", "unified_ann_params.json"):
+            if blob_exists(blob_name):
+                container_client.delete_blob(blob_name)
+        return
+
+    index = build_tier_index(flat_vectors(_global_faiss_index), tier)
+    params = {
+        "tier": tier,
+        "factory": factory_string(tier, index.ntotal),
+        "search_params": search_params(tier),
+        "ntotal": index.ntotal,
+        "built_at": datetime.utcnow().isoformat(),
+    }
+
+    faiss.write_index(index, ANN_INDEX_PATH)
+    with open(ANN_PARAMS_PATH, "w") as f:
+        json.dump(params, f, indent=2)
+
+    upload_blob(ANN_INDEX_PATH, "unified_ann.index")
+    upload_blob(ANN_PARAMS_PATH, "unified_ann_params.json")
+
+    print(f"Published {params['factory']} index with {index.ntotal} vectors to Azure.", flush=True)
+
 def upload_jsonl_to_blob(summaries, blob_name="summaries.jsonl"):
     """Uploads a list of summaries to an Azure Blob Storage container as a JSONL file"""
 
@@ -8,10 +8,32 @@ INPUT_CSV = os.path.join(
     BASE_DIR, "Data", "scrapedData", "cdaDownloads", "cda_amc_cleaned.csv"
 )
 EMBEDDING_MODEL = "text-embedding-3-small"
-EMBEDDING_MODEL_DIM = 1536
+# Output size requested from the text-embedding-3 model; the unified index is built at this size
+EMBEDDING_MODEL_DIM = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))
 VECTOR_DIR = os.path.join(BASE_DIR, "Data", "vectorDB")
 UNIFIED_INDEX_PATH = os.path.join(VECTOR_DIR, "unified.index")
 UNIFIED_METADATA_PATH = os.path.join(VECTOR_DIR, "unified_meta.pkl")
+INDEX_INFO_PATH = os.path.join(VECTOR_DIR, "unified_index_info.json")
+
+# ANN tier published next to the flat unified index ("flat" publishes none)
+# Tiers: flat, ivf_flat, ivf_pq, hnsw
+INDEX_TIER = os.getenv("CDA_INDEX_TIER", "flat")
+ANN_INDEX_PATH = os.path.join(VECTOR_DIR, "unified_ann.index")
+ANN_PARAMS_PATH = os.path.join(VECTOR_DIR, "unified_ann_params.json")
+INDEX_REPORT_PATH = os.path.join(VECTOR_DIR, "index_tier_report.json")
+IVF_NLIST = int(os.getenv("CDA_IVF_NLIST", "0"))  # 0 picks ~4 * sqrt(corpus size)
+IVF_NPROBE = int(os.getenv("CDA_IVF_NPROBE", "16"))
+PQ_M = int(os.getenv("CDA_PQ_M", "64"))  # sub-quantizers; must divide EMBEDDING_MODEL_DIM
+HNSW_M = int(os.getenv("CDA_HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("CDA_HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("CDA_HNSW_EF_SEARCH", "64"))
+# Batched chunk embedding: per-request limits, parallel requests and retries
+EMBED_BATCH_MAX_INPUTS = int(os.getenv("EMBED_BATCH_MAX_INPUTS", "2048"))
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "250000"))  # API cap is 300k per request
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(BASE_DIR, "Data", "embeddingCache", "embeddings.sqlite3"))
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
 AZURE_OUTPUT_BLOB_NAME = "summaries_batch.jsonl"
 AZURE_OUTPUT_LOCAL_TEMP = "summaries_batch.jsonl"
 
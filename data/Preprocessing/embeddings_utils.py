@@ -1,13 +1,39 @@
-import re
-import tiktoken
+import os
+import sys
+import time
+import random
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 from dotenv import load_dotenv
-from config import EMBEDDING_MODEL
+from config import (
+    EMBEDDING_MODEL,
+    EMBEDDING_MODEL_DIM,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MAX_BYTES,
+    EMBED_BATCH_MAX_INPUTS,
+    EMBED_BATCH_MAX_TOKENS,
+    EMBED_CONCURRENCY,
+    EMBED_MAX_RETRIES,
+)
+
+# Chunking and the embedding cache are shared with the backend's upload pipeline
+backend_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "backend"))
+if backend_folder not in sys.path:
+    sys.path.insert(0, backend_folder)
+from app.services.vectorDBServices.embedding_cache import EmbeddingCache
+from app.services.vectorDBServices.chunking import chunk_lines, get_encoder
 
 load_dotenv()
 client = OpenAI(api_key=__import__("os").getenv("OPENAI_API_KEY"))
-enc = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+enc = get_encoder(EMBEDDING_MODEL)
+# Chunk texts and canned queries repeat across runs; embed each one only once
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_BYTES)
+
+# Only the text-embedding-3 models accept a dimensions parameter
+DIMENSIONS_KWARGS = {"dimensions": EMBEDDING_MODEL_DIM} if EMBEDDING_MODEL.startswith("text-embedding-3") else {}
+# Vectors of different sizes from the same model must not share cache entries
+CACHE_MODEL = f"{EMBEDDING_MODEL}@{EMBEDDING_MODEL_DIM}" if DIMENSIONS_KWARGS else EMBEDDING_MODEL
 
 # Model limits
 MAX_EMBED_TOKENS = 8191
@@ -20,77 +46,94 @@ def chunk_text(blocks, max_tokens=650, overlap=50):
     """
     Splits a list of {'source','page','text'} dicts into semantic chunks
     of <= max_tokens tokens, with an overlap of `overlap` tokens.
+    Uses the same TokenChunker as user uploads in the backend.
     """
-    chunks = []
-    current_tokens = []
-    current_meta   = {}
-    current_header = "Untitled Section"
-
-    def flush_chunk():
-        if not current_tokens:
-            return
-        text = enc.decode(current_tokens)
-        chunks.append({
-            **current_meta,
-            "section_title": current_header,
-            "text": text
-        })
-
-    for block in blocks:
-        header = block["text"]
-        is_header = bool(re.match(r"^[A-Z][A-Z\s\d:]{3,}$", header) or
-                         re.match(r"^\d+\.\s+[A-Z]", header))
-        if is_header:
-            # flush previous chunk
-            flush_chunk()
-            # start new
-            current_header = header
-            current_tokens = []
-            current_meta   = {"source": block["source"], "page": block["page"]}
-            continue
-
-        # tokenize this line
-        line_tokens = enc.encode(block["text"] + " ")
-        if not current_meta:
-            current_meta = {"source": block["source"], "page": block["page"]}
-
-        # if adding would exceed, flush with overlap
-        if len(current_tokens) + len(line_tokens) > max_tokens:
-            # keep last `overlap` tokens as the start of the next chunk
-            overlap_tokens = current_tokens[-overlap:]
-            flush_chunk()
-            current_tokens = overlap_tokens
-
-        current_tokens.extend(line_tokens)
-
-    # final flush
-    flush_chunk()
+    chunks = chunk_lines(blocks, enc, max_tokens, overlap)
     print(f"Created {len(chunks)} chunks (≈{max_tokens} tokens each).", flush=True)
     return chunks
 
 def embed_text(text: str) -> np.ndarray:
     """Embeds a single text string, ensuring it's under the token limit."""
+    cached = embedding_cache.get(CACHE_MODEL, text)
+    if cached is not None:
+        return cached
+    return _embed_uncached(text)
+
+def _embed_uncached(text: str) -> np.ndarray:
     if not text.strip():
         raise ValueError("Text must be non-empty.")
     tok_count = count_tokens(text)
     if tok_count > MAX_EMBED_TOKENS:
         raise ValueError(f"Text exceeds token limit ({tok_count} > {MAX_EMBED_TOKENS}).")
 
-    resp = client.embeddings.create(input=[text], model=EMBEDDING_MODEL)
-    return np.array(resp.data[0].embedding, dtype="float32")
+    resp = client.embeddings.create(input=[text], model=EMBEDDING_MODEL, **DIMENSIONS_KWARGS)
+    vector = np.array(resp.data[0].embedding, dtype="float32")
+    embedding_cache.put(CACHE_MODEL, text, vector)
+    return vector
 
-def embed_chunks(chunks):
+def _pack_batches(items):
     """
-    Embeds each chunk safely. Since chunk_text guarantees 
-    token ≤ max_tokens, we don’t need to re-split here.
+    Groups (position, text, tokens) items into requests that stay within
+    EMBED_BATCH_MAX_INPUTS inputs and EMBED_BATCH_MAX_TOKENS tokens.
     """
-    embedded = []
-    for idx, c in enumerate(chunks):
+    batches, current, current_tokens = [], [], 0
+    for item in items:
+        tokens = item[2]
+        if current and (len(current) >= EMBED_BATCH_MAX_INPUTS or current_tokens + tokens > EMBED_BATCH_MAX_TOKENS):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(item)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def _embed_batch(texts):
+    """One embeddings request for many texts, retried with exponential backoff and jitter."""
+    for attempt in range(EMBED_MAX_RETRIES):
         try:
-            vec = embed_text(c["text"])
-            embedded.append({**c, "embedding": vec})
+            resp = client.embeddings.create(input=texts, model=EMBEDDING_MODEL, **DIMENSIONS_KWARGS)
+            return [np.array(d.embedding, dtype="float32") for d in sorted(resp.data, key=lambda d: d.index)]
         except Exception as e:
-            print(f"[embed_chunks] skip chunk {idx}: {e}", flush=True)
+            if attempt == EMBED_MAX_RETRIES - 1:
+                raise
+            delay = min(2 ** attempt, 30) + random.uniform(0, 1)
+            print(f"[embed_chunks] batch of {len(texts)} failed ({e}), retrying in {delay:.1f}s", flush=True)
+            time.sleep(delay)
+
+def embed_chunks(chunks):
+    """
+    Embeds chunks in token-budgeted batches, a few requests at a time.
+    Since chunk_text guarantees token ≤ max_tokens, we don’t need to re-split here.
+    A batch that still fails after EMBED_MAX_RETRIES raises instead of dropping its chunks.
+    """
+    vectors = embedding_cache.get_many(CACHE_MODEL, [c["text"] for c in chunks])
+
+    pending = []
+    for idx, (c, vec) in enumerate(zip(chunks, vectors)):
+        if vec is not None:
+            continue
+        text = c["text"]
+        # chunk_text already counted the tokens of its chunks
+        tok_count = (c.get("token_count") or count_tokens(text)) if text.strip() else 0
+        if not tok_count or tok_count > MAX_EMBED_TOKENS:
+            print(f"[embed_chunks] skip chunk {idx}: empty or over {MAX_EMBED_TOKENS} tokens", flush=True)
+            continue
+        pending.append((idx, text, tok_count))
+
+    batches = _pack_batches(pending)
+    if batches:
+        print(f"[embed_chunks] embedding {len(pending)} chunks in {len(batches)} requests", flush=True)
+    with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as pool:
+        results = pool.map(_embed_batch, [[text for _, text, _ in batch] for batch in batches])
+        for batch, batch_vectors in zip(batches, results):
+            embedding_cache.put_many(CACHE_MODEL, [text for _, text, _ in batch], batch_vectors)
+            for (idx, _, _), vec in zip(batch, batch_vectors):
+                vectors[idx] = vec
+
+    embedded = [{**c, "embedding": vec} for c, vec in zip(chunks, vectors) if vec is not None]
+    stats = embedding_cache.stats()
+    print(f"[embed_chunks] embedding cache hits={stats['hits']} misses={stats['misses']}", flush=True)
     return embedded
 
 def retrieve_top_k(index, metadata, query_text, k=5):
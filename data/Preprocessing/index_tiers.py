@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import argparse
+import faiss
+import numpy as np
+from typing import Dict, List
+
+from config import (
+    INDEX_TIER,
+    INDEX_REPORT_PATH,
+    IVF_NLIST,
+    IVF_NPROBE,
+    PQ_M,
+    HNSW_M,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF_SEARCH,
+)
+
+TIERS = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+
+def _nlist(ntotal: int) -> int:
+    """IVF cell count: configured, or ~4 * sqrt(N) while keeping >= 39 training points per cell"""
+    if IVF_NLIST:
+        return IVF_NLIST
+    return max(1, min(int(4 * np.sqrt(ntotal)), ntotal // 39))
+
+
+def factory_string(tier: str, ntotal: int) -> str:
+    """FAISS index_factory description for a tier"""
+    if tier == "flat":
+        return "Flat"
+    if tier == "ivf_flat":
+        return f"IVF{_nlist(ntotal)},Flat"
+    if tier == "ivf_pq":
+        return f"IVF{_nlist(ntotal)},PQ{PQ_M}"
+    if tier == "hnsw":
+        return f"HNSW{HNSW_M},Flat"
+    raise ValueError(f"Unknown index tier '{tier}', expected one of {TIERS}")
+
+
+def search_params(tier: str) -> Dict[str, int]:
+    """Query-time knobs for a tier; FAISS also persists these inside the written index"""
+    if tier in ("ivf_flat", "ivf_pq"):
+        return {"nprobe": IVF_NPROBE}
+    if tier == "hnsw":
+        return {"efSearch": HNSW_EF_SEARCH}
+    return {}
+
+
+def apply_search_params(index: faiss.Index, params: Dict[str, int]):
+    space = faiss.ParameterSpace()
+    for name, value in params.items():
+        space.set_index_parameter(index, name, value)
+
+
+def build_tier_index(vectors: np.ndarray, tier: str) -> faiss.Index:
+    """Train (where needed) and fill an index of the given tier, keeping the vectors' order so metadata lines up"""
+    ntotal, dim = vectors.shape
+    index = faiss.index_factory(dim, factory_string(tier, ntotal), faiss.METRIC_L2)
+
+    if tier == "hnsw":
+        faiss.downcast_index(index).hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+
+    if not index.is_trained:
+        print(f"Training {tier} index on {ntotal} vectors", flush=True)
+        index.train(vectors)
+
+    index.add(vectors)
+    apply_search_params(index, search_params(tier))
+    return index
+
+
+def flat_vectors(index: faiss.Index) -> np.ndarray:
+    """All vectors of a flat index, in insertion order"""
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def recall_latency_report(flat_index: faiss.Index, tiers: List[str], n_queries: int = 200,
+                          k: int = 10, seed: int = 0) -> List[dict]:
+    """
+    Compare each tier against exact flat search on a held-out query set.
+
+    The queries are corpus vectors removed from the indexed set, so no query
+    trivially finds itself. Latency is measured one query at a time, as the
+    retriever issues them.
+    """
+    vectors = flat_vectors(flat_index)
+    if len(vectors) < 10:
+        raise ValueError(f"Need at least 10 vectors to hold out queries, index has {len(vectors)}")
+    rng = np.random.default_rng(seed)
+    held_out = rng.choice(len(vectors), size=min(n_queries, len(vectors) // 10), replace=False)
+    keep = np.ones(len(vectors), dtype=bool)
+    keep[held_out] = False
+    queries, base = vectors[held_out], vectors[keep]
+
+    baseline = build_tier_index(base, "flat")
+    _, truth = baseline.search(queries, k)
+
+    report = []
+    for tier in ("flat", *[t for t in tiers if t != "flat"]):
+        start = time.perf_counter()
+        index = baseline if tier == "flat" else build_tier_index(base, tier)
+        build_seconds = time.perf_counter() - start
+
+        latencies = []
+        found = []
+        for query in queries:
+            start = time.perf_counter()
+            _, ids = index.search(query.reshape(1, -1), k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found.append(ids[0])
+
+        hits = sum(len(set(ids) & set(expected)) for ids, expected in zip(found, truth))
+        report.append({
+            "tier": tier,
+            "factory": factory_string(tier, len(base)),
+            "params": search_params(tier),
+            f"recall@{k}": hits / truth.size,
+            "mean_latency_ms": float(np.mean(latencies)),
+            "p95_latency_ms": float(np.percentile(latencies, 95)),
+            "build_seconds": build_seconds,
+            "index_bytes": int(faiss.serialize_index(index).size),
+        })
+        print(
+            f"{tier:<9} recall@{k}={report[-1][f'recall@{k}']:.3f} "
+            f"mean={report[-1]['mean_latency_ms']:.3f}ms p95={report[-1]['p95_latency_ms']:.3f}ms "
+            f"size={report[-1]['index_bytes'] / 1e6:.1f}MB",
+            flush=True
+        )
+
+    return report
+
+
+if __name__ == "__main__":
+    from Data.azure_blob_store import load_embeddings
+
+    parser = argparse.ArgumentParser(description="Recall vs latency of ANN tiers against the flat unified index")
+    parser.add_argument("--tiers", nargs="+", choices=TIERS, default=[t for t in TIERS if t != "flat"])
+    parser.add_argument("--queries", type=int, default=200, help="Held-out query vectors")
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    index, _ = load_embeddings()
+    results = recall_latency_report(index, args.tiers, n_queries=args.queries, k=args.k)
+
+    os.makedirs(os.path.dirname(INDEX_REPORT_PATH), exist_ok=True)
+    with open(INDEX_REPORT_PATH, "w") as f:
+        json.dump({"ntotal": index.ntotal, "k": args.k, "tiers": results}, f, indent=2)
+    print(f"Wrote report to {INDEX_REPORT_PATH} (default tier: {INDEX_TIER})", flush=True)
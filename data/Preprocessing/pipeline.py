@@ -8,11 +8,13 @@ from config import (
     INPUT_CSV, 
     OUTPUT_DIR, 
     PDF_DIR,
+    INDEX_TIER,
 )
-from Data.azure_blob_store import flush_embeddings_to_azure, upload_jsonl_to_blob, load_embeddings
+from Data.azure_blob_store import flush_embeddings_to_azure, upload_jsonl_to_blob, load_embeddings, publish_ann_index
+from index_tiers import TIERS
 from utils import text_from_pdfs, download_pdfs, get_price_from_formulary
 
-def run_pipeline(start_index: int = 0, end_index: int = None):
+def run_pipeline(start_index: int = 0, end_index: int = None, index_tier: str = INDEX_TIER):
     """Run the drug summarization pipeline in batches"""
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     load_embeddings()
@@ -124,11 +126,15 @@ def run_pipeline(start_index: int = 0, end_index: int = None):
         flush_embeddings_to_azure()
         upload_jsonl_to_blob(summaries)
 
+        print(f"\nTraining and publishing {index_tier} index", flush=True)
+        publish_ann_index(index_tier)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run drug summarization pipeline in batches")
     parser.add_argument("--start", type=int, default=0, help="Start index (inclusive)")
     parser.add_argument("--end", type=int, default=None, help="End index (exclusive)")
+    parser.add_argument("--index-tier", choices=TIERS, default=INDEX_TIER, help="ANN index published for retrieval")
     args = parser.parse_args()
 
-    run_pipeline(start_index=args.start, end_index=args.end)
+    run_pipeline(start_index=args.start, end_index=args.end, index_tier=args.index_tier)
     print("Pipeline completed successfully!", flush=True)
@@ -9,6 +9,7 @@ TEST_DB_URL_TEMPLATE = "sqlite+aiosqlite:///{db_file}"
 os.environ["TESTING"] = "1"
 os.environ["AZURE_STORAGE_CONNECTION_STRING"] = "DefaultEndpointsProtocol=https;AccountName=test;AccountKey=test"
 os.environ["OPENAI_API_KEY"] = "test-openai-key"
+os.environ["EMBEDDING_CACHE_PATH"] = ""
 
 import pytest
 import pytest_asyncio
@@ -43,7 +44,7 @@ sys.modules['cohere'] = types.SimpleNamespace(
     )
 )
 
-from app.db.sqlite import get_db
+from app.db.supabase import get_db
 from app.models.base import Base
 from app.routers.auth import router as auth_router
 from app.routers.chatbot import router as chat_router
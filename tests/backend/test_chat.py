@@ -1,6 +1,10 @@
+import json
+
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import select
 
+from app.models.chat_message import ChatMessage
 from app.models.user import User
 
 
@@ -254,4 +258,103 @@ async def test_upload_context_404_invalid_session(client: AsyncClient, _session)
     data = {"user_id": str(user.id)}
 
     resp = await client.post("/chat/sessions/99999/upload", data=data, files=files)
-    assert resp.status_code == 404 
\ No newline at end of file
+    assert resp.status_code == 404 
+
+@pytest.mark.asyncio
+async def test_stream_message_streams_tokens_and_persists_answer(client: AsyncClient, _session, monkeypatch):
+    from app.services import chatbot_service
+
+    async def prepare_answer(self, message, user_id):
+        return {"query": message, "jurisdiction": {"country": None}, "snippets": []}, None, None
+
+    async def reformat_stream(user_query, data_dict, prediction=None, **kwargs):
+        for piece in ("Regorafenib ", "is ", "listed."):
+            yield piece
+
+    monkeypatch.setattr(chatbot_service.ChatbotService, "_prepare_answer", prepare_answer)
+    monkeypatch.setattr(chatbot_service, "reformat_stream", reformat_stream)
+
+    user = await _create_user(_session, email="stream_chat@example.com")
+    create_resp = await client.post("/chat/sessions", data={"user_id": str(user.id), "title": "Stream"})
+    session_id = create_resp.json()["id"]
+
+    resp = await client.post(
+        f"/chat/sessions/{session_id}/messages/stream",
+        data={"user_id": str(user.id), "message": "Is regorafenib listed?"},
+    )
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/event-stream")
+
+    events = [
+        (block.split("\n")[0][len("event: "):], json.loads(block.split("\n")[1][len("data: "):]))
+        for block in resp.text.strip().split("\n\n")
+    ]
+    assert [data["text"] for name, data in events if name == "token"] == ["Regorafenib ", "is ", "listed."]
+    name, done = events[-1]
+    assert name == "done" and done["ttft_ms"] is not None and done["message_id"]
+
+    msgs = (await client.get(f"/chat/sessions/{session_id}/messages?user_id={user.id}")).json()["messages"]
+    assert [(m["role"], m["content"]) for m in msgs] == [
+        ("USER", "Is regorafenib listed?"),
+        ("ASSISTANT", "Regorafenib is listed."),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_stream_message_persists_answer_through_real_get_db(app, client: AsyncClient, _session, _engine,
+                                                                  monkeypatch):
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+    from app.db import supabase
+    from app.services import chatbot_service
+
+    async def prepare_answer(self, message, user_id):
+        return {"query": message, "jurisdiction": {"country": None}, "snippets": []}, None, None
+
+    async def reformat_stream(user_query, data_dict, prediction=None, **kwargs):
+        yield "Not listed."
+
+    monkeypatch.setattr(chatbot_service.ChatbotService, "_prepare_answer", prepare_answer)
+    monkeypatch.setattr(chatbot_service, "reformat_stream", reformat_stream)
+
+    # The production dependency closes its session before the streamed body runs;
+    # nothing may write through it afterwards
+    closed = []
+
+    class _RequestSession(AsyncSession):
+        async def close(self):
+            closed.append(self)
+            await super().close()
+
+        async def commit(self):
+            assert self not in closed, "request session used after get_db closed it"
+            await super().commit()
+
+    monkeypatch.setattr(supabase, "SessionLocal",
+                        async_sessionmaker(_engine, expire_on_commit=False, class_=_RequestSession))
+    monkeypatch.delitem(app.dependency_overrides, supabase.get_db)
+
+    user = await _create_user(_session, email="stream_real_db@example.com")
+    session_id = (await client.post("/chat/sessions", data={"user_id": str(user.id), "title": "Stream"})).json()["id"]
+
+    resp = await client.post(
+        f"/chat/sessions/{session_id}/messages/stream",
+        data={"user_id": str(user.id), "message": "Is it listed?"},
+    )
+    assert resp.status_code == 200
+    assert closed
+
+    result = await _session.execute(
+        select(ChatMessage).where(ChatMessage.chat_history_id == session_id).order_by(ChatMessage.id)
+    )
+    assert [(m.role, m.content) for m in result.scalars()] == [("USER", "Is it listed?"), ("ASSISTANT", "Not listed.")]
+
+
+@pytest.mark.asyncio
+async def test_stream_message_404_invalid_session(client: AsyncClient, _session):
+    user = await _create_user(_session, email="stream_404@example.com")
+    resp = await client.post(
+        "/chat/sessions/99999/messages/stream",
+        data={"user_id": str(user.id), "message": "Hello"},
+    )
+    assert resp.status_code == 404
@@ -50,3 +50,226 @@ def test_intent_classification(monkeypatch, ic_module, top_prediction, expected)
 
     # Ensure the result list is sorted by value.
     assert result == sorted(result, key=lambda x: x.value)
+
+
+class _StubContainer:
+    """Blob container stub serving one pickled metadata list and one index per user."""
+
+    def __init__(self, blobs):
+        self.blobs = blobs  # name -> (bytes, etag)
+        self.downloads = 0
+
+    def get_blob_client(self, name):
+        container = self
+
+        def download_blob():
+            container.downloads += 1
+            data, etag = container.blobs[name]
+            return types.SimpleNamespace(readall=lambda: data, properties=types.SimpleNamespace(etag=etag))
+
+        return types.SimpleNamespace(
+            download_blob=download_blob,
+            get_blob_properties=lambda: types.SimpleNamespace(etag=container.blobs[name][1]),
+        )
+
+
+def test_flat_index_vectors_are_mapped_not_copied(monkeypatch, tmp_path):
+    import os
+
+    import faiss
+    import numpy as np
+
+    swigfaiss = importlib.import_module(faiss.IndexFlat.__module__)
+    monkeypatch.setattr(faiss, "read_index", swigfaiss.read_index)
+    utils = importlib.import_module("app.rag_tools.info_retrievers.utils")
+
+    vectors = np.random.default_rng(0).random((8192, 1024), dtype=np.float32)
+    index = faiss.IndexFlatL2(1024)
+    index.add(vectors)
+    index_path = str(tmp_path / "unified.index")
+    faiss.write_index(index, index_path)
+    # The first load converts the index; later loads only map the converted vectors
+    utils._load_index(index_path)
+
+    def resident_bytes():
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+    before = resident_bytes()
+    mapped = utils._load_index(index_path)
+    assert resident_bytes() - before < vectors.nbytes / 4
+
+    assert isinstance(mapped.vectors, np.memmap)
+    assert (mapped.ntotal, mapped.d) == (8192, 1024)
+    expected = index.search(vectors[:3], 5)
+    found = mapped.search(vectors[:3], 5)
+    assert np.array_equal(found[1], expected[1])
+    assert np.allclose(found[0], expected[0])
+
+
+def test_user_index_cache_is_keyed_by_user_and_revalidated(monkeypatch):
+    import pickle
+    import faiss
+    import numpy as np
+
+    # conftest stubs faiss.read_index globally; restore the real one for byte round trips
+    swigfaiss = importlib.import_module(faiss.IndexFlat.__module__)
+    monkeypatch.setattr(faiss, "read_index", swigfaiss.read_index)
+
+    utils = importlib.import_module("app.rag_tools.info_retrievers.utils")
+    monkeypatch.setattr(utils._user_index_cache, "revalidate_seconds", 0)
+    utils._user_index_cache.clear()
+
+    blobs = {}
+    for user_id, n in ((1, 2), (2, 5)):
+        index = faiss.IndexFlatL2(utils.EMBEDDING_MODEL_DIM)
+        index.add(np.zeros((n, utils.EMBEDDING_MODEL_DIM), dtype=np.float32))
+        blobs[f"unified_{user_id}.index"] = (faiss.serialize_index(index).tobytes(), "v1")
+        blobs[f"unified_meta_{user_id}.pkl"] = (pickle.dumps([{"text": str(i)} for i in range(n)]), "v1")
+    container = _StubContainer(blobs)
+    monkeypatch.setattr(utils, "container_client", container)
+
+    assert utils.load_embeddings(1)[0].ntotal == 2
+    assert utils.load_embeddings(2)[0].ntotal == 5
+    downloads = container.downloads
+    assert utils.load_embeddings(1)[0].ntotal == 2
+    assert container.downloads == downloads
+
+    data, _ = blobs["unified_1.index"]
+    blobs["unified_1.index"] = (data, "v2")
+    utils.load_embeddings(1)
+    assert container.downloads > downloads
+    assert utils.user_index_cache_stats()["hits"] >= 2
+
+
+@pytest.mark.asyncio
+async def test_call_tools_queries_sources_concurrently_with_one_embedding(monkeypatch):
+    import threading
+    import time
+
+    from app.models.enums import DatabaseEnum
+
+    chatbot_service = importlib.import_module("app.services.chatbot_service")
+    query_context = importlib.import_module("app.rag_tools.query_context")
+    embedded = []
+
+    class _Gateway:
+        async def embed(self, text):
+            embedded.append(text)
+            return [0.1, 0.2]
+
+    class _Retriever:
+        def __init__(self, name, delay):
+            self.name, self.delay = name, delay
+            self.calls = []
+
+        def query_embedding_model(self):
+            return "text-embedding-3-small"
+
+        def retrieve(self, query, user_id=None, top_k=3, query_embeddings=None):
+            self.calls.append((threading.current_thread(), query_embeddings))
+            time.sleep(self.delay)
+            return [f"{self.name} chunk"]
+
+    retrievers = {DatabaseEnum.CDA_VECTORDB: _Retriever("CDA", 0.05), DatabaseEnum.USER_VECTORDB: _Retriever("USER", 1)}
+
+    async def get_retriever(database):
+        return retrievers[database]
+
+    monkeypatch.setattr(query_context, "get_embedding_gateway", lambda model, dimensions=None: _Gateway())
+    monkeypatch.setattr(chatbot_service.settings, "RETRIEVAL_SOURCE_TIMEOUT_SECONDS", 0.3)
+    service = chatbot_service.ChatbotService(db=None)
+    monkeypatch.setattr(service.retriever_service, "get_retriever", get_retriever)
+
+    context = query_context.QueryContext(query="regorafenib price", user_id=1, intents=[IntentEnum.VECTORDB])
+    started = time.monotonic()
+    (response,) = await service.call_tools("regorafenib price", user_id=1, context=context)
+
+    # The slow user source times out instead of stalling the answer
+    assert response["response"] == ["CDA chunk"]
+    assert time.monotonic() - started < 0.9
+    assert embedded == ["regorafenib price"]
+    for retriever in retrievers.values():
+        ((thread, query_embeddings),) = retriever.calls
+        assert thread is not threading.main_thread()
+        assert list(query_embeddings) == ["text-embedding-3-small"]
+
+
+@pytest.mark.asyncio
+async def test_call_tools_answers_without_sources_when_the_query_embedding_times_out(monkeypatch):
+    import asyncio
+    import time
+
+    chatbot_service = importlib.import_module("app.services.chatbot_service")
+    query_context = importlib.import_module("app.rag_tools.query_context")
+
+    class _HungGateway:
+        async def embed(self, text):
+            await asyncio.sleep(5)
+
+    class _Retriever:
+        calls = 0
+
+        def query_embedding_model(self):
+            return "text-embedding-3-small"
+
+        def retrieve(self, *args, **kwargs):
+            _Retriever.calls += 1
+            return ["chunk"]
+
+    async def get_retriever(database):
+        return _Retriever()
+
+    monkeypatch.setattr(query_context, "get_embedding_gateway", lambda model, dimensions=None: _HungGateway())
+    monkeypatch.setattr(chatbot_service.settings, "RETRIEVAL_SOURCE_TIMEOUT_SECONDS", 0.3)
+    service = chatbot_service.ChatbotService(db=None)
+    monkeypatch.setattr(service.retriever_service, "get_retriever", get_retriever)
+
+    context = query_context.QueryContext(query="regorafenib price", user_id=1, intents=[IntentEnum.VECTORDB])
+    started = time.monotonic()
+    (response,) = await service.call_tools("regorafenib price", user_id=1, context=context)
+
+    assert response["response"] == []
+    assert time.monotonic() - started < 0.9
+    assert _Retriever.calls == 0
+
+
+@pytest.mark.asyncio
+async def test_query_context_is_shared_across_the_turn(monkeypatch):
+    query_context = importlib.import_module("app.rag_tools.query_context")
+    normalizer = importlib.import_module("app.rag_tools.normalizer")
+    formatter = importlib.import_module("app.rag_tools.llm_response_formatter")
+    embedded = []
+
+    class _Gateway:
+        def __init__(self, model):
+            self.model = model
+
+        async def embed(self, text):
+            embedded.append(self.model)
+            return [1.0]
+
+    monkeypatch.setattr(query_context, "get_embedding_gateway", lambda model, dimensions=None: _Gateway(model))
+    context = query_context.QueryContext(query="price of regorafenib in Germany")
+
+    await context.embed(["model-a", "model-b"])
+    assert set(await context.embed(["model-a"])) == {"model-a"}
+    assert sorted(embedded) == ["model-a", "model-b"]
+
+    data_dict, _ = normalizer.normalize_tool_responses(context.query, [], context)
+    assert context.jurisdiction == data_dict["jurisdiction"] == {"country": "Germany"}
+
+    prompts = []
+
+    async def create(**kwargs):
+        prompts.append(kwargs["messages"])
+        message = types.SimpleNamespace(content="answer")
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+    # The context's jurisdiction wins over a stale one in data_dict
+    assert await formatter.reformat(context.query, {**data_dict, "jurisdiction": {"country": None}}, client=client,
+                              context=context) == "answer"
+    system_prompt, user_block = (message["content"] for message in prompts[0])
+    assert "Germany: 0.9" in system_prompt
+    assert "Germany" in user_block
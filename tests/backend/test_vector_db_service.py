@@ -0,0 +1,970 @@
+import asyncio
+import importlib
+import io
+import json
+import types
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import faiss
+import numpy as np
+import pytest
+import pytest_asyncio
+from azure.core.exceptions import ResourceNotFoundError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.models.drug import Drug, DrugFile, IngestionJob
+from app.services.ingestion_queue import IngestionQueue
+from app.services.vectorDBServices import embedding_backfill, file_processing_service, pdf_extraction, vector_db_service
+from app.services.vectorDBServices.azure_blob_service import BlobConflictError
+from app.services.vectorDBServices.chunk_store import ChunkStore
+from app.services.vectorDBServices.chunking import chunk_lines
+from app.services.vectorDBServices.embedding_cache import EmbeddingCache
+from app.services.vectorDBServices.embedding_gateway import EmbeddingGateway
+from app.services.vectorDBServices.embedding_service import EmbeddingUnavailableError
+from app.services.vectorDBServices.quantization import recall_report
+from app.services.vectorDBServices.reembed_migration import CHECKPOINT_PREFIX, ReembedMigration
+from app.services.vectorDBServices.user_index_cache import UserIndexCache
+
+
+class _FakeBlobService:
+    """In-memory stand-in for AzureBlobService that counts downloads."""
+
+    def __init__(self):
+        self.blobs = {}
+        self.downloads = 0
+
+    async def upload_blob(self, filename, data, content_type=None, container_name=None):
+        await self.upload_blob_with_etag(filename, data, content_type, container_name)
+        return f"https://blob.test/{filename}"
+
+    async def upload_blob_with_etag(self, filename, data, content_type=None, container_name=None,
+                                    if_match=None, if_none_match=False):
+        current = self.blobs.get(filename)
+        if if_none_match and current is not None:
+            raise BlobConflictError(filename)
+        if if_match is not None and (current is None or current[1] != if_match):
+            raise BlobConflictError(filename)
+        # Yield like a real network call so concurrent writers interleave
+        await asyncio.sleep(0)
+        etag = uuid.uuid4().hex
+        self.blobs[filename] = (bytes(data), etag)
+        return etag
+
+    async def download_blob(self, filename, container_name=None):
+        data, _ = await self.download_blob_with_etag(filename, container_name)
+        return data
+
+    async def download_blob_with_etag(self, filename, container_name=None):
+        if filename not in self.blobs:
+            raise ResourceNotFoundError(f"{filename} not found")
+        self.downloads += 1
+        return self.blobs[filename]
+
+    async def get_blob_etag(self, filename, container_name=None):
+        entry = self.blobs.get(filename)
+        return entry[1] if entry else None
+
+    async def blob_exists(self, filename, container_name=None):
+        return filename in self.blobs
+
+    async def delete_blob(self, filename, container_name=None):
+        return self.blobs.pop(filename, None) is not None
+
+    async def list_blobs(self, prefix="", container_name=None):
+        return [name for name in self.blobs if name.startswith(prefix)]
+
+
+@pytest_asyncio.fixture()
+async def vector_db(monkeypatch):
+    monkeypatch.setattr(vector_db_service, "AzureBlobService", _FakeBlobService)
+    # conftest stubs faiss.read_index globally; restore the real one for byte round trips
+    swigfaiss = importlib.import_module(faiss.IndexFlat.__module__)
+    monkeypatch.setattr(faiss, "read_index", swigfaiss.read_index)
+    service = vector_db_service.VectorDBService()
+    service.cache = UserIndexCache(max_bytes=64 * 1024 * 1024, max_entries=8, revalidate_seconds=0)
+    yield service
+    # Background compactions must not outlive the test's loop
+    tasks = list(vector_db_service._loop_state().compaction_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _chunks(n, drug_id=1):
+    return [{"text": f"chunk {drug_id}-{i}", "word_count": 2, "char_count": 8} for i in range(n)]
+
+
+def _embeddings(n, dim=1536, seed=0):
+    return np.random.default_rng(seed).random((n, dim), dtype=np.float32).tolist()
+
+
+_DRUG = {"id": 1, "title": "Drug A"}
+_FILE = {"id": 10, "original_filename": "a.pdf"}
+
+
+@pytest.mark.asyncio
+async def test_cache_serves_hot_user_without_download(vector_db):
+    await vector_db.add_document_chunks(7, _chunks(3), _embeddings(3), _DRUG, _FILE)
+    await vector_db._load_user_vector_db(7)
+    downloads = vector_db.blob_service.downloads
+
+    index, metadata = await vector_db._load_user_vector_db(7)
+    await vector_db._load_user_vector_db(7)
+
+    assert vector_db.blob_service.downloads == downloads
+    assert len(metadata["chunks"]) == 3
+    assert vector_db.cache.stats()["hits"] >= 2
+
+
+@pytest.mark.asyncio
+async def test_cache_refetches_when_blob_changes(vector_db):
+    await vector_db.add_document_chunks(7, _chunks(3), _embeddings(3), _DRUG, _FILE)
+    await vector_db._load_user_vector_db(7)
+    downloads = vector_db.blob_service.downloads
+
+    # Simulate another worker rewriting the user's manifest
+    name = vector_db._get_user_manifest_path(7)
+    data, _ = vector_db.blob_service.blobs[name]
+    vector_db.blob_service.blobs[name] = (data, "changed-elsewhere")
+
+    await vector_db._load_user_vector_db(7)
+    assert vector_db.blob_service.downloads > downloads
+
+
+def test_cache_evicts_least_recently_used_over_budget():
+    cache = UserIndexCache(max_bytes=10 * 1536 * 4, max_entries=8)
+    for user_id in range(3):
+        index = faiss.IndexFlatIP(1536)
+        index.add(np.zeros((4, 1536), dtype=np.float32))
+        cache.put(user_id, index, {}, etag=str(user_id))
+
+    assert cache.get(0) is None
+    assert cache.get(2) is not None
+    assert cache.stats()["evictions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_index_round_trips_through_blob_bytes(vector_db):
+    await vector_db.add_document_chunks(7, _chunks(3), _embeddings(3), _DRUG, _FILE)
+    vector_db.cache.clear()
+
+    index, metadata = await vector_db._load_user_vector_db(7)
+
+    assert index.ntotal == 3
+    assert metadata["total_vectors"] == 3
+
+
+@pytest.mark.asyncio
+async def test_ingestion_appends_delta_segments_only(vector_db):
+    await vector_db.add_document_chunks(7, _chunks(3), _embeddings(3), _DRUG, _FILE)
+    uploaded_before = set(vector_db.blob_service.blobs)
+
+    await vector_db.add_document_chunks(7, _chunks(2), _embeddings(2, seed=1), _DRUG, {"id": 11, "original_filename": "b.pdf"})
+
+    new_blobs = set(vector_db.blob_service.blobs) - uploaded_before
+    assert all("-delta-" in name for name in new_blobs)
+    assert len(new_blobs) == 3
+
+    vector_db.cache.clear()
+    index, metadata = await vector_db._load_user_vector_db(7)
+    assert index.ntotal == 5
+    assert set(metadata["chunks"].columns["vector_index"].tolist()) == set(faiss.vector_to_array(index.id_map).tolist())
+
+
+@pytest.mark.asyncio
+async def test_file_without_embedded_chunks_writes_nothing(vector_db):
+    await vector_db.add_document_chunks(7, _chunks(2), _embeddings(2), _DRUG, _FILE)
+    blobs = set(vector_db.blob_service.blobs)
+
+    assert await vector_db.add_document_chunks(7, [], [], _DRUG, {"id": 12, "original_filename": "empty.pdf"}) == []
+
+    assert set(vector_db.blob_service.blobs) == blobs
+
+
+@pytest.mark.asyncio
+async def test_compaction_folds_deltas_into_base(vector_db):
+    for file_id in range(3):
+        await vector_db.add_document_chunks(7, _chunks(2), _embeddings(2, seed=file_id), _DRUG, {"id": file_id, "original_filename": "f.pdf"})
+
+    assert await vector_db._compact_user_vector_db(7)
+
+    manifest, _ = await vector_db._read_manifest(7)
+    assert manifest["deltas"] == []
+    assert manifest["total_vectors"] == 6
+    assert not any("-delta-" in name for name in vector_db.blob_service.blobs)
+
+    vector_db.cache.clear()
+    index, _ = await vector_db._load_user_vector_db(7)
+    assert index.ntotal == 6
+
+
+@pytest.mark.asyncio
+async def test_delete_writes_tombstones_instead_of_rebuilding(vector_db):
+    await vector_db.add_document_chunks(7, _chunks(4), _embeddings(4), _DRUG, _FILE)
+    await vector_db.add_document_chunks(7, _chunks(2, drug_id=2), _embeddings(2, seed=1), {"id": 2, "title": "Drug B"}, {"id": 11, "original_filename": "b.pdf"})
+    blobs_before = set(vector_db.blob_service.blobs)
+
+    assert await vector_db.delete_file_documents(7, 11)
+
+    # Only the manifest changes; no segment is rewritten
+    assert set(vector_db.blob_service.blobs) == blobs_before
+    manifest, _ = await vector_db._read_manifest(7)
+    assert len(manifest["tombstones"]) == 2
+
+    vector_db.cache.clear()
+    index, metadata = await vector_db._load_user_vector_db(7)
+    assert index.ntotal == 4
+    assert set(metadata["chunks"].columns["file_id"].tolist()) == {10}
+
+
+@pytest.mark.asyncio
+async def test_compaction_drops_tombstoned_vectors(vector_db, monkeypatch):
+    monkeypatch.setattr(vector_db_service.settings, "USER_INDEX_TOMBSTONE_COMPACTION_RATIO", 1.0)
+    await vector_db.add_document_chunks(7, _chunks(4), _embeddings(4), _DRUG, _FILE)
+    await vector_db.delete_drug_documents(7, _DRUG["id"])
+
+    assert await vector_db._compact_user_vector_db(7)
+
+    manifest, _ = await vector_db._read_manifest(7)
+    assert manifest["tombstones"] == []
+    assert manifest["total_vectors"] == 0
+
+
+@pytest.mark.asyncio
+async def test_concurrent_additions_are_coalesced_and_none_are_lost(vector_db):
+    await vector_db.add_document_chunks(7, _chunks(1), _embeddings(1), _DRUG, _FILE)
+
+    await asyncio.gather(*[
+        vector_db.add_document_chunks(7, _chunks(2), _embeddings(2, seed=file_id), _DRUG, {"id": file_id, "original_filename": "f.pdf"})
+        for file_id in range(20, 24)
+    ])
+
+    manifest, _ = await vector_db._read_manifest(7)
+    # The first caller writes its own batch; the three that queued behind it share one delta
+    assert len(manifest["deltas"]) == 3
+    assert manifest["total_vectors"] == 9
+
+    vector_db.cache.clear()
+    index, metadata = await vector_db._load_user_vector_db(7)
+    assert index.ntotal == 9
+    assert set(metadata["chunks"].columns["file_id"].tolist()) == {10, 20, 21, 22, 23}
+
+
+@pytest.mark.asyncio
+async def test_cancelled_flush_fails_the_additions_it_took(vector_db, monkeypatch):
+    writes = []
+    release_first = asyncio.Event()
+
+    async def append_delta_segment(user_id, embeddings, chunks, model):
+        writes.append(len(chunks))
+        if len(writes) == 1:
+            await release_first.wait()
+        else:
+            await asyncio.Event().wait()  # never lands
+
+    monkeypatch.setattr(vector_db, "_append_delta_segment", append_delta_segment)
+
+    def add(file_id):
+        return asyncio.create_task(vector_db.add_document_chunks(
+            7, _chunks(1), _embeddings(1), _DRUG, {"id": file_id, "original_filename": "f.pdf"}
+        ))
+
+    # A writes its own batch while B and C queue behind it
+    a = add(20)
+    while not writes:
+        await asyncio.sleep(0)
+    b, c = add(21), add(22)
+    await asyncio.sleep(0)
+    release_first.set()
+    await a
+
+    # B takes the lock, writes B and C together and is cancelled mid-write
+    while len(writes) < 2:
+        await asyncio.sleep(0)
+    assert writes == [1, 2]
+    b.cancel()
+
+    with pytest.raises(RuntimeError, match="cancelled"):
+        await asyncio.wait_for(c, timeout=5)
+    assert b.cancelled()
+    assert vector_db_service._loop_state().pending_additions.get(7, []) == []
+
+
+@pytest.mark.asyncio
+async def test_manifest_write_retries_after_cross_process_conflict(vector_db):
+    await vector_db.add_document_chunks(7, _chunks(2), _embeddings(2), _DRUG, _FILE)
+
+    # Another process appends a delta between our manifest read and write
+    name = vector_db._get_user_manifest_path(7)
+    real_read = vector_db._read_manifest
+    raced = []
+
+    async def racing_read(user_id):
+        manifest, etag = await real_read(user_id)
+        if not raced:
+            raced.append(True)
+            data, _ = vector_db.blob_service.blobs[name]
+            vector_db.blob_service.blobs[name] = (data, "written-elsewhere")
+        return manifest, etag
+
+    vector_db._read_manifest = racing_read
+    await vector_db.add_document_chunks(7, _chunks(3), _embeddings(3, seed=1), _DRUG, {"id": 11, "original_filename": "b.pdf"})
+
+    manifest, _ = await real_read(7)
+    assert len(manifest["deltas"]) == 2
+    assert manifest["total_vectors"] == 5
+
+
+def test_chunk_store_round_trips_and_repacks_text():
+    records = [
+        {"doc_id": str(uuid.uuid4()), "vector_index": i, "drug_id": 1 + i % 2, "file_id": 10,
+         "content": f"chunk text {i} é", "drug_title": f"Drug {i % 2}", "section_title": f"{i}. Dosing",
+         "created_at": "2025-01-01T00:00:00.000001"}
+        for i in range(4)
+    ]
+    store = ChunkStore.from_records(records[:2])
+    store.append(ChunkStore.from_records(records[2:]))
+    store.remove([1])
+
+    columns_data, text = store.to_bytes()
+    loaded = ChunkStore.from_bytes(columns_data, text)
+
+    assert len(loaded) == 3
+    assert b"chunk text 1" not in text
+    assert loaded.vector_ids_where("drug_id", 1).tolist() == [0, 2]
+    row = loaded.rows_for(np.array([3, 1, -1]))
+    assert row[1] == -1 and row[2] == -1
+    assert loaded.row(row[0]) == {**records[3], "user_id": 0, "chunk_index": 0, "page_number": 0,
+                                        "word_count": 0, "char_count": 0, "filename": "",
+                                        "therapeutic_area": "", "drug_type": "", "submission_pathway": ""}
+
+    # Segments written before section titles were stored load with empty ones
+    with np.load(io.BytesIO(columns_data)) as arrays:
+        older = {name: arrays[name] for name in arrays.files if not name.endswith("section_title")}
+    buffer = io.BytesIO()
+    np.savez(buffer, **older)
+    assert ChunkStore.from_bytes(buffer.getvalue(), text).row(row[0])["section_title"] == ""
+
+
+@pytest.mark.asyncio
+async def test_pre_columnar_json_segments_still_load(vector_db):
+    doc_id = str(uuid.uuid4())
+    index = faiss.IndexFlatIP(1536)
+    index.add(np.array(_embeddings(1), dtype=np.float32))
+    blobs = vector_db.blob_service.blobs
+    blobs[f"{vector_db._get_user_vector_path(7)}.index"] = (vector_db_service.serialize_index(index), "v1")
+    blobs[f"{vector_db._get_user_metadata_path(7)}.json"] = (
+        json.dumps({"documents": {doc_id: {"vector_index": 0, "content": "legacy", "drug_id": 1, "file_id": 10}}}).encode(),
+        "m1",
+    )
+
+    index, metadata = await vector_db._load_user_vector_db(7)
+
+    assert index.ntotal == 1
+    assert metadata["chunks"].row(0)["content"] == "legacy"
+    assert metadata["chunks"].row(0)["doc_id"] == doc_id
+
+
+@pytest.mark.asyncio
+async def test_search_prefilters_by_drug(vector_db, monkeypatch):
+    await vector_db.add_document_chunks(7, _chunks(40, drug_id=2), _embeddings(40), {"id": 2, "title": "Drug B"}, {"id": 11, "original_filename": "b.pdf"})
+    await vector_db.add_document_chunks(7, _chunks(3), _embeddings(3, seed=1), _DRUG, _FILE)
+
+    # The query sits right on top of drug 2's vectors, so post-filtering would find none of drug 1's
+    query = _embeddings(1)[0]
+
+    async def fake_embedding(text, model=None):
+        return query
+
+    monkeypatch.setattr(vector_db.embedding_service, "generate_embedding", fake_embedding)
+
+    results = await vector_db.search_user_documents(7, "q", drug_id=_DRUG["id"], top_k=3)
+
+    assert len(results) == 3
+    assert {r["drug_id"] for r in results} == {_DRUG["id"]}
+    assert results == sorted(results, key=lambda r: r["score"], reverse=True)
+
+
+@pytest.mark.asyncio
+async def test_search_short_circuits_when_query_embedding_fails(vector_db, monkeypatch):
+    await vector_db.add_document_chunks(7, _chunks(3), _embeddings(3), _DRUG, _FILE)
+
+    async def failing_embedding(text, model=None):
+        raise EmbeddingUnavailableError("embeddings API down")
+
+    monkeypatch.setattr(vector_db.embedding_service, "generate_embedding", failing_embedding)
+
+    assert await vector_db.search_user_documents(7, "q") == []
+
+
+@pytest.mark.asyncio
+async def test_failed_chunks_are_queued_and_back_filled(vector_db, monkeypatch):
+    monkeypatch.setattr(embedding_backfill, "AzureBlobService", _FakeBlobService)
+    backfill = embedding_backfill.EmbeddingBackfillService(vector_db)
+    progress = []
+
+    async def get_drug_file(file_id):
+        return object()
+
+    async def record_progress(file_id, vector_ids, status=None):
+        progress.append((file_id, len(vector_ids), status))
+
+    monkeypatch.setattr(backfill, "_get_drug_file", get_drug_file)
+    monkeypatch.setattr(backfill, "_record_progress", record_progress)
+
+    outage = {"down": True}
+
+    async def embeddings_batch(texts, model=None):
+        return [None if outage["down"] and i % 2 else e for i, e in enumerate(_embeddings(len(texts)))]
+
+    monkeypatch.setattr(backfill.embedding_service, "generate_embeddings_batch", embeddings_batch)
+
+    await backfill.enqueue(7, _chunks(4), _DRUG, _FILE)
+
+    # Half the chunks still fail and stay queued; the other half are indexed
+    assert await backfill.backfill_once() == 2
+    assert progress == [(_FILE["id"], 2, None)]
+    (entry,) = backfill.blob_service.blobs.values()
+    assert json.loads(entry[0])["attempts"] == 1
+
+    # The entry backs off before its next round
+    outage["down"] = False
+    assert await backfill.backfill_once() == 0
+    (name,) = backfill.blob_service.blobs
+    entry = json.loads(backfill.blob_service.blobs[name][0])
+    entry["retry_after"] = 0.0
+    await backfill.blob_service.upload_blob(name, json.dumps(entry).encode("utf-8"))
+
+    assert await backfill.backfill_once() == 2
+    assert progress[-1] == (_FILE["id"], 2, "completed")
+    assert backfill.blob_service.blobs == {}
+
+    _, metadata = await vector_db._load_user_vector_db(7)
+    assert len(metadata["chunks"]) == 4
+
+
+@pytest.mark.asyncio
+async def test_back_fill_gives_up_after_max_attempts(vector_db, monkeypatch):
+    monkeypatch.setattr(embedding_backfill, "AzureBlobService", _FakeBlobService)
+    monkeypatch.setattr(embedding_backfill.settings, "EMBEDDING_BACKFILL_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(embedding_backfill.settings, "EMBEDDING_BACKFILL_RETRY_BASE_SECONDS", 0.0)
+    backfill = embedding_backfill.EmbeddingBackfillService(vector_db)
+    progress = []
+
+    async def get_drug_file(file_id):
+        return object()
+
+    async def record_progress(file_id, vector_ids, status=None):
+        progress.append(status)
+
+    async def embeddings_batch(texts, model=None):
+        raise EmbeddingUnavailableError("embedding API down")
+
+    monkeypatch.setattr(backfill, "_get_drug_file", get_drug_file)
+    monkeypatch.setattr(backfill, "_record_progress", record_progress)
+    monkeypatch.setattr(backfill.embedding_service, "generate_embeddings_batch", embeddings_batch)
+
+    await backfill.enqueue(7, _chunks(2), _DRUG, _FILE)
+    for _ in range(5):
+        assert await backfill.backfill_once() == 0
+
+    assert progress == [None, None, "failed"]
+    assert backfill.blob_service.blobs == {}
+
+
+@pytest.mark.asyncio
+async def test_ingestion_job_retries_without_duplicating_chunks(vector_db, monkeypatch, _engine):
+    session_factory = async_sessionmaker(_engine, expire_on_commit=False, class_=AsyncSession)
+    queue = IngestionQueue(workers=1, session_factory=session_factory)
+    queue.vector_db = vector_db
+    queue.blob_service = vector_db.blob_service
+    monkeypatch.setattr(embedding_backfill, "AzureBlobService", _FakeBlobService)
+    queue.backfill = embedding_backfill.EmbeddingBackfillService(vector_db)
+
+    attempts = []
+
+    async def process_file(content, filename, drug_id, embedding_model=None):
+        attempts.append(content)
+        if len(attempts) == 1:
+            raise RuntimeError("extraction failed")
+        return _chunks(3), _embeddings(3)
+
+    queue.file_processor = types.SimpleNamespace(process_file=process_file)
+
+    async with session_factory() as db:
+        drug = Drug(user_id=7, title="Drug A")
+        db.add(drug)
+        await db.flush()
+        drug_file = DrugFile(drug_id=drug.id, user_id=7, filename="7_a.pdf", original_filename="a.pdf",
+                             processing_status="pending")
+        db.add(drug_file)
+        await db.flush()
+        job = IngestionJob(drug_file_id=drug_file.id, drug_id=drug.id, user_id=7, status="queued")
+        db.add(job)
+        await db.commit()
+    await queue.blob_service.upload_blob("7_a.pdf", b"%PDF")
+
+    # The failed attempt backs off, so the job is not due again yet
+    assert await queue.run_job(job.id)
+    assert not await queue.run_job(job.id)
+    async with session_factory() as db:
+        failed = await db.get(IngestionJob, job.id)
+        assert (failed.status, failed.attempts, failed.last_error) == ("queued", 1, "extraction failed")
+        failed.run_after = datetime.now(timezone.utc)
+        await db.commit()
+
+    assert await queue.run_job(job.id)
+
+    # A worker that died after indexing leaves the job running; the rerun replaces its chunks
+    async with session_factory() as db:
+        done = await db.get(IngestionJob, job.id)
+        assert done.status == "succeeded"
+        done.status = "running"
+        done.lease_expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+        await db.commit()
+    assert await queue.run_job(job.id)
+
+    async with session_factory() as db:
+        indexed = await db.get(DrugFile, drug_file.id)
+        assert (indexed.processing_status, indexed.chunk_count) == ("completed", 3)
+        assert (await db.get(IngestionJob, job.id)).attempts == 3
+    vector_db.cache.clear()
+    index, metadata = await vector_db._load_user_vector_db(7)
+    assert index.ntotal == len(metadata["chunks"]) == 3
+
+
+@pytest.mark.asyncio
+async def test_ingestion_job_lease_is_renewed_while_it_runs(vector_db, monkeypatch, _engine):
+    monkeypatch.setattr(vector_db_service.settings, "INGESTION_JOB_LEASE_SECONDS", 0.3)
+    session_factory = async_sessionmaker(_engine, expire_on_commit=False, class_=AsyncSession)
+    queue = IngestionQueue(workers=1, session_factory=session_factory)
+    queue.vector_db = vector_db
+    queue.blob_service = vector_db.blob_service
+    monkeypatch.setattr(embedding_backfill, "AzureBlobService", _FakeBlobService)
+    queue.backfill = embedding_backfill.EmbeddingBackfillService(vector_db)
+
+    async with session_factory() as db:
+        drug = Drug(user_id=7, title="Drug A")
+        db.add(drug)
+        await db.flush()
+        drug_file = DrugFile(drug_id=drug.id, user_id=7, filename="7_b.pdf", original_filename="b.pdf",
+                             processing_status="pending")
+        db.add(drug_file)
+        await db.flush()
+        job = IngestionJob(drug_file_id=drug_file.id, drug_id=drug.id, user_id=7, status="queued")
+        db.add(job)
+        await db.commit()
+    await queue.blob_service.upload_blob("7_b.pdf", b"%PDF")
+
+    # Processing outlasts the lease several times over; the job must never look abandoned meanwhile
+    due_while_running = []
+
+    async def process_file(content, filename, drug_id, embedding_model=None):
+        for _ in range(4):
+            await asyncio.sleep(0.2)
+            due_while_running.append(await queue.enqueue_due())
+        return _chunks(2), _embeddings(2)
+
+    queue.file_processor = types.SimpleNamespace(process_file=process_file)
+
+    assert await queue.run_job(job.id)
+    assert due_while_running == [0] * 4
+    async with session_factory() as db:
+        done = await db.get(IngestionJob, job.id)
+        assert (done.status, done.attempts, done.lease_expires_at) == ("succeeded", 1, None)
+        assert (await db.get(DrugFile, drug_file.id)).chunk_count == 2
+
+
+@pytest.mark.asyncio
+async def test_ingestion_of_a_drug_deleted_mid_run_leaves_no_chunks(vector_db, monkeypatch, _engine):
+    session_factory = async_sessionmaker(_engine, expire_on_commit=False, class_=AsyncSession)
+    queue = IngestionQueue(workers=1, session_factory=session_factory)
+    queue.vector_db = vector_db
+    queue.blob_service = vector_db.blob_service
+    monkeypatch.setattr(embedding_backfill, "AzureBlobService", _FakeBlobService)
+    queue.backfill = embedding_backfill.EmbeddingBackfillService(vector_db)
+
+    async with session_factory() as db:
+        drug = Drug(user_id=7, title="Drug A")
+        db.add(drug)
+        await db.flush()
+        drug_file = DrugFile(drug_id=drug.id, user_id=7, filename="7_c.pdf", original_filename="c.pdf",
+                             processing_status="pending")
+        db.add(drug_file)
+        await db.flush()
+        job = IngestionJob(drug_file_id=drug_file.id, drug_id=drug.id, user_id=7, status="queued")
+        db.add(job)
+        await db.commit()
+    await queue.blob_service.upload_blob("7_c.pdf", b"%PDF")
+
+    async def process_file(content, filename, drug_id, embedding_model=None):
+        # The user deletes the drug while its file is being processed
+        async with session_factory() as db:
+            for row in (await db.get(IngestionJob, job.id), await db.get(DrugFile, drug_file.id),
+                        await db.get(Drug, drug.id)):
+                await db.delete(row)
+            await db.commit()
+        return _chunks(2), _embeddings(2)
+
+    queue.file_processor = types.SimpleNamespace(process_file=process_file)
+
+    assert await queue.run_job(job.id)
+
+    vector_db.cache.clear()
+    index, metadata = await vector_db._load_user_vector_db(7)
+    assert index.ntotal == len(metadata["chunks"]) == 0
+
+
+@pytest.mark.asyncio
+async def test_sq8_storage_reranks_against_fp16_vectors(vector_db, monkeypatch):
+    monkeypatch.setattr(vector_db_service.settings, "USER_INDEX_VECTOR_STORAGE", "sq8")
+    monkeypatch.setattr(vector_db_service, "SQ8_MIN_VECTORS", 0)
+    embeddings = _embeddings(50)
+    await vector_db.add_document_chunks(7, _chunks(50), embeddings, _DRUG, _FILE)
+
+    async def fake_embedding(text, model=None):
+        return embeddings[5]
+
+    monkeypatch.setattr(vector_db.embedding_service, "generate_embedding", fake_embedding)
+
+    results = await vector_db.search_user_documents(7, "q", top_k=3)
+
+    assert results[0]["content"] == "chunk 1-5"
+    assert results[0]["score"] == pytest.approx(1.0, abs=1e-3)
+    _, metadata = await vector_db._load_user_vector_db(7)
+    assert metadata["sq8_index"] is not None
+    # Segments hold float16 vectors, half the bytes of float32
+    (index_blob,) = [data for name, (data, _) in vector_db.blob_service.blobs.items() if name.endswith(".index")]
+    assert len(index_blob) < 50 * 1536 * 4 * 0.6
+
+
+@pytest.mark.asyncio
+async def test_flat_segments_load_after_switching_to_fp16(vector_db, monkeypatch):
+    await vector_db.add_document_chunks(7, _chunks(3), _embeddings(3), _DRUG, _FILE)
+    monkeypatch.setattr(vector_db_service.settings, "USER_INDEX_VECTOR_STORAGE", "fp16")
+    await vector_db.add_document_chunks(7, _chunks(2, drug_id=2), _embeddings(2, seed=1), {"id": 2, "title": "Drug B"}, _FILE)
+
+    vector_db.cache.invalidate(7)
+    index, metadata = await vector_db._load_user_vector_db(7)
+
+    assert index.ntotal == len(metadata["chunks"]) == 5
+    assert isinstance(faiss.downcast_index(index.index), faiss.IndexScalarQuantizer)
+
+
+@pytest.mark.asyncio
+async def test_vector_db_of_another_dimension_is_refused(vector_db):
+    await vector_db.add_document_chunks(7, _chunks(3), _embeddings(3), _DRUG, _FILE)
+    manifest, _ = await vector_db._read_manifest(7)
+    assert manifest["embedding_dim"] == 1536
+
+    vector_db.embedding_dim = 512
+    vector_db.cache.invalidate(7)
+
+    with pytest.raises(ValueError, match="1536-d"):
+        await vector_db._load_user_vector_db(7)
+    with pytest.raises(ValueError, match="512-d"):
+        await vector_db.add_document_chunks(7, _chunks(1), _embeddings(1), _DRUG, _FILE)
+
+
+@pytest.mark.asyncio
+async def test_reembedding_migration_swaps_model_and_resumes(vector_db, monkeypatch):
+    monkeypatch.setattr(vector_db_service.settings, "EMBEDDING_MODEL", "old-model")
+    await vector_db.add_document_chunks(7, _chunks(5), _embeddings(5), _DRUG, _FILE)
+    assert await vector_db.get_user_embedding_model(7) == "old-model"
+
+    migration = ReembedMigration(vector_db, target_model="new-model", batch_size=2)
+    calls = []
+
+    async def embeddings_batch(texts, model=None):
+        calls.append((model, len(texts)))
+        if len(calls) == 2:
+            return [None] * len(texts)  # outage part-way through the first run
+        return _embeddings(len(texts), seed=len(calls))
+
+    monkeypatch.setattr(migration.embedding_service, "generate_embeddings_batch", embeddings_batch)
+
+    with pytest.raises(RuntimeError):
+        await migration.migrate_user(7)
+    assert len(await vector_db.blob_service.list_blobs(prefix=CHECKPOINT_PREFIX)) == 1
+
+    # Resumes after the checkpointed batch and re-embeds only the remaining three chunks
+    assert await migration.migrate_user(7)
+    assert [n for _, n in calls] == [2, 2, 2, 1]
+    assert {model for model, _ in calls} == {"new-model"}
+    assert await vector_db.blob_service.list_blobs(prefix=CHECKPOINT_PREFIX) == []
+
+    vector_db.cache.invalidate(7)
+    index, metadata = await vector_db._load_user_vector_db(7)
+    assert metadata["embedding_model"] == "new-model"
+    assert index.ntotal == len(metadata["chunks"]) == 5
+
+    # Chunks embedded with the old model can no longer be added
+    with pytest.raises(ValueError, match="new-model"):
+        await vector_db.add_document_chunks(7, _chunks(1), _embeddings(1), _DRUG, _FILE, "old-model")
+
+
+@pytest.mark.asyncio
+async def test_reembedding_migration_changes_the_vector_size(vector_db, monkeypatch):
+    monkeypatch.setattr(vector_db_service.settings, "EMBEDDING_MODEL", "old-model")
+    await vector_db.add_document_chunks(7, _chunks(3), _embeddings(3), _DRUG, _FILE)
+
+    # EMBEDDING_DIMENSIONS drops to 512; the 1536-d DB can no longer be searched, only migrated
+    vector_db.embedding_dim = 512
+    vector_db.cache.invalidate(7)
+    migration = ReembedMigration(vector_db, target_model="new-model", batch_size=2)
+
+    async def embeddings_batch(texts, model=None):
+        return _embeddings(len(texts), dim=512)
+
+    monkeypatch.setattr(migration.embedding_service, "generate_embeddings_batch", embeddings_batch)
+
+    assert await migration.migrate_user(7)
+
+    manifest, _ = await vector_db._read_manifest(7)
+    assert (manifest["embedding_model"], manifest["embedding_dim"]) == ("new-model", 512)
+    vector_db.cache.invalidate(7)
+    index, metadata = await vector_db._load_user_vector_db(7)
+    assert index.d == 512
+    assert index.ntotal == len(metadata["chunks"]) == 3
+    await vector_db.add_document_chunks(7, _chunks(1), _embeddings(1, dim=512), _DRUG, _FILE, "new-model")
+
+
+@pytest.mark.asyncio
+async def test_adopted_legacy_vector_db_is_reembedded(vector_db, monkeypatch):
+    index = faiss.IndexFlatIP(1536)
+    index.add(np.array(_embeddings(2), dtype=np.float32))
+    documents = {str(uuid.uuid4()): {"vector_index": i, "content": f"legacy {i}", "drug_id": 1, "file_id": 10}
+                 for i in range(2)}
+    blobs = vector_db.blob_service.blobs
+    blobs["user-7-drug-vectors.index"] = (vector_db_service.serialize_index(index), "v1")
+    blobs["user-7-drug-metadata.json"] = (json.dumps({"documents": documents}).encode(), "m1")
+
+    manifest, _ = await vector_db._read_manifest(7)
+    assert manifest["embedding_model"] == "text-embedding-ada-002"
+    assert await vector_db.get_user_embedding_model(7) == "text-embedding-ada-002"
+
+    migration = ReembedMigration(vector_db, target_model="text-embedding-3-small", batch_size=2)
+    calls = []
+
+    async def embeddings_batch(texts, model=None):
+        calls.append(model)
+        return _embeddings(len(texts), seed=1)
+
+    monkeypatch.setattr(migration.embedding_service, "generate_embeddings_batch", embeddings_batch)
+
+    assert await migration.migrate_user(7)
+    assert calls == ["text-embedding-3-small"]
+    vector_db.cache.invalidate(7)
+    index, metadata = await vector_db._load_user_vector_db(7)
+    assert metadata["embedding_model"] == "text-embedding-3-small"
+    assert index.ntotal == 2
+
+
+def test_recall_report_covers_every_storage_mode():
+    vectors = np.random.default_rng(0).standard_normal((500, 64)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+
+    report = {row["mode"]: row for row in recall_report(vectors, n_queries=20, k=5)}
+
+    assert set(report) == {"flat", "fp16", "sq8", "sq8+rerank"}
+    assert report["flat"]["recall@5"] == 1.0
+    assert report["fp16"]["recall@5"] >= 0.95
+    assert report["sq8+rerank"]["recall@5"] >= report["sq8"]["recall@5"]
+    assert report["sq8"]["vector_bytes"] * 4 == report["flat"]["vector_bytes"]
+
+
+class _FakeEmbeddingsClient:
+    """Stand-in for AsyncOpenAI that records the size of every embeddings call."""
+
+    def __init__(self):
+        self.calls = []
+        self.embeddings = self
+
+    async def create(self, model, input):
+        self.calls.append(len(input))
+        data = [types.SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+        return types.SimpleNamespace(data=list(reversed(data)))
+
+
+@pytest.mark.asyncio
+async def test_embedding_gateway_batches_concurrent_callers():
+    client = _FakeEmbeddingsClient()
+    gateway = EmbeddingGateway("test-model", max_batch_size=4, max_wait_ms=50, client=client)
+
+    texts = ["a" * n for n in range(1, 11)]
+    results = await asyncio.gather(*[gateway.embed(text) for text in texts])
+
+    assert results == [[float(n)] for n in range(1, 11)]
+    assert client.calls == [4, 4, 2]
+    # Synchronous callers from other threads share the same gateway
+    assert await asyncio.to_thread(gateway.embed_blocking, "abc") == [3.0]
+
+
+@pytest.mark.asyncio
+async def test_embedding_gateway_looks_up_the_cache_once_per_batch_off_the_callers_thread(tmp_path):
+    import threading
+
+    client = _FakeEmbeddingsClient()
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"), max_bytes=1024 * 1024)
+    cache.put_many("test-model", ["cached"], [[42.0]])
+    lookups = []
+    get_many = cache.get_many
+
+    def recording_get_many(model, texts):
+        lookups.append((threading.current_thread(), list(texts)))
+        return get_many(model, texts)
+
+    cache.get_many = recording_get_many
+    gateway = EmbeddingGateway("test-model", max_batch_size=4, max_wait_ms=50, client=client, cache=cache)
+
+    results = await asyncio.gather(*[gateway.embed(text) for text in ("cached", "aa", "bbb")])
+
+    assert results == [[42.0], [2.0], [3.0]]
+    # Only the misses reach the API, and the whole batch was looked up in one call on a worker thread
+    assert client.calls == [2]
+    ((thread, texts),) = lookups
+    assert thread is not threading.current_thread() and sorted(texts) == ["aa", "bbb", "cached"]
+    assert await gateway.embed("aa") == [2.0]
+    assert client.calls == [2]
+
+
+def test_embedding_cache_persists_and_evicts_least_recently_used(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    cache = EmbeddingCache(path, max_bytes=3 * 1536 * 4)
+    vectors = np.random.default_rng(0).random((4, 1536), dtype=np.float32)
+
+    cache.put_many("m", ["a", "b", "c"], vectors[:3])
+    assert np.array_equal(cache.get("m", "a"), vectors[0])
+    assert cache.get("other-model", "a") is None
+
+    # "a" was just used, so "b" is the least recently used when "d" pushes the cache over budget
+    cache.put("m", "d", vectors[3])
+    assert cache.stats()["evictions"] >= 1
+
+    reopened = EmbeddingCache(path, max_bytes=3 * 1536 * 4)
+    assert reopened.get("m", "b") is None
+    assert np.array_equal(reopened.get("m", "d"), vectors[3])
+    assert reopened.stats()["hits"] == 1
+
+
+class _ByteEncoder:
+    """One token per UTF-8 byte, so token counts are easy to reason about."""
+
+    def encode(self, text):
+        return list(text.encode())
+
+    def decode(self, tokens):
+        return bytes(tokens).decode()
+
+
+def test_token_chunker_tracks_pages_sections_and_budget():
+    lines = [
+        {"text": "INTRODUCTION", "page": 1},
+        {"text": "a" * 30, "page": 1},
+        {"text": "b" * 30, "page": 2},
+        {"text": "c" * 100, "page": 2},
+        {"text": "2. Economic Review", "page": 3},
+        {"text": "d" * 10, "page": 3},
+        {"text": "1. Patients must consent.", "page": 3},
+    ]
+    chunks = chunk_lines(lines, _ByteEncoder(), max_tokens=64, overlap=8)
+
+    assert all(chunk["token_count"] <= 64 for chunk in chunks)
+    first, second = chunks[:2]
+    assert (first["page"], first["page_end"], first["section_title"]) == (1, 1, "INTRODUCTION")
+    assert first["text"] == "INTRODUCTION " + "a" * 30 + " "
+    # Overlap tokens are carried over, together with the page they came from
+    assert second["text"].startswith(first["text"][-8:])
+    assert (second["page"], second["page_end"]) == (1, 2)
+    # A heading closes the chunk without overlap, opens the next one and titles what follows;
+    # numbered sentences are body text
+    text = "2. Economic Review " + "d" * 10 + " 1. Patients must consent. "
+    assert chunks[-1] == {"text": text, "page": 3, "page_end": 3, "section_title": "2. Economic Review",
+                          "token_count": len(text), "source": None}
+    assert "".join(chunk["text"] for chunk in chunks).count("c") >= 100
+
+
+def _text_pdf(page_texts):
+    """A PDF with one line of Helvetica text per page; empty strings give pages without text"""
+    from PyPDF2 import PageObject, PdfWriter
+    from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    for text in page_texts:
+        page = PageObject.create_blank_page(None, 612, 792)
+        contents = DecodedStreamObject()
+        contents.set_data(f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode() if text else b"")
+        page[NameObject("/Contents")] = writer._add_object(contents)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})
+        })
+        writer.add_page(page)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_pdf_extraction_splits_pages_and_replaces_a_timed_out_pool(monkeypatch):
+    content = _text_pdf([f"Page {n} text" for n in range(1, 6)] + [""])
+    monkeypatch.setattr(pdf_extraction.settings, "PDF_EXTRACTION_PAGES_PER_TASK", 2)
+
+    # Each part is a standalone PDF holding only its own pages
+    parts = pdf_extraction._split_pages(content, 2)
+    assert [page_numbers for page_numbers, _ in parts] == [[1, 2], [3, 4], [5, 6]]
+    assert pdf_extraction._extract_pages(parts[1][1], parts[1][0]) == [(3, "Page 3 text"), (4, "Page 4 text")]
+
+    try:
+        monkeypatch.setattr(pdf_extraction.settings, "PDF_EXTRACTION_TIMEOUT_SECONDS", 0.0)
+        with pytest.raises(asyncio.TimeoutError):
+            async for _ in pdf_extraction.iter_pdf_pages(content):
+                pass
+        assert pdf_extraction._executor is None
+
+        monkeypatch.setattr(pdf_extraction.settings, "PDF_EXTRACTION_TIMEOUT_SECONDS", 60.0)
+        pages = [page async for page in pdf_extraction.iter_pdf_pages(content)]
+        assert pages == [(n, f"Page {n} text") for n in range(1, 6)]
+    finally:
+        pdf_extraction.shutdown_executor()
+
+
+@pytest.mark.asyncio
+async def test_pdf_pages_are_chunked_and_embedded_as_they_stream(monkeypatch):
+    pages = [(n, "\n".join(f"page {n} line {i} " + "x" * 40 for i in range(20))) for n in range(1, 6)]
+    parsed = []
+
+    async def iter_pdf_pages(content):
+        for page in pages:
+            await asyncio.sleep(0)
+            parsed.append(page[0])
+            yield page
+
+    embedded_after = []
+
+    async def embeddings_batch(texts, model=None):
+        embedded_after.append(len(parsed))
+        return _embeddings(len(texts))
+
+    monkeypatch.setattr(file_processing_service, "iter_pdf_pages", iter_pdf_pages)
+    monkeypatch.setattr(file_processing_service, "get_encoder", lambda model: _ByteEncoder())
+    monkeypatch.setattr(file_processing_service.settings, "CHUNK_MAX_TOKENS", 200)
+    monkeypatch.setattr(file_processing_service.settings, "EMBEDDING_BATCH_MAX_SIZE", 2)
+    service = file_processing_service.FileProcessingService()
+    monkeypatch.setattr(service.embedding_service, "generate_embeddings_batch", embeddings_batch)
+
+    chunks, embeddings = await service.process_file(b"%PDF", "a.pdf", drug_id=1)
+
+    assert all(chunk["token_count"] <= 200 for chunk in chunks)
+    assert [chunk["chunk_index"] for chunk in chunks] == list(range(len(chunks)))
+    assert chunks[0]["page_number"] == 1 and chunks[-1]["page_number"] == 5
+    page_numbers = [chunk["page_number"] for chunk in chunks]
+    assert page_numbers == sorted(page_numbers) and set(page_numbers) == {1, 2, 3, 4, 5}
+    assert len(embeddings) == len(chunks)
+    # The first batch went out before the last page was parsed
+    assert embedded_after[0] < len(pages)